@@ -0,0 +1,226 @@
+import argparse
+import ast
+import json
+import logging
+import os
+import time
+from collections import Counter
+from typing import List, Optional
+import numpy as np
+from semanticsilm.graph_store import CompactGraphStore, csr, expand, load_graph_store
+from semanticsilm.telemetry import traced
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_FNAME = "analytics.json"
+ANALYTICS_VERSION = 1
+ANALYTICS_ARRAYS = ["degree", "pagerank", "community", "one_hop"]
+PAGERANK_DAMPING = 0.85
+PAGERANK_ITERATIONS = 100
+PAGERANK_TOLERANCE = 1e-10
+# Entities (by PageRank) that get a neighbourhood summary
+SUMMARY_ENTITIES = 500
+SUMMARY_NEIGHBOURS = 5
+SUMMARY_RELATIONS = 3
+# Triplet ranking weights: naming a query entity beats sharing its community beats centrality
+FOCUS_WEIGHT = 2.0
+COMMUNITY_WEIGHT = 1.0
+
+
+def pagerank(sources: np.ndarray, targets: np.ndarray, num_nodes: int, damping: float = PAGERANK_DAMPING,
+             iterations: int = PAGERANK_ITERATIONS, tolerance: float = PAGERANK_TOLERANCE) -> np.ndarray:
+    """PageRank by power iteration over the edge arrays.
+
+    Same as networkx.pagerank, except that two relations between the same
+    pair of entities count as two edges. Dangling entities spread their rank
+    evenly over the graph.
+    """
+    if num_nodes == 0:
+        return np.empty(0)
+    out_degree = np.bincount(sources, minlength=num_nodes).astype(np.float64)
+    dangling = out_degree == 0
+    rank = np.full(num_nodes, 1.0 / num_nodes)
+    for _ in range(iterations):
+        share = np.divide(rank, out_degree, out=np.zeros(num_nodes), where=~dangling)
+        spread = np.bincount(targets, weights=share[sources], minlength=num_nodes)
+        updated = damping * (spread + rank[dangling].sum() / num_nodes) + (1 - damping) / num_nodes
+        converged = np.abs(updated - rank).sum() < num_nodes * tolerance
+        rank = updated
+        if converged:
+            break
+    return rank
+
+def undirected_adjacency(sources: np.ndarray, targets: np.ndarray, num_nodes: int):
+    """CSR offsets and neighbours of the graph with directions and duplicate edges dropped."""
+    pairs = np.concatenate([np.stack([sources, targets], axis=1), np.stack([targets, sources], axis=1)])
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    pairs = np.unique(pairs, axis=0) if len(pairs) else pairs.reshape(0, 2)
+    return csr(pairs[:, 0], num_nodes), pairs[:, 1].astype(np.int64)
+
+def community_partition(offsets: np.ndarray, neighbours: np.ndarray, num_nodes: int) -> np.ndarray:
+    import networkx as nx
+    from community import community_louvain
+    g = nx.Graph()
+    g.add_nodes_from(range(num_nodes))
+    g.add_edges_from(zip(np.repeat(np.arange(num_nodes), np.diff(offsets)).tolist(), neighbours.tolist()))
+    partition = community_louvain.best_partition(g, random_state=0)
+    return np.array([partition[node] for node in range(num_nodes)], dtype=np.int32)
+
+def triplet_parts(triplet_text: str):
+    """(subject, relation, object) from a retrieved triplet's text, like "['Melkor', 'corrupted', 'Sauron']"."""
+    try:
+        parts = ast.literal_eval(triplet_text)
+    except (ValueError, SyntaxError):
+        return None
+    if isinstance(parts, (list, tuple)) and len(parts) == 3:
+        return tuple(str(part) for part in parts)
+    return None
+
+class GraphAnalytics:
+    """Centrality, communities and neighbourhood summaries of a linked graph, by entity.
+
+    Computed once per build and stored in the index folder, so queries can
+    rank retrieved triplets without touching the graph library.
+    """
+
+    def __init__(self, names: List[str], degree: np.ndarray, pagerank: np.ndarray, community: np.ndarray,
+                 one_hop: np.ndarray, summaries: list):
+        self.names = names
+        self.ids = {name: i for i, name in enumerate(names)}
+        self.lower_ids = {}
+        for i, name in enumerate(names):
+            self.lower_ids.setdefault(name.lower(), i)
+        self.degree = degree
+        self.pagerank = pagerank
+        self.community = community
+        self.one_hop = one_hop
+        self.summaries = {summary["entity"]: summary for summary in summaries}
+        top = float(pagerank.max()) if len(pagerank) else 0.0
+        self._centrality = pagerank / top if top > 0 else np.zeros(len(pagerank))
+
+    def entity_id(self, name: str) -> Optional[int]:
+        node = self.ids.get(name)
+        return node if node is not None else self.lower_ids.get(name.strip().lower())
+
+    def partition(self) -> dict:
+        """Community by entity name, in the shape visualize's renderers take."""
+        return dict(zip(self.names, self.community.tolist()))
+
+    def describe(self, name: str) -> Optional[str]:
+        node = self.entity_id(name)
+        summary = self.summaries.get(self.names[node]) if node is not None else None
+        if summary is None:
+            return None
+        return (f"{summary['entity']}: {summary['degree']} relationships with {summary['one_hop']} entities "
+                f"({summary['two_hop']} within two hops), community {summary['community']}; "
+                f"most central neighbours: {', '.join(summary['neighbours']) or 'none'}; "
+                f"most common relations: {', '.join(summary['relations']) or 'none'}")
+
+    def rank_triplets(self, triplet_texts: List[str], focus: List[str], limit: int = None) -> List[str]:
+        """triplet_texts best first, cut to limit.
+
+        A triplet scores for naming a focus entity, for touching a focus
+        entity's community and for the PageRank of its most central entity.
+        Ties keep their retrieval order.
+        """
+        focus_ids = {node for node in (self.entity_id(name) for name in focus) if node is not None}
+        focus_communities = {int(self.community[node]) for node in focus_ids}
+        scores = []
+        for text in triplet_texts:
+            parts = triplet_parts(text)
+            nodes = [self.entity_id(parts[0]), self.entity_id(parts[2])] if parts else []
+            nodes = [node for node in nodes if node is not None]
+            score = 0.0
+            if nodes:
+                score += FOCUS_WEIGHT * any(node in focus_ids for node in nodes)
+                score += COMMUNITY_WEIGHT * any(int(self.community[node]) in focus_communities for node in nodes)
+                score += max(float(self._centrality[node]) for node in nodes)
+            scores.append(score)
+        order = sorted(range(len(triplet_texts)), key=lambda i: -scores[i])
+        return [triplet_texts[i] for i in order[:limit]]
+
+    def save(self, persist_dir: str):
+        os.makedirs(persist_dir, exist_ok=True)
+        for name in ANALYTICS_ARRAYS:
+            np.save(os.path.join(persist_dir, f"analytics_{name}.npy"), getattr(self, name))
+        # Written last: its presence marks a complete set of arrays
+        with open(os.path.join(persist_dir, ANALYTICS_FNAME), 'w', encoding='utf-8') as file:
+            json.dump({
+                "version": ANALYTICS_VERSION,
+                "nodes": self.names,
+                "communities": len(np.unique(self.community)),
+                "summaries": list(self.summaries.values()),
+            }, file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, persist_dir: str) -> "GraphAnalytics":
+        with open(os.path.join(persist_dir, ANALYTICS_FNAME), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        arrays = {name: np.load(os.path.join(persist_dir, f"analytics_{name}.npy"), mmap_mode="r")
+                  for name in ANALYTICS_ARRAYS}
+        return cls(meta["nodes"], summaries=meta["summaries"], **arrays)
+
+@traced("analytics")
+def compute_analytics(graph_store) -> GraphAnalytics:
+    """Degree, PageRank, Louvain communities and 1- and 2-hop summaries of the hubs."""
+    if not isinstance(graph_store, CompactGraphStore):
+        graph_store = CompactGraphStore.from_graph_store(graph_store)
+    names = graph_store.node_names()
+    relation_names = graph_store.relation_names()
+    num_nodes = len(names)
+    sources, rels, targets = (np.asarray(array, dtype=np.int64) for array in graph_store.edges())
+
+    degree = (np.bincount(sources, minlength=num_nodes) + np.bincount(targets, minlength=num_nodes)).astype(np.int32)
+    rank = pagerank(sources, targets, num_nodes)
+    offsets, neighbours = undirected_adjacency(sources, targets, num_nodes)
+    one_hop = np.diff(offsets).astype(np.int32)
+    community = community_partition(offsets, neighbours, num_nodes)
+
+    # Edges by target, to count each hub's incoming relations without a scan per hub
+    in_order = np.argsort(targets, kind="stable")
+    out_offsets, in_offsets = csr(sources, num_nodes), csr(targets, num_nodes)
+    summaries = []
+    for node in np.argsort(-rank, kind="stable")[:SUMMARY_ENTITIES].tolist():
+        first_hop = neighbours[offsets[node]:offsets[node + 1]]
+        reached = np.unique(expand(offsets, neighbours, first_hop)) if len(first_hop) else first_hop
+        second_hop = np.setdiff1d(reached, np.append(first_hop, node))
+        central = first_hop[np.argsort(-rank[first_hop], kind="stable")[:SUMMARY_NEIGHBOURS]]
+        node_rels = np.concatenate([rels[out_offsets[node]:out_offsets[node + 1]],
+                                    rels[in_order[in_offsets[node]:in_offsets[node + 1]]]])
+        summaries.append({
+            "entity": names[node],
+            "community": int(community[node]),
+            "degree": int(degree[node]),
+            "pagerank": float(rank[node]),
+            "one_hop": int(one_hop[node]),
+            "two_hop": int(len(second_hop)),
+            "neighbours": [names[neighbour] for neighbour in central.tolist()],
+            "relations": [relation_names[rel] for rel, _ in
+                          Counter(node_rels.tolist()).most_common(SUMMARY_RELATIONS)],
+        })
+    analytics = GraphAnalytics(list(names), degree, rank, community, one_hop, summaries)
+    logger.info(f"Graph analytics: {num_nodes} entities, {len(np.unique(community))} communities, "
+                f"{len(summaries)} summaries")
+    return analytics
+
+def load_analytics(persist_dir: str) -> Optional[GraphAnalytics]:
+    if not os.path.exists(os.path.join(persist_dir, ANALYTICS_FNAME)):
+        logger.info(f"No graph analytics in {persist_dir}, retrieved triplets are not ranked "
+                    f"(run analytics.py on the folder to add them)")
+        return None
+    return GraphAnalytics.load(persist_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute graph analytics for existing index folders")
+    parser.add_argument("persist_dirs", nargs="+")
+    args = parser.parse_args()
+    for persist_dir in args.persist_dirs:
+        start = time.perf_counter()
+        analytics = compute_analytics(load_graph_store(persist_dir))
+        analytics.save(persist_dir)
+        print(f"Computed analytics for {persist_dir} in {time.perf_counter() - start:.2f}s")
+        for summary in sorted(analytics.summaries.values(), key=lambda item: -item["pagerank"])[:5]:
+            print(f"  {analytics.describe(summary['entity'])}")
+
+if __name__ == "__main__":
+    main()
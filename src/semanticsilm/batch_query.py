@@ -0,0 +1,246 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.schema import QueryBundle
+from semanticsilm.analytics import load_analytics
+from semanticsilm.main import DEFAULT_RESPONSE_MODE, RESPONSE_MODES, configure_settings, latest_index_folder
+from semanticsilm.persistence import load_index
+from semanticsilm.query_cache import DEFAULT_SIMILARITY_THRESHOLD, QueryCache
+from semanticsilm.retrieval import build_query_engine
+from semanticsilm.telemetry import count, span, tracer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+# Answers per response mode kept for QueryRunner.latency_report
+LATENCY_HISTORY = 10_000
+# Stands for "the runner's own setting" where None already means "no limit"
+_RUNNER_DEFAULT = object()
+
+
+class QueryRunner:
+    """One loaded index folder and its query engines, safe to query from several threads.
+
+    There is an engine per response mode, context token limit and streaming
+    setting, built on first use. Answers are only cached for the default mode
+    without a context limit or a ranked_triplets override, the configuration
+    the cache was filled with.
+    """
+
+    def __init__(self, index_folder: str, use_cache: bool = True, index=None, mode: str = DEFAULT_RESPONSE_MODE,
+                 max_context_tokens: int = None, similarity_threshold: float = None, **engine_kwargs):
+        self.index_folder = index_folder
+        self.mode = mode
+        self.max_context_tokens = max_context_tokens
+        self.similarity_threshold = similarity_threshold or DEFAULT_SIMILARITY_THRESHOLD
+        self.engine_kwargs = engine_kwargs
+        start = time.perf_counter()
+        # An index that was just built is reused rather than read back from disk
+        self.index = index if index is not None else load_index(index_folder)
+        self.analytics = load_analytics(index_folder)
+        self._engines = {}
+        self._engines_lock = threading.Lock()
+        self.query_engine = self.engine(mode, max_context_tokens)
+        self.query_cache = (QueryCache(index_folder, embed_model=Settings.embed_model,
+                                       similarity_threshold=self.similarity_threshold) if use_cache else None)
+        # (first token ms or None, total ms) of every answer, by response mode
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_HISTORY))
+        self.load_seconds = time.perf_counter() - start
+        logger.info(f"Loaded {index_folder} in {self.load_seconds:.2f}s")
+
+    def engine(self, mode: str, max_context_tokens: int = None, streaming: bool = False):
+        key = (mode, max_context_tokens, streaming)
+        with self._engines_lock:
+            if key not in self._engines:
+                shared = {}
+                if self._engines:
+                    # Every engine scores the same triplet embeddings, so they share one matrix
+                    shared["triplet_embeddings"] = next(iter(self._engines.values())).retriever.triplet_embeddings
+                self._engines[key] = build_query_engine(
+                    self.index, analytics=self.analytics, max_context_tokens=max_context_tokens, streaming=streaming,
+                    **shared, **{**RESPONSE_MODES[mode], **self.engine_kwargs},
+                )
+            return self._engines[key]
+
+    def answer(self, query: str, mode: str = None, max_context_tokens=_RUNNER_DEFAULT, similarity_threshold: float = None,
+               on_token=None) -> dict:
+        """Answers query, streaming the answer's text to on_token as it arrives if given.
+
+        mode, max_context_tokens and similarity_threshold default to the runner's;
+        max_context_tokens=None lifts the limit.
+        """
+        mode = mode or self.mode
+        similarity_threshold = similarity_threshold or self.similarity_threshold
+        if max_context_tokens is _RUNNER_DEFAULT:
+            max_context_tokens = self.max_context_tokens
+        if mode not in RESPONSE_MODES:
+            raise ValueError(f"Unknown response mode {mode!r}, expected one of {', '.join(RESPONSE_MODES)}")
+        use_cache = (self.query_cache is not None and mode == DEFAULT_RESPONSE_MODE and max_context_tokens is None
+                     and self.engine_kwargs.get("ranked_triplets") is None)
+        start = time.perf_counter()
+        first_token = None
+        with span("query", mode=mode) as query_span:
+            response, query_embedding = None, None
+            if use_cache:
+                response, query_embedding = self.query_cache.lookup(query, similarity_threshold)
+            query_span.set(cached=response is not None)
+            cached = response is not None
+            if cached:
+                first_token = time.perf_counter()
+                if on_token is not None:
+                    on_token(response)
+            else:
+                engine = self.engine(mode, max_context_tokens, streaming=on_token is not None)
+                with span("query.engine"):
+                    result = engine.query(QueryBundle(query, embedding=query_embedding))
+                    if on_token is None:
+                        response = str(result)
+                    else:
+                        parts = []
+                        # An empty retrieval answers with a plain, already finished response
+                        for token in getattr(result, "response_gen", None) or [str(result)]:
+                            if first_token is None:
+                                first_token = time.perf_counter()
+                            parts.append(token)
+                            on_token(token)
+                        response = "".join(parts)
+                if use_cache:
+                    self.query_cache.put(query, response, query_embedding)
+            ttft_ms = (first_token - start) * 1000 if first_token is not None else None
+            latency_ms = (time.perf_counter() - start) * 1000
+            query_span.set(ttft_ms=ttft_ms)
+        count("query.cache_hits" if cached else "query.cache_misses")
+        self.latencies[mode].append((ttft_ms, latency_ms))
+        return {"response": response, "cached": cached, "mode": mode, "ttft_ms": ttft_ms, "latency_ms": latency_ms}
+
+    def latency_report(self) -> str:
+        """First-token and total latency percentiles for each response mode used so far."""
+        lines = []
+        for mode, latencies in self.latencies.items():
+            ttfts = [ttft for ttft, _ in latencies if ttft is not None]
+            totals = np.asarray([total for _, total in latencies])
+            line = f"{mode}: {len(totals)} answers, total p50 {np.percentile(totals, 50):.0f} ms, " \
+                   f"p95 {np.percentile(totals, 95):.0f} ms"
+            if ttfts:
+                line += f"; first token p50 {np.percentile(ttfts, 50):.0f} ms, p95 {np.percentile(ttfts, 95):.0f} ms"
+            lines.append(line)
+        return "\n".join(lines) if lines else "No queries answered yet"
+
+def read_queries(file):
+    """(id, query) pairs from plain lines or JSONL objects with "query" and an optional "id"."""
+    for line_number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            record = json.loads(line)
+            yield record.get("id", line_number), record["query"]
+        else:
+            yield line_number, line
+
+def latency_summary(latencies_ms, wall_seconds: float, errors: int, ttfts_ms=()) -> str:
+    if not latencies_ms:
+        return f"0 queries answered, {errors} errors"
+    latencies = np.asarray(latencies_ms)
+    p50, p95 = np.percentile(latencies, [50, 95])
+    summary = (f"{len(latencies)} queries answered, {errors} errors in {wall_seconds:.1f}s "
+               f"({len(latencies) / wall_seconds:.2f} queries/s); latency p50 {p50:.0f} ms, "
+               f"p95 {p95:.0f} ms, max {latencies.max():.0f} ms")
+    if len(ttfts_ms):
+        ttft_p50, ttft_p95 = np.percentile(np.asarray(ttfts_ms), [50, 95])
+        summary += f"; first token p50 {ttft_p50:.0f} ms, p95 {ttft_p95:.0f} ms"
+    return summary
+
+def run_batch(runner: QueryRunner, queries, output, workers: int = DEFAULT_WORKERS, stream: bool = False) -> str:
+    """Answers queries concurrently and writes one JSON line per answer as soon as it is ready.
+
+    With stream set the answers are generated token by token, which only
+    changes the reported time to first token, not the output.
+    """
+    latencies = []
+    ttfts = []
+    errors = 0
+    write_lock = threading.Lock()
+    start = time.perf_counter()
+
+    def run(query_id, query):
+        try:
+            result = runner.answer(query, on_token=(lambda token: None) if stream else None)
+        except Exception as error:
+            logger.exception(f"Query {query_id} failed")
+            result = {"error": repr(error)}
+        return {"id": query_id, "query": query, **result}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query") as executor:
+        futures = [executor.submit(run, query_id, query) for query_id, query in queries]
+        for future in as_completed(futures):
+            result = future.result()
+            if "error" in result:
+                errors += 1
+            else:
+                latencies.append(result["latency_ms"])
+                if stream and result["ttft_ms"] is not None:
+                    ttfts.append(result["ttft_ms"])
+            with write_lock:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+    return latency_summary(latencies, time.perf_counter() - start, errors, ttfts)
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of queries against one index folder")
+    parser.add_argument("index_folder", nargs="?", default=None, help="index folder (default: the newest)")
+    parser.add_argument("--queries", default="-", help="one query per line, or JSONL with id/query (default: stdin)")
+    parser.add_argument("--output", default="-", help="JSONL results file (default: stdout)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="queries answered at once")
+    parser.add_argument("--use-cache", action="store_true", help="answer repeated queries from query_cache.json")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_SIMILARITY_THRESHOLD,
+                        help=f"cosine similarity at which a cached query's answer is reused (default: "
+                             f"{DEFAULT_SIMILARITY_THRESHOLD})")
+    parser.add_argument("--mode", choices=list(RESPONSE_MODES), default=DEFAULT_RESPONSE_MODE,
+                        help="response mode, from the slowest and most thorough to the cheapest")
+    parser.add_argument("--context-tokens", type=int, default=None, help="limit on retrieved context tokens")
+    parser.add_argument("--stream", action="store_true", help="stream answers and report time to first token")
+    parser.add_argument("--ranked-triplets", type=int, default=None,
+                        help="triplets kept after graph ranking (default: max_knowledge_sequence, 30)")
+    args = parser.parse_args()
+    if args.context_tokens is not None and args.context_tokens < 1:
+        parser.error("--context-tokens must be at least 1")
+    if args.ranked_triplets is not None and args.ranked_triplets < 1:
+        parser.error("--ranked-triplets must be at least 1")
+    if not 0 < args.similarity_threshold <= 1:
+        parser.error("--similarity-threshold must be above 0 and at most 1")
+
+    index_folder = args.index_folder or latest_index_folder()
+    if index_folder is None or not os.path.isdir(index_folder):
+        parser.error("no index folder found, build one with main.py first")
+
+    configure_settings()
+    runner = QueryRunner(index_folder, use_cache=args.use_cache, mode=args.mode,
+                         max_context_tokens=args.context_tokens, similarity_threshold=args.similarity_threshold,
+                         ranked_triplets=args.ranked_triplets)
+    queries_file = sys.stdin if args.queries == "-" else open(args.queries, 'r', encoding='utf-8')
+    output = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    try:
+        summary = run_batch(runner, read_queries(queries_file), output, workers=args.workers,
+                            stream=args.stream)
+    finally:
+        if runner.query_cache is not None:
+            runner.query_cache.flush()
+        if queries_file is not sys.stdin:
+            queries_file.close()
+        if output is not sys.stdout:
+            output.close()
+    # Results may be on stdout, so the summaries go to stderr
+    print(summary, file=sys.stderr)
+    print(tracer.summary(), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict
+from datetime import datetime
+import networkx as nx
+from llama_index.core import Document, Settings, SimpleDirectoryReader
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.graph_stores.types import GraphStore
+from llama_index.core.llms import CompletionResponse
+from llama_index.core.schema import MetadataMode
+from semanticsilm import visualize
+from semanticsilm.analytics import compute_analytics
+from semanticsilm.cache import ExtractionCache, cache_key
+from semanticsilm.graph_store import CompactGraphStore, graph_items
+from semanticsilm.layout import compute_layout
+from semanticsilm.fake_llm import FakeLLM, synthetic_response
+from semanticsilm.main import (
+    DATA_DIR, EXTRACTION_BATCH_SIZE, IMPORTANT_ENTITIES, IMPORTANT_RELATIONSHIPS, build_extraction_prompt,
+    create_silmarillion_kg, inspect_graph_structure, parse_response_to_triplets, silmarillion_entity_linking,
+)
+from semanticsilm.retrieval import TripletEmbeddings
+from semanticsilm.stats import BuildStats
+
+BENCH_DIR = "../../bench"
+
+SYLLABLES = ["an", "bel", "cel", "dor", "el", "fin", "gal", "hur", "il", "lor", "mel", "nar", "or",
+             "quen", "rim", "sil", "tur", "ul", "val", "wen"]
+
+
+def measure(records: dict, name: str, fn, *args, **kwargs):
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    record = {"seconds": time.perf_counter() - start}
+    if tracemalloc.is_tracing():
+        record["peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    # ru_maxrss is the process high-water mark in KB on Linux
+    record["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    records[name] = record
+    return result
+
+def use_fake_models(latency: float, embed_dim: int, recorded_cache: str = None, recorded_model: str = None):
+    def synthetic(prompt):
+        return synthetic_response(prompt, IMPORTANT_ENTITIES, IMPORTANT_RELATIONSHIPS)
+
+    def recorded(prompt):
+        entry = cache.get(cache_key(recorded_model, prompt))
+        if entry is not None:
+            return entry["response"]
+        return synthetic(prompt)
+
+    cache = ExtractionCache(recorded_cache) if recorded_cache else None
+    respond = recorded if recorded_cache else synthetic
+    Settings.llm = FakeLLM(latency=latency, respond=respond)
+    Settings.embed_model = MockEmbedding(embed_dim=embed_dim)
+    Settings.chunk_size = 1024
+
+def scale_documents(documents, factor: int):
+    if factor == 1:
+        return list(documents)
+    scaled = []
+    for copy in range(factor):
+        for doc in documents:
+            # A distinct file_path keeps every copy's chunks distinct, so
+            # nothing is deduplicated away during extraction.
+            file_path = f"{doc.metadata.get('file_path', doc.doc_id)}#copy{copy}"
+            scaled.append(Document(
+                text=doc.text,
+                id_=f"{doc.doc_id}#copy{copy}",
+                metadata={**doc.metadata, "file_path": file_path},
+                excluded_llm_metadata_keys=list(doc.excluded_llm_metadata_keys),
+                excluded_embed_metadata_keys=list(doc.excluded_embed_metadata_keys),
+            ))
+    return scaled
+
+def graph_to_networkx(graph_store: GraphStore):
+    g = nx.DiGraph()
+    for subject, relations in graph_items(graph_store):
+        for relation, object in relations:
+            g.add_edge(subject, object, relationship=relation)
+    return g
+
+def bench_visualizers(records: dict, g, max_render_nodes: int):
+    if g.number_of_nodes() > max_render_nodes:
+        records["visualize"] = {"skipped": f"{g.number_of_nodes()} nodes > {max_render_nodes}"}
+        return
+    # Layouts are cached on disk, so use a fresh cache to time the real computation
+    with tempfile.TemporaryDirectory() as layout_dir:
+        pos = measure(records, "layout", compute_layout, g, cache_dir=layout_dir)
+    partition = measure(records, "communities", visualize.community_partition, g)
+    with tempfile.TemporaryDirectory() as output_dir:
+        renderers = [
+            ("visualize_networkx", visualize.visualize_networkx, "graph.png"),
+            ("visualize_plotly", visualize.visualize_plotly, "graph_plotly.html"),
+            ("create_interactive_graph", visualize.create_interactive_graph, "graph_interactive.html"),
+        ]
+        for name, render, filename in renderers:
+            output_file = os.path.join(output_dir, filename)
+            kwargs = {"partition": partition} if render is not visualize.visualize_networkx else {}
+            measure(records, name, render, g, output_file=output_file, pos=pos, **kwargs)
+            records[name]["output_mb"] = os.path.getsize(output_file) / (1024 * 1024)
+
+def bench_corpus(documents, factor: int, args):
+    records = {}
+    docs = scale_documents(documents, factor)
+    stats = BuildStats()
+    index = measure(records, "build", create_silmarillion_kg, docs, stats=stats, concurrency=args.concurrency,
+                    prefilter=not args.no_prefilter, batch_size=args.batch_size)
+    records["build"]["stages"] = {name: asdict(stage) for name, stage in stats.stages.items()}
+
+    responses = []
+    for node in index.docstore.docs.values():
+        prompt = build_extraction_prompt(node.get_content(metadata_mode=MetadataMode.LLM))
+        responses.append(CompletionResponse(text=Settings.llm.respond(prompt)))
+    measure(records, "parse_response_to_triplets", lambda: [parse_response_to_triplets(r) for r in responses])
+
+    triplet_embeddings = measure(records, "triplet_embeddings", TripletEmbeddings, index.index_struct.embedding_dict)
+    query_embedding = Settings.embed_model.get_text_embedding("Who is Melkor?")
+    measure(records, "embedding_search", triplet_embeddings.search, query_embedding, 10)
+
+    g = index.get_networkx_graph(limit=index.graph_store.num_edges())
+    bench_visualizers(records, g, args.max_render_nodes)
+    return {"documents": len(docs), "chunks": len(index.docstore.docs), "records": records}
+
+def synthetic_names(count: int, rng: random.Random):
+    names = []
+    seen = set()
+    while len(names) < count:
+        if names and rng.random() < 0.05:
+            # Near-duplicate spellings give entity linking something to merge
+            base = list(rng.choice(names))
+            base[rng.randrange(len(base))] = rng.choice("aeiou")
+            name = "".join(base)
+        else:
+            name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+def synthetic_graph_store(num_nodes: int, edges_per_node: int = 3, seed: int = 0) -> CompactGraphStore:
+    rng = random.Random(seed)
+    names = synthetic_names(num_nodes, rng)
+    graph_store = CompactGraphStore()
+    # Preferential attachment gives the hub-heavy degree distribution the real graph has
+    targets = names[:edges_per_node]
+    for subj in names:
+        for _ in range(edges_per_node):
+            obj = rng.choice(targets)
+            if obj != subj:
+                graph_store.upsert_triplet(subj, rng.choice(IMPORTANT_RELATIONSHIPS), obj)
+                targets.append(obj)
+        targets.append(subj)
+    return graph_store
+
+def bench_graph(num_nodes: int, args):
+    records = {}
+    graph_store = measure(records, "generate", synthetic_graph_store, num_nodes)
+    measure(records, "inspect_graph_structure", inspect_graph_structure, graph_store)
+    subjects = graph_store.subjects()
+    subjs = random.Random(0).sample(subjects, min(100, len(subjects)))
+    measure(records, "get_rel_map", graph_store.get_rel_map, subjs=subjs, depth=2, limit=30)
+    linked_graph_store = measure(records, "silmarillion_entity_linking", silmarillion_entity_linking, graph_store)
+    measure(records, "graph_analytics", compute_analytics, linked_graph_store)
+    g = measure(records, "to_networkx", graph_to_networkx, linked_graph_store)
+    bench_visualizers(records, g, args.max_render_nodes)
+    return {"nodes": g.number_of_nodes(), "edges": g.number_of_edges(), "records": records}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten_seconds(results: dict, prefix: str = ""):
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten_seconds(value, path))
+        elif key == "seconds":
+            flat[prefix] = value
+    return flat
+
+def compare(old_results: dict, new_results: dict):
+    old = flatten_seconds(old_results)
+    new = flatten_seconds(new_results)
+    print(f"{'stage':<70} {'old':>9} {'new':>9} {'ratio':>7}")
+    for path in sorted(set(old) & set(new)):
+        ratio = new[path] / old[path] if old[path] else float("inf")
+        print(f"{path:<70} {old[path]:>9.3f} {new[path]:>9.3f} {ratio:>7.2f}")
+
+def parse_sizes(value: str):
+    return [int(part) for part in value.split(",") if part]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the build pipeline offline with a fake LLM")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--scales", type=parse_sizes, default=[1, 10, 100], help="corpus multipliers")
+    parser.add_argument("--graph-nodes", type=parse_sizes, default=[10_000, 100_000], help="synthetic graph sizes")
+    parser.add_argument("--max-render-nodes", type=int, default=20_000, help="skip visualizers above this")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of fake LLM latency per call")
+    parser.add_argument("--embed-dim", type=int, default=256)
+    parser.add_argument("--recorded-cache", default=None, help="replay real responses from this extraction cache")
+    parser.add_argument("--recorded-model", default="gpt-4o-mini")
+    parser.add_argument("--batch-size", type=int, default=EXTRACTION_BATCH_SIZE,
+                        help="chunks per extraction request (1 to replay a cache of single-chunk prompts)")
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="send whole chunks, e.g. to replay a cache recorded before pre-extraction")
+    parser.add_argument("--memory", action="store_true", help="track per-stage peak memory with tracemalloc")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    if args.memory:
+        tracemalloc.start()
+    use_fake_models(args.latency, args.embed_dim, args.recorded_cache, args.recorded_model)
+
+    documents = SimpleDirectoryReader(args.data_dir, recursive=True, filename_as_id=True).load_data()
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "corpus": {},
+        "graph": {},
+    }
+    for factor in args.scales:
+        print(f"Benchmarking corpus x{factor}...")
+        results["corpus"][f"x{factor}"] = bench_corpus(documents, factor, args)
+    for num_nodes in args.graph_nodes:
+        print(f"Benchmarking synthetic graph with {num_nodes} nodes...")
+        results["graph"][str(num_nodes)] = bench_graph(num_nodes, args)
+
+    output_file = args.output or os.path.join(
+        BENCH_DIR, f"{datetime.now().strftime('%m_%d_%Y_%H_%M')}_{results['commit'] or 'nogit'}.json"
+    )
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f"Benchmark results saved to {output_file}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            compare(json.load(file), results)
+
+if __name__ == "__main__":
+    main()
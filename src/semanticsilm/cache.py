@@ -0,0 +1,111 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "../../cache"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def cache_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+class ExtractionCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        # Touch on read so eviction drops the least recently used entries first
+        os.utime(path)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, model: str, response_text: str, triplets):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            "model": model,
+            "response": response_text,
+            "triplets": [list(triplet) for triplet in triplets],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(entry, file, ensure_ascii=False)
+        # An entry written again for the same key replaces the old one rather than adding to it
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        self._size += os.path.getsize(path) - replaced
+        if self._size > self.max_bytes:
+            # Leave some headroom so a full cache is not rescanned on every write
+            self.prune(int(self.max_bytes * 0.9))
+
+    def prune(self, max_bytes: int = None) -> int:
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        self._size = total
+        if removed:
+            logger.info(f"Evicted {removed} cache entries, {total} bytes remaining")
+        return removed
+
+    def clear(self) -> int:
+        return self.prune(max_bytes=0)
+
+    def size(self) -> int:
+        return self._size
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the triplet extraction cache")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--max-mb", type=float, default=None, help="prune down to this many megabytes")
+    parser.add_argument("--clear", action="store_true", help="remove every cached response")
+    args = parser.parse_args()
+
+    cache = ExtractionCache(args.cache_dir)
+    if args.clear:
+        removed = cache.clear()
+    elif args.max_mb is not None:
+        removed = cache.prune(int(args.max_mb * 1024 * 1024))
+    else:
+        removed = 0
+    print(f"Removed {removed} entries, cache size is now {cache.size() / (1024 * 1024):.1f} MB")
+
+if __name__ == "__main__":
+    main()
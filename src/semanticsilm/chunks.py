@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+from llama_index.core import Document, SimpleDirectoryReader
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode, TextNode
+from semanticsilm.manifest import chunk_hash
+
+logger = logging.getLogger(__name__)
+
+# Hidden, so SimpleDirectoryReader never loads it as a document
+CHUNK_MANIFEST_FNAME = ".chunks.json"
+CHUNK_MANIFEST_VERSION = 1
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 200
+
+
+def stable_chunk_id(i: int, doc) -> str:
+    return f"{doc.doc_id}#chunk{i}"
+
+def node_parser() -> SentenceSplitter:
+    # Settings.node_parser's defaults for chunk_size 1024, but with ids that survive a rebuild
+    return SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, id_func=stable_chunk_id)
+
+def data_files(data_dir: str):
+    """The files SimpleDirectoryReader would load from data_dir, in the order it loads them."""
+    return [str(path) for path in SimpleDirectoryReader(data_dir, recursive=True).input_files]
+
+def file_stat(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def reader_path(path: str) -> str:
+    """path the way SimpleDirectoryReader(data_dir, recursive=True) names it: joined to the cwd, not normalized.
+
+    The name ends up in the doc id and in the file_path metadata the chunk
+    text (and so every chunk hash) includes, so preprocessed and freshly read
+    documents have to agree on it.
+    """
+    from fsspec.implementations.local import make_path_posix
+    return make_path_posix(path)
+
+def chunk_file(path: str) -> dict:
+    documents = SimpleDirectoryReader(input_files=[reader_path(path)], filename_as_id=True).load_data()
+    nodes = node_parser().get_nodes_from_documents(documents)
+    return {
+        "path": os.path.abspath(path),
+        **file_stat(path),
+        "documents": [{"hash": doc.hash, "document": doc.to_dict()} for doc in documents],
+        "chunks": [
+            {"id": node.node_id, "hash": chunk_hash(node.get_content(metadata_mode=MetadataMode.LLM)),
+             "node": node.to_dict()}
+            for node in nodes
+        ],
+    }
+
+def save_chunk_manifest(entries, data_dir: str):
+    manifest = {
+        "version": CHUNK_MANIFEST_VERSION,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "files": entries,
+    }
+    path = os.path.join(data_dir, CHUNK_MANIFEST_FNAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def load_chunk_manifest(data_dir: str, chunk_size: int = CHUNK_SIZE):
+    """Documents and chunk nodes from preprocess.py's manifest, or None if it is missing or stale.
+
+    Stale means any file under data_dir was added, removed or touched since
+    the manifest was written; only the files are stat-ed, none are read.
+    """
+    path = os.path.join(data_dir, CHUNK_MANIFEST_FNAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+    if manifest.get("version") != CHUNK_MANIFEST_VERSION or manifest.get("chunk_size") != chunk_size:
+        return None
+
+    entries = {entry["path"]: entry for entry in manifest["files"]}
+    files = [os.path.abspath(file_path) for file_path in data_files(data_dir)]
+    if set(files) != set(entries):
+        logger.info(f"Files under {data_dir} changed since preprocessing, ignoring {path}")
+        return None
+    documents = []
+    nodes = []
+    for file_path in files:
+        entry = entries[file_path]
+        if file_stat(file_path) != {"size": entry["size"], "mtime_ns": entry["mtime_ns"]}:
+            logger.info(f"{file_path} changed since preprocessing, ignoring {path}")
+            return None
+        documents.extend(Document.from_dict(doc["document"]) for doc in entry["documents"])
+        nodes.extend(TextNode.from_dict(chunk["node"]) for chunk in entry["chunks"])
+    return documents, nodes
@@ -0,0 +1,62 @@
+from collections.abc import MutableMapping
+import numpy as np
+
+
+class EmbeddingMatrix(MutableMapping):
+    """Triplet-text -> embedding mapping backed by one float32 matrix.
+
+    Stands in for KG.embedding_dict. Rows of the base matrix (which may be a
+    read-only memory map) are handed out as views; embeddings added later
+    live in a small overlay until the next to_matrix().
+    """
+
+    def __init__(self, keys=(), matrix: np.ndarray = None):
+        self._keys = list(keys)
+        self._rows = {key: row for row, key in enumerate(self._keys)}
+        self._matrix = matrix if matrix is not None else np.empty((0, 0), dtype=np.float32)
+        self._extra = {}
+
+    @classmethod
+    def from_dict(cls, embedding_dict) -> "EmbeddingMatrix":
+        if isinstance(embedding_dict, EmbeddingMatrix):
+            return embedding_dict
+        keys = list(embedding_dict)
+        if not keys:
+            return cls()
+        return cls(keys, np.asarray([embedding_dict[key] for key in keys], dtype=np.float32))
+
+    def __getitem__(self, key):
+        if key in self._extra:
+            return self._extra[key]
+        return self._matrix[self._rows[key]]
+
+    def __setitem__(self, key, value):
+        self._rows.pop(key, None)
+        self._extra[key] = np.asarray(value, dtype=np.float32)
+
+    def __delitem__(self, key):
+        if key in self._extra:
+            del self._extra[key]
+        else:
+            del self._rows[key]
+
+    def __iter__(self):
+        yield from self._rows
+        yield from self._extra
+
+    def __len__(self):
+        return len(self._rows) + len(self._extra)
+
+    def to_matrix(self):
+        """All keys and their embeddings as one contiguous float32 matrix."""
+        keys = list(self)
+        unchanged = not self._extra and len(self._rows) == len(self._keys)
+        if unchanged:
+            return keys, self._matrix
+        rows = np.fromiter(self._rows.values(), dtype=np.int64, count=len(self._rows))
+        parts = [self._matrix[rows]] if len(rows) else []
+        if self._extra:
+            parts.append(np.vstack(list(self._extra.values())))
+        if not parts:
+            return keys, np.empty((0, 0), dtype=np.float32)
+        return keys, np.ascontiguousarray(np.vstack(parts), dtype=np.float32)
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import random
+import time
+import openai
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = (asyncio.TimeoutError, ConnectionError, openai.APIConnectionError, openai.APITimeoutError)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self, amount: float = 1):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        # Waiters queue on the lock, so requests are admitted in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, tokens: int = 0):
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None and tokens:
+            await self.tokens.acquire(tokens)
+
+def is_retryable(error: Exception) -> bool:
+    if getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES:
+        return True
+    return isinstance(error, RETRYABLE_ERRORS)
+
+def retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    # "Full jitter": spreads retries out so concurrent workers don't hit the API in lockstep
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+async def acomplete_with_retry(llm, prompt: str, limiter: RateLimiter = None, tokens: int = 0,
+                               max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0):
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.acquire(tokens)
+        try:
+            return await llm.acomplete(prompt)
+        except Exception as error:
+            if attempt == max_retries or not is_retryable(error):
+                raise
+            delay = retry_after(error) or backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"LLM call failed ({error!r}), retrying in {delay:.2f}s "
+                           f"(attempt {attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+
+async def gather_in_order(items, fn, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item):
+        async with semaphore:
+            return await fn(item)
+
+    # gather returns results in the order of its arguments, whatever order they finish in
+    return await asyncio.gather(*(run(item) for item in items))
+
+def as_triplet(item):
+    """A (subject, relation, object) tuple from a JSON triplet, or None if it isn't one."""
+    if isinstance(item, dict):
+        item = [item.get("subject"), item.get("relation"), item.get("object")]
+    if not isinstance(item, list) or len(item) != 3:
+        return None
+    if not all(isinstance(part, (str, int, float)) for part in item):
+        return None
+    triplet = tuple(str(part).strip() for part in item)
+    return triplet if all(triplet) else None
+
+class TripletStreamParser:
+    """Incremental parser for {"chunk id": [[subject, relation, object], ...], ...}.
+
+    Text can be fed as it streams in, and each complete triplet is returned
+    as soon as its closing bracket arrives. Anything around the object (code
+    fences, prose) is skipped. A truncated or malformed answer keeps every
+    triplet before the damage; closed holds the chunk ids whose list was
+    read to the end with at least one usable triplet (or nothing in it), so
+    the rest can be retried.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.state = "start"
+        self.key = None
+        self.items = 0
+        self.results = {}
+        self.closed = set()
+        self._decoder = json.JSONDecoder()
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    @property
+    def found_object(self) -> bool:
+        """Whether the text had a JSON object at all, rather than, say, the old line format."""
+        return self.state != "start"
+
+    def feed(self, text: str):
+        self.buffer += text
+        found = []
+        while not self.done:
+            step = self._step()
+            if step is None:
+                break
+            if isinstance(step, tuple):
+                found.append(step)
+        return found
+
+    def _skip(self, chars: str):
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in chars:
+            self.pos += 1
+
+    def _decode(self):
+        try:
+            value, self.pos = self._decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            # Most likely cut off mid-value; wait for more text
+            return None, False
+        return value, True
+
+    def _step(self):
+        """Advances one token: True on progress, (key, triplet) for a triplet, None for more input."""
+        self._skip(" \t\r\n," if self.state in ("key", "item") else " \t\r\n")
+        if self.pos >= len(self.buffer):
+            return None
+        char = self.buffer[self.pos]
+        if self.state == "start":
+            start = self.buffer.find("{", self.pos)
+            self.pos = len(self.buffer) if start == -1 else start + 1
+            if start != -1:
+                self.state = "key"
+            return True
+        if self.state == "key":
+            if char == "}":
+                self.pos += 1
+                self.state = "done"
+                return True
+            if char != '"':
+                self.pos += 1
+                return True
+            key, ok = self._decode()
+            if not ok:
+                return None
+            self.key = str(key)
+            self.results.setdefault(self.key, [])
+            self.state = "colon"
+            return True
+        if self.state == "colon":
+            if char == ":":
+                self.pos += 1
+            self.state = "list"
+            return True
+        if self.state == "list":
+            if char == "[":
+                self.pos += 1
+                self.state = "item"
+                self.items = 0
+                return True
+            # Not a list (null, a string...): skip the value
+            _, ok = self._decode()
+            if not ok:
+                return None
+            self.state = "key"
+            return True
+        if char == "]":
+            self.pos += 1
+            # A list of nothing but malformed items is no answer, so the chunk is retried
+            if self.items == 0 or self.results[self.key]:
+                self.closed.add(self.key)
+            self.state = "key"
+            return True
+        item, ok = self._decode()
+        if not ok:
+            return None
+        self.items += 1
+        triplet = as_triplet(item)
+        if triplet is None:
+            logger.debug(f"Skipping malformed triplet for {self.key}: {item!r}")
+            return True
+        self.results[self.key].append(triplet)
+        return self.key, triplet
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Any, Callable, Optional
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+DEFAULT_RESPONSE = """1. (Melkor, corrupted, Arda)
+2. (Fëanor, crafted, Silmarils)
+3. (Morgoth, fought against, Valar)"""
+
+
+def prompt_text(prompt: str) -> str:
+    start = prompt.find("Text:")
+    end = prompt.rfind("Relationships:")
+    if start == -1 or end <= start:
+        return prompt
+    return prompt[start + len("Text:"):end]
+
+def batch_texts(prompt: str) -> dict:
+    """Chunk id -> text for a batched extraction prompt, empty for a single-chunk one."""
+    sections = re.split(r"^Chunk (\S+)\n", prompt, flags=re.MULTILINE)
+    texts = {}
+    for chunk_id, section in zip(sections[1::2], sections[2::2]):
+        start = section.find("Text:")
+        text = section[start + len("Text:"):] if start != -1 else section
+        texts[chunk_id] = re.sub(r"\s*JSON:\s*$", "", text)
+    return texts
+
+def synthetic_triplets(text: str, entities, relationships, limit: int = 25):
+    # Deterministic stand-in for an extraction answer: pair up the known
+    # entities mentioned in the chunk, choosing relationships by hash.
+    found = sorted((text.find(entity), entity) for entity in entities if entity in text)
+    mentioned = [entity for _, entity in found]
+    triplets = []
+    for subj, obj in zip(mentioned, mentioned[1:] + mentioned[:1]):
+        if len(triplets) >= limit or subj == obj:
+            break
+        digest = hashlib.sha256(f"{subj}|{obj}|{text[:64]}".encode("utf-8")).digest()
+        triplets.append((subj, relationships[digest[0] % len(relationships)], obj))
+    return triplets
+
+def synthetic_response(prompt: str, entities, relationships, limit: int = 25) -> str:
+    texts = batch_texts(prompt)
+    if texts:
+        return json.dumps({
+            chunk_id: [list(triplet) for triplet in synthetic_triplets(text, entities, relationships, limit)]
+            for chunk_id, text in texts.items()
+        }, ensure_ascii=False)
+    triplets = synthetic_triplets(prompt_text(prompt), entities, relationships, limit)
+    return "\n".join(f"{i + 1}. ({subj}, {rel}, {obj})" for i, (subj, rel, obj) in enumerate(triplets))
+
+class FakeLLMError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"fake LLM error {status_code}")
+        self.status_code = status_code
+
+class FakeLLM(CustomLLM):
+    """Offline stand-in for the OpenAI LLM with configurable latency and failures."""
+
+    latency: float = 0.0
+    # Delay between streamed words, so time to first token differs from total time
+    token_latency: float = 0.0
+    error_rate: float = 0.0
+    error_status_codes: tuple = (429, 500, 503)
+    seed: int = 0
+    model_name: str = "fake"
+    respond: Optional[Callable[[str], str]] = None
+    calls: int = 0
+
+    _rng: random.Random = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.model_name)
+
+    def _response(self, prompt: str) -> CompletionResponse:
+        self.calls += 1
+        if self._rng.random() < self.error_rate:
+            raise FakeLLMError(self._rng.choice(self.error_status_codes))
+        text = self.respond(prompt) if self.respond is not None else DEFAULT_RESPONSE
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self.latency)
+        return self._response(prompt)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self.latency)
+        return self._response(prompt)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        time.sleep(self.latency)
+        response = self._response(prompt)
+
+        def gen():
+            text = ""
+            for word in re.findall(r"\S+\s*|\s+", response.text) or [""]:
+                if text:
+                    time.sleep(self.token_latency)
+                text += word
+                yield CompletionResponse(text=text, delta=word)
+
+        return gen()
@@ -0,0 +1,336 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+import fsspec
+import numpy as np
+from llama_index.core.graph_stores import SimpleGraphStore
+from llama_index.core.graph_stores.types import DEFAULT_PERSIST_FNAME, GraphStore
+
+logger = logging.getLogger(__name__)
+
+COMPACT_FORMAT = "compact"
+COMPACT_VERSION = 1
+GRAPH_NAMES_FNAME = "graph_names.json"
+GRAPH_ARRAYS = ["offsets", "targets", "rels", "in_offsets", "in_sources", "in_rels"]
+# SimpleGraphStore recurses below the first hop with its default limit, not the caller's
+NESTED_REL_MAP_LIMIT = 30
+# Upserts are buffered and merged into the arrays in batches
+MAX_PENDING_EDGES = 100_000
+
+
+def csr(sources: np.ndarray, num_nodes: int) -> np.ndarray:
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_nodes), out=offsets[1:])
+    return offsets
+
+def expand(offsets: np.ndarray, values: np.ndarray, frontier: np.ndarray) -> np.ndarray:
+    starts = offsets[frontier]
+    counts = offsets[frontier + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=values.dtype)
+    # Positions of every edge of every frontier node, without a Python loop
+    shift = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return values[shift + np.arange(total)]
+
+class CompactGraphStore(GraphStore):
+    """Graph store over interned ids and CSR adjacency arrays.
+
+    Drop-in for SimpleGraphStore: get and get_rel_map return the same shapes
+    and ordering, but edges live in flat int arrays (plus a reverse index for
+    incoming edges) instead of a dict of nested lists. Duplicate triplets are
+    stored once.
+    """
+
+    def __init__(self, fs: Optional[fsspec.AbstractFileSystem] = None):
+        self._fs = fs or fsspec.filesystem("file")
+        self._node_ids: Dict[str, int] = {}
+        self._node_names: List[str] = []
+        self._rel_ids: Dict[str, int] = {}
+        self._rel_names: List[str] = []
+        # Subjects in first-upsert order, which is SimpleGraphStore's key order
+        self._subjects: Dict[int, None] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._targets = np.empty(0, dtype=np.int32)
+        self._rels = np.empty(0, dtype=np.int32)
+        self._in_offsets = np.zeros(1, dtype=np.int64)
+        self._in_sources = np.empty(0, dtype=np.int32)
+        self._in_rels = np.empty(0, dtype=np.int32)
+        self._pending = []
+
+    @property
+    def client(self) -> None:
+        return
+
+    def _intern(self, ids: Dict[str, int], names: List[str], name: str) -> int:
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    def _set_edges(self, sources, rels, targets):
+        num_nodes = len(self._node_names)
+        order = np.argsort(sources, kind="stable")
+        self._offsets = csr(sources, num_nodes)
+        self._targets = targets[order].astype(np.int32)
+        self._rels = rels[order].astype(np.int32)
+        in_order = np.argsort(targets, kind="stable")
+        self._in_offsets = csr(targets, num_nodes)
+        self._in_sources = sources[in_order].astype(np.int32)
+        self._in_rels = rels[in_order].astype(np.int32)
+
+    def _edge_sources(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self._offsets) - 1, dtype=np.int64), np.diff(self._offsets))
+
+    def _compact(self):
+        if not self._pending:
+            # New nodes may still need empty adjacency rows
+            if len(self._offsets) - 1 < len(self._node_names):
+                self._set_edges(self._edge_sources(), self._rels.astype(np.int64), self._targets.astype(np.int64))
+            return
+        pending = np.array(self._pending, dtype=np.int64).reshape(-1, 3)
+        self._pending = []
+        sources = np.concatenate([self._edge_sources(), pending[:, 0]])
+        rels = np.concatenate([self._rels.astype(np.int64), pending[:, 1]])
+        targets = np.concatenate([self._targets.astype(np.int64), pending[:, 2]])
+        # Existing edges come first and pending edges keep insertion order,
+        # so the stable sort preserves each subject's edge order
+        num_nodes = max(len(self._node_names), 1)
+        keys = (sources * max(len(self._rel_names), 1) + rels) * num_nodes + targets
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+        self._set_edges(sources[first], rels[first], targets[first])
+
+    def upsert_triplet(self, subj: str, rel: str, obj: str) -> None:
+        subj_id = self._intern(self._node_ids, self._node_names, subj)
+        self._subjects.setdefault(subj_id)
+        self._pending.append((
+            subj_id,
+            self._intern(self._rel_ids, self._rel_names, rel),
+            self._intern(self._node_ids, self._node_names, obj),
+        ))
+        if len(self._pending) >= MAX_PENDING_EDGES:
+            self._compact()
+
+    def delete(self, subj: str, rel: str, obj: str) -> None:
+        if subj not in self._node_ids or obj not in self._node_ids or rel not in self._rel_ids:
+            return
+        self._compact()
+        node = self._node_ids[subj]
+        start, end = self._offsets[node], self._offsets[node + 1]
+        match = np.flatnonzero((self._targets[start:end] == self._node_ids[obj]) &
+                               (self._rels[start:end] == self._rel_ids[rel]))
+        if len(match) == 0:
+            return
+        keep = np.ones(len(self._targets), dtype=bool)
+        keep[start + match] = False
+        sources = self._edge_sources()[keep]
+        self._set_edges(sources, self._rels[keep].astype(np.int64), self._targets[keep].astype(np.int64))
+        if self._offsets[node] == self._offsets[node + 1]:
+            del self._subjects[node]
+
+    def get(self, subj: str) -> List[List[str]]:
+        if subj not in self._node_ids:
+            return []
+        self._compact()
+        node = self._node_ids[subj]
+        start, end = self._offsets[node], self._offsets[node + 1]
+        return [[self._rel_names[rel], self._node_names[obj]]
+                for rel, obj in zip(self._rels[start:end].tolist(), self._targets[start:end].tolist())]
+
+    def get_incoming(self, obj: str) -> List[List[str]]:
+        if obj not in self._node_ids:
+            return []
+        self._compact()
+        node = self._node_ids[obj]
+        start, end = self._in_offsets[node], self._in_offsets[node + 1]
+        return [[self._node_names[subj], self._rel_names[rel]]
+                for subj, rel in zip(self._in_sources[start:end].tolist(), self._in_rels[start:end].tolist())]
+
+    def _walk(self, node: int, depth: int, limit: int, out: list, budget: int):
+        if depth == 0:
+            return
+        start = self._offsets[node]
+        end = min(self._offsets[node + 1], start + limit)
+        for rel, obj in zip(self._rels[start:end].tolist(), self._targets[start:end].tolist()):
+            if len(out) >= budget:
+                return
+            out.append((node, rel, obj))
+            self._walk(obj, depth - 1, NESTED_REL_MAP_LIMIT, out, budget)
+
+    def get_rel_map(
+        self, subjs: Optional[List[str]] = None, depth: int = 2, limit: int = 30
+    ) -> Dict[str, List[List[str]]]:
+        self._compact()
+        # A repeated subject is one rel_map key, so it must only be charged to the budget once
+        subjs = list(dict.fromkeys(subjs)) if subjs is not None else self.subjects()
+        # Same result as SimpleGraphStoreData.get_rel_map, which builds every
+        # subject's full depth-first map and then truncates to `limit` rows
+        # overall; walking stops as soon as the truncation point is known.
+        rel_map = {}
+        rel_count = 0
+        for subj in subjs:
+            rows = []
+            if subj in self._node_ids:
+                # One row past the budget tells us whether this subject overflows
+                self._walk(self._node_ids[subj], depth, limit, rows, limit - rel_count + 1)
+            if rel_count + len(rows) > limit:
+                rel_map[subj] = self._rows_to_names(rows[: limit - rel_count])
+                break
+            rel_map[subj] = self._rows_to_names(rows)
+            rel_count += len(rows)
+        return rel_map
+
+    def _rows_to_names(self, rows) -> List[List[str]]:
+        return [[self._node_names[subj], self._rel_names[rel], self._node_names[obj]] for subj, rel, obj in rows]
+
+    def neighborhood(self, subjs: List[str], depth: int = 2, direction: str = "out") -> List[str]:
+        """Entities reachable from subjs within depth hops, following edges out, in, or both ways."""
+        self._compact()
+        num_nodes = len(self._node_names)
+        visited = np.zeros(num_nodes, dtype=bool)
+        frontier = np.array(sorted({self._node_ids[subj] for subj in subjs if subj in self._node_ids}), dtype=np.int64)
+        visited[frontier] = True
+        for _ in range(depth):
+            if len(frontier) == 0:
+                break
+            reached = []
+            if direction in ("out", "both"):
+                reached.append(expand(self._offsets, self._targets, frontier))
+            if direction in ("in", "both"):
+                reached.append(expand(self._in_offsets, self._in_sources, frontier))
+            reached = np.unique(np.concatenate(reached)).astype(np.int64)
+            frontier = reached[~visited[reached]]
+            visited[frontier] = True
+        return [self._node_names[node] for node in np.flatnonzero(visited).tolist()]
+
+    def edges(self):
+        """(sources, rels, targets) id arrays of every edge, grouped by source."""
+        self._compact()
+        return self._edge_sources(), self._rels, self._targets
+
+    def node_names(self) -> List[str]:
+        return self._node_names
+
+    def relation_names(self) -> List[str]:
+        return self._rel_names
+
+    def subjects(self) -> List[str]:
+        return [self._node_names[node] for node in self._subjects]
+
+    def items(self):
+        for subj in self.subjects():
+            yield subj, self.get(subj)
+
+    def num_nodes(self) -> int:
+        return len(self._node_names)
+
+    def num_edges(self) -> int:
+        self._compact()
+        return len(self._targets)
+
+    def get_schema(self, refresh: bool = False) -> str:
+        raise NotImplementedError("CompactGraphStore does not support get_schema")
+
+    def query(self, query: str, param_map: Optional[Dict[str, Any]] = {}) -> Any:
+        raise NotImplementedError("CompactGraphStore does not support query")
+
+    def to_dict(self) -> dict:
+        self._compact()
+        return {
+            "format": COMPACT_FORMAT,
+            "version": COMPACT_VERSION,
+            "nodes": self._node_names,
+            "relations": self._rel_names,
+            "subjects": list(self._subjects),
+            "offsets": self._offsets.tolist(),
+            "targets": self._targets.tolist(),
+            "rels": self._rels.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, save_dict: dict) -> "CompactGraphStore":
+        store = cls()
+        store._node_names = list(save_dict["nodes"])
+        store._node_ids = {name: i for i, name in enumerate(store._node_names)}
+        store._rel_names = list(save_dict["relations"])
+        store._rel_ids = {name: i for i, name in enumerate(store._rel_names)}
+        store._subjects = dict.fromkeys(save_dict["subjects"])
+        offsets = np.array(save_dict["offsets"], dtype=np.int64)
+        sources = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+        store._set_edges(sources, np.array(save_dict["rels"], dtype=np.int64),
+                         np.array(save_dict["targets"], dtype=np.int64))
+        return store
+
+    def save_arrays(self, persist_dir: str):
+        self._compact()
+        os.makedirs(persist_dir, exist_ok=True)
+        for name in GRAPH_ARRAYS:
+            np.save(os.path.join(persist_dir, f"graph_{name}.npy"), getattr(self, f"_{name}"))
+        # Written last: its presence marks a complete set of arrays
+        with open(os.path.join(persist_dir, GRAPH_NAMES_FNAME), 'w', encoding='utf-8') as file:
+            json.dump({
+                "format": COMPACT_FORMAT,
+                "version": COMPACT_VERSION,
+                "nodes": self._node_names,
+                "relations": self._rel_names,
+                "subjects": list(self._subjects),
+            }, file, ensure_ascii=False)
+
+    @classmethod
+    def from_arrays_dir(cls, persist_dir: str, mmap: bool = True) -> "CompactGraphStore":
+        with open(os.path.join(persist_dir, GRAPH_NAMES_FNAME), 'r', encoding='utf-8') as file:
+            names = json.load(file)
+        store = cls()
+        store._node_names = names["nodes"]
+        store._node_ids = {name: i for i, name in enumerate(store._node_names)}
+        store._rel_names = names["relations"]
+        store._rel_ids = {name: i for i, name in enumerate(store._rel_names)}
+        store._subjects = dict.fromkeys(names["subjects"])
+        # Memory-mapped arrays are read-only; any mutation builds fresh arrays
+        for name in GRAPH_ARRAYS:
+            array = np.load(os.path.join(persist_dir, f"graph_{name}.npy"), mmap_mode="r" if mmap else None)
+            setattr(store, f"_{name}", array)
+        return store
+
+    @classmethod
+    def from_graph_store(cls, graph_store: GraphStore) -> "CompactGraphStore":
+        store = cls()
+        for subj, relations in graph_items(graph_store):
+            for rel, obj in relations:
+                store.upsert_triplet(subj, rel, obj)
+        store._compact()
+        return store
+
+    def persist(
+        self,
+        persist_path: str = os.path.join("./storage", DEFAULT_PERSIST_FNAME),
+        fs: Optional[fsspec.AbstractFileSystem] = None,
+    ) -> None:
+        fs = fs or self._fs
+        dirpath = os.path.dirname(persist_path)
+        if not fs.exists(dirpath):
+            fs.makedirs(dirpath)
+        with fs.open(persist_path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+def graph_items(graph_store: GraphStore):
+    if isinstance(graph_store, CompactGraphStore):
+        return graph_store.items()
+    return graph_store._data.graph_dict.items()
+
+def load_graph_store(persist_dir: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> GraphStore:
+    if os.path.exists(os.path.join(persist_dir, GRAPH_NAMES_FNAME)):
+        return CompactGraphStore.from_arrays_dir(persist_dir)
+    # Index folders from before CompactGraphStore hold SimpleGraphStore JSON
+    fs = fs or fsspec.filesystem("file")
+    persist_path = os.path.join(persist_dir, DEFAULT_PERSIST_FNAME)
+    if not fs.exists(persist_path):
+        logger.warning(f"No graph store found at {persist_path}. Starting from an empty graph.")
+        return CompactGraphStore(fs=fs)
+    with fs.open(persist_path, "rb") as f:
+        data = json.load(f)
+    if data.get("format") == COMPACT_FORMAT:
+        return CompactGraphStore.from_dict(data)
+    return SimpleGraphStore.from_dict(data)
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import threading
+import time
+from semanticsilm.manifest import chunk_hash
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FNAME = "build_journal.jsonl"
+
+
+def is_unfinished_build(persist_dir: str) -> bool:
+    # The journal is removed once the index folder is complete
+    return os.path.exists(os.path.join(persist_dir, JOURNAL_FNAME))
+
+class BuildJournal:
+    """Append-only log of a build's progress, kept in the index folder it builds.
+
+    Each chunk's triplets are appended (and synced) as soon as they are
+    extracted, so a build that dies on chunk N can be resumed without paying
+    for the first N - 1 again. A torn last line from a crash is ignored.
+    """
+
+    def __init__(self, persist_dir: str):
+        self.persist_dir = persist_dir
+        self.path = os.path.join(persist_dir, JOURNAL_FNAME)
+        self.settings = None
+        self.resumes = 0
+        self._chunks = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
+            lines = file.readlines()
+        if lines and not lines[-1].endswith("\n"):
+            # End the torn line so the next record starts on a line of its own
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write("\n")
+        for line_number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring unreadable line {line_number} of {self.path}")
+                continue
+            if record["type"] == "start":
+                self.settings = record["settings"]
+            elif record["type"] == "resume":
+                self.resumes += 1
+            elif record["type"] == "chunk":
+                self._chunks[record["hash"]] = [tuple(triplet) for triplet in record["triplets"]]
+
+    def _append(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+
+    @property
+    def started(self) -> bool:
+        return self.settings is not None
+
+    def begin(self, **settings):
+        """Starts the journal, or notes another attempt at the build it already holds."""
+        os.makedirs(self.persist_dir, exist_ok=True)
+        if self.started:
+            self.resumes += 1
+            self._append({"type": "resume", "time": time.time(), "completed": len(self._chunks)})
+            return
+        self.settings = settings
+        self._append({"type": "start", "time": time.time(), "settings": settings})
+
+    def record(self, text: str, triplets):
+        key = chunk_hash(text)
+        triplets = [tuple(triplet) for triplet in triplets]
+        self._chunks[key] = triplets
+        self._append({"type": "chunk", "hash": key, "triplets": [list(triplet) for triplet in triplets]})
+
+    def get(self, text: str):
+        """The chunk's journaled triplets, or None if it hasn't been extracted yet."""
+        return self._chunks.get(chunk_hash(text))
+
+    def __contains__(self, text: str) -> bool:
+        return chunk_hash(text) in self._chunks
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def finish(self):
+        """Drops the journal once everything it protected is saved in the index folder."""
+        os.remove(self.path)
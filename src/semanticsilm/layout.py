@@ -0,0 +1,174 @@
+import hashlib
+import logging
+import os
+import time
+from functools import lru_cache
+import networkx as nx
+import numpy as np
+from scipy.fft import irfft2, next_fast_len, rfft2
+from scipy.spatial import cKDTree
+from semanticsilm.telemetry import traced
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_CACHE_DIR = "../../cache/layouts"
+LAYOUT_VERSION = 1
+# Below this nx.spring_layout is fast enough and gives the pictures we had before
+SPRING_LAYOUT_MAX_NODES = 500
+COARSEST_NODES = 50
+COARSEST_ITERATIONS = 200
+REFINE_ITERATIONS = 30
+GRID_CELLS = 256
+
+
+def graph_hash(g: nx.Graph) -> str:
+    digest = hashlib.sha256(f"layout-v{LAYOUT_VERSION}".encode("utf-8"))
+    for node in sorted(map(str, g.nodes())):
+        digest.update(node.encode("utf-8") + b"\0")
+    digest.update(b"\1")
+    for u, v in sorted(tuple(sorted((str(u), str(v)))) for u, v in g.edges()):
+        digest.update(f"{u}\0{v}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+def edge_array(g: nx.Graph, index: dict) -> np.ndarray:
+    edges = {tuple(sorted((index[u], index[v]))) for u, v in g.edges() if u != v}
+    return np.array(sorted(edges), dtype=np.int64).reshape(-1, 2)
+
+def coarsen(num_nodes: int, edges: np.ndarray, rng: np.random.Generator):
+    """Groups every node with at least one neighbour; returns each node's group and the group count.
+
+    A plain matching barely shrinks hub-heavy graphs (a star only matches one
+    leaf), so nodes left unmatched join the group of a matched neighbour.
+    """
+    group = np.full(num_nodes, -1, dtype=np.int64)
+    groups = 0
+    for u, v in edges[rng.permutation(len(edges))]:
+        if group[u] < 0 and group[v] < 0:
+            group[u] = group[v] = groups
+            groups += 1
+    for u, v in edges:
+        if group[u] < 0 and group[v] >= 0:
+            group[u] = group[v]
+        elif group[v] < 0 and group[u] >= 0:
+            group[v] = group[u]
+    unmatched = group < 0
+    group[unmatched] = np.arange(groups, groups + int(unmatched.sum()))
+    return group, groups + int(unmatched.sum())
+
+@lru_cache(maxsize=8)
+def repulsion_kernel(cells: int):
+    """FFTs of the x and y repulsion kernels for a cells x cells grid with unit spacing."""
+    offsets = np.arange(-(cells - 1), cells, dtype=np.float64)
+    dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+    distance2 = dx * dx + dy * dy
+    distance2[cells - 1, cells - 1] = np.inf
+    shape = (next_fast_len(3 * cells - 2, real=True),) * 2
+    return shape, rfft2(dx / distance2, shape), rfft2(dy / distance2, shape)
+
+def grid_repulsion(pos: np.ndarray, weights: np.ndarray, cells: int):
+    """Approximate all-pairs k^2/d repulsion by spreading node weight over a grid.
+
+    The force field is the grid density convolved (by FFT) with the
+    repulsion kernel, so each call costs O(n + cells^2 log cells) instead of
+    O(n^2). Returns the forces and the cell size.
+    """
+    low = pos.min(axis=0)
+    cell = max(float((pos.max(axis=0) - low).max()) / (cells - 1), 1e-9)
+    ij = np.minimum(((pos - low) / cell).astype(np.int64), cells - 1)
+    flat = ij[:, 0] * cells + ij[:, 1]
+    density = np.bincount(flat, weights, minlength=cells * cells).reshape(cells, cells)
+    shape, kernel_x, kernel_y = repulsion_kernel(cells)
+    density_fft = rfft2(density, shape)
+    # The kernel is 1/d, so a grid with spacing cell scales it by 1/cell
+    window = (slice(cells - 1, 2 * cells - 1),) * 2
+    field_x = irfft2(density_fft * kernel_x, shape)[window].ravel() / cell
+    field_y = irfft2(density_fft * kernel_y, shape)[window].ravel() / cell
+    return np.column_stack([field_x[flat], field_y[flat]]) * weights[:, None], cell
+
+def force_directed(pos: np.ndarray, edges: np.ndarray, weights: np.ndarray, iterations: int) -> np.ndarray:
+    """Fruchterman-Reingold with natural length 1 and grid-approximated repulsion."""
+    num_nodes = len(pos)
+    cells = int(np.clip(2 * np.sqrt(num_nodes), 16, GRID_CELLS))
+    temperature = max(1.0, np.sqrt(num_nodes) / 4)
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        displacement, cell = grid_repulsion(pos, weights, cells)
+        # Exact repulsion for near neighbours, which the grid lumps into one cell
+        pairs = cKDTree(pos).query_pairs(min(cell, 1.0), output_type="ndarray")
+        if len(pairs):
+            delta = pos[pairs[:, 0]] - pos[pairs[:, 1]]
+            distance2 = np.maximum(np.einsum("ij,ij->i", delta, delta), 1e-4)
+            force = delta * (weights[pairs[:, 0]] * weights[pairs[:, 1]] / distance2)[:, None]
+            for axis in range(2):
+                displacement[:, axis] += np.bincount(pairs[:, 0], force[:, axis], minlength=num_nodes)
+                displacement[:, axis] -= np.bincount(pairs[:, 1], force[:, axis], minlength=num_nodes)
+        if len(edges):
+            delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+            # d^2 / k along the unit vector
+            force = delta * np.sqrt(np.einsum("ij,ij->i", delta, delta))[:, None]
+            for axis in range(2):
+                displacement[:, axis] -= np.bincount(edges[:, 0], force[:, axis], minlength=num_nodes)
+                displacement[:, axis] += np.bincount(edges[:, 1], force[:, axis], minlength=num_nodes)
+        length = np.maximum(np.linalg.norm(displacement, axis=1), 1e-9)
+        pos = pos + displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+    return pos
+
+def multilevel_layout(g: nx.Graph, seed: int = 0) -> np.ndarray:
+    """Positions for g's nodes, in g.nodes() order, from a multilevel force layout."""
+    rng = np.random.default_rng(seed)
+    index = {node: i for i, node in enumerate(g.nodes())}
+    levels = [(len(index), edge_array(g, index), np.ones(len(index)))]
+    groups = []
+    while levels[-1][0] > COARSEST_NODES:
+        num_nodes, edges, weights = levels[-1]
+        group, num_groups = coarsen(num_nodes, edges, rng)
+        if num_groups > 0.9 * num_nodes:
+            break
+        coarse_edges = np.unique(np.sort(group[edges], axis=1), axis=0) if len(edges) else edges
+        coarse_edges = coarse_edges[coarse_edges[:, 0] != coarse_edges[:, 1]]
+        groups.append(group)
+        levels.append((num_groups, coarse_edges, np.bincount(group, weights, minlength=num_groups)))
+
+    num_nodes, edges, weights = levels[-1]
+    pos = rng.uniform(-1, 1, (num_nodes, 2)) * np.sqrt(num_nodes)
+    pos = force_directed(pos, edges, np.sqrt(weights), COARSEST_ITERATIONS)
+    for level in range(len(groups) - 1, -1, -1):
+        num_nodes, edges, weights = levels[level]
+        coarse_nodes = levels[level + 1][0]
+        # Spread the coarse layout so the finer graph gets room for its extra nodes
+        pos = pos[groups[level]] * np.sqrt(num_nodes / coarse_nodes) + rng.normal(0, 0.1, (num_nodes, 2))
+        pos = force_directed(pos, edges, np.sqrt(weights), REFINE_ITERATIONS)
+    return pos
+
+def rescale(pos: np.ndarray) -> np.ndarray:
+    pos = pos - pos.mean(axis=0)
+    extent = np.abs(pos).max() if len(pos) else 0
+    return pos / extent if extent > 0 else pos
+
+@traced("layout")
+def compute_layout(g: nx.Graph, cache_dir: str = LAYOUT_CACHE_DIR, seed: int = 0) -> dict:
+    """Node -> (x, y) in [-1, 1], computed once per distinct graph and cached on disk."""
+    nodes = list(g.nodes())
+    path = os.path.join(cache_dir, f"{graph_hash(g)}.npz") if cache_dir else None
+    if path and os.path.exists(path):
+        cached = np.load(path)
+        cached_pos = dict(zip(cached["nodes"].tolist(), cached["pos"]))
+        if all(str(node) in cached_pos for node in nodes):
+            logger.info(f"Loaded layout for {len(nodes)} nodes from {path}")
+            return {node: cached_pos[str(node)] for node in nodes}
+
+    start = time.perf_counter()
+    if len(nodes) <= SPRING_LAYOUT_MAX_NODES:
+        spring_pos = nx.spring_layout(g, k=0.5, iterations=50, seed=seed)
+        pos = np.array([spring_pos[node] for node in nodes]).reshape(-1, 2)
+    else:
+        pos = rescale(multilevel_layout(g, seed))
+    logger.info(f"Computed layout for {len(nodes)} nodes in {time.perf_counter() - start:.2f}s")
+
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, nodes=np.array([str(node) for node in nodes]), pos=pos)
+        os.replace(tmp_path, path)
+    return dict(zip(nodes, pos))
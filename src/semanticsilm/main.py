@@ -1,25 +1,73 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
 import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from llama_index.core import SimpleDirectoryReader, KnowledgeGraphIndex, StorageContext
-from llama_index.core.graph_stores import SimpleGraphStore
-from llama_index.core.storage.index_store import SimpleIndexStore
-from llama_index.llms.openai import OpenAI
-from llama_index.llms.openai.utils import CompletionResponse
-from llama_index.core import Settings
-from llama_index.core import load_index_from_storage
-from thefuzz import fuzz
+from typing import TYPE_CHECKING
 import logging
 import re
-from semanticsilm import visualize
+from semanticsilm.cache import ExtractionCache, cache_key
+from semanticsilm.journal import BuildJournal, is_unfinished_build
+from semanticsilm.manifest import (
+    MANIFEST_FNAME, build_manifest, changed_documents, chunk_entry, chunk_hash, load_manifest, manifest_triplets,
+    new_manifest, save_manifest,
+)
+from semanticsilm.resolver import EntityResolver, preprocess_entity
+from semanticsilm.stats import BuildStats, count_tokens
+from semanticsilm.telemetry import configure_logging, count, span, trace_path, traced, tracer
+
+# llama_index, OpenAI, spaCy and the plotting stack take seconds to import, so
+# they are imported where they are used: loading a saved index to query it
+# never pays for the build pipeline, and the REPL prompt shows before any of it.
+if TYPE_CHECKING:
+    from llama_index.core import KnowledgeGraphIndex, StorageContext
+    from llama_index.core.graph_stores.types import GraphStore
+    from llama_index.core.llms import CompletionResponse
+    from semanticsilm.extraction import RateLimiter
+    from semanticsilm.graph_store import CompactGraphStore
+
+# When the module started importing, for the startup profile
+IMPORT_STARTED = time.perf_counter()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# Prompts, responses, triplets and link decisions are logged at DEBUG, off unless SEMANTICSILM_VERBOSE=1
+configure_logging(__name__, "semanticsilm")
 
 INDEX_DIR = "../../index"
 DATA_DIR = "../../data"
 SOURCE_DIR = "../../source"
 OUTPUT_DIR = "../../output"
 
+# Defaults sized for gpt-4o-mini on a tier 1 OpenAI account
+EXTRACTION_CONCURRENCY = 8
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
+EXPECTED_COMPLETION_TOKENS = 512
+# Chunks packed into one extraction request (1 sends each chunk on its own),
+# capped so a batch's prompt stays well inside the context window
+EXTRACTION_BATCH_SIZE = 4
+MAX_BATCH_PROMPT_TOKENS = 8000
+# Send the LLM only the sentences that name an entity, found locally with spaCy
+PREFILTER = True
+
+# Query engine settings for each response mode, slowest and most thorough first
+RESPONSE_MODES = {
+    # A summary of every retrieved chunk, then summaries of those: several LLM calls in a row
+    "tree": {"include_text": True, "response_mode": "tree_summarize"},
+    # Chunks packed into as few calls as fit, the answer refined call by call
+    "compact": {"include_text": True, "response_mode": "compact"},
+    # Triplets only, no source text: usually a single short call
+    "graph": {"include_text": False, "response_mode": "compact"},
+}
+DEFAULT_RESPONSE_MODE = "tree"
+REPL_HELP = "Commands: :mode tree|compact|graph, :context <tokens>|off, :similarity <0-1>, :latency, quit"
+
 IMPORTANT_ENTITIES = [
     "Ilúvatar", "Valar", "Maiar", "Elves", "Men", "Dwarves", "Melkor", "Morgoth", "Fëanor",
     "Valinor", "Middle-earth", "Beleriand", "Númenor", "Arda",
@@ -49,12 +97,18 @@ aliases = {
     "incánus": "gandalf",
 }
 
-def silmarillion_triplet_extract_fn(text):
-    prompt = f"""
+def known_entities():
+    names = dict.fromkeys(IMPORTANT_ENTITIES)
+    for alias, name in aliases.items():
+        names.update(dict.fromkeys([alias.title(), name.title()]))
+    return list(names)
+
+def build_extraction_prompt(text, entities=None):
+    return f"""
     Extract key relationships from the following text, focusing on characters, 
     locations, and events from the Silmarillion. Pay special attention to:
     
-    Entities: {', '.join(IMPORTANT_ENTITIES)}
+    Entities: {', '.join(IMPORTANT_ENTITIES if entities is None else entities)}
     Relationships: {', '.join(IMPORTANT_RELATIONSHIPS)}
     
     Format as (Entity1, Relationship, Entity2).
@@ -65,18 +119,75 @@ def silmarillion_triplet_extract_fn(text):
     
     Relationships:
     """
-    logger.info(f"Sending prompt to LLM (length: {len(prompt)} chars)")
-    response = Settings.llm.complete(prompt)
-    logger.info(f"Received response from LLM (length: {len(response.text)} chars)")
-    logger.info(f"LLM response: {response.text}")
+
+def cached_triplets(prompt, stats: BuildStats = None, cache: ExtractionCache = None):
+    if cache is None:
+        return None
+    from llama_index.core import Settings
+    key = cache_key(Settings.llm.metadata.model_name, prompt)
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    logger.debug(f"Cache hit for prompt {key[:12]}")
+    count("extract.cache_hits")
+    if stats is not None:
+        stats.get("extract").hits += 1
+    return [tuple(triplet) for triplet in entry["triplets"]]
+
+def record_llm_call(prompt, response, stats: BuildStats = None):
+    prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(response.text)
+    count("llm.prompt_tokens", prompt_tokens)
+    count("llm.completion_tokens", completion_tokens)
+    if stats is not None:
+        stats.record_call("extract", prompt_tokens + completion_tokens)
+
+def handle_extraction_response(prompt, response, stats: BuildStats = None, cache: ExtractionCache = None):
+    logger.debug(f"Received response from LLM (length: {len(response.text)} chars)")
+    logger.debug(f"LLM response: {response.text}")
+    record_llm_call(prompt, response, stats=stats)
     
     triplets = parse_response_to_triplets(response)
+    count("triplets.extracted", len(triplets))
     
     if not triplets:
         logger.warning("No triplets extracted. LLM response may not contain the expected format.")
+
+    if cache is not None:
+        from llama_index.core import Settings
+        model = Settings.llm.metadata.model_name
+        cache.put(cache_key(model, prompt), model, response.text, triplets)
     
     return triplets
 
+def silmarillion_triplet_extract_fn(text, stats: BuildStats = None, cache: ExtractionCache = None, entities=None):
+    from llama_index.core import Settings
+    prompt = build_extraction_prompt(text, entities)
+    triplets = cached_triplets(prompt, stats=stats, cache=cache)
+    if triplets is not None:
+        return triplets
+
+    logger.debug(f"Sending prompt to LLM (length: {len(prompt)} chars)")
+    with span("llm.extract", chunks=1, prompt_chars=len(prompt)):
+        response = Settings.llm.complete(prompt)
+    return handle_extraction_response(prompt, response, stats=stats, cache=cache)
+
+async def asilmarillion_triplet_extract_fn(text, limiter: RateLimiter = None, stats: BuildStats = None,
+                                           cache: ExtractionCache = None, entities=None):
+    from llama_index.core import Settings
+    from semanticsilm.extraction import acomplete_with_retry
+    prompt = build_extraction_prompt(text, entities)
+    triplets = cached_triplets(prompt, stats=stats, cache=cache)
+    if triplets is not None:
+        return triplets
+
+    logger.debug(f"Sending prompt to LLM (length: {len(prompt)} chars)")
+    # Reserve TPM budget for the prompt plus a full-length answer up front
+    tokens = count_tokens(prompt) + EXPECTED_COMPLETION_TOKENS
+    with span("llm.extract", chunks=1, prompt_chars=len(prompt)):
+        response = await acomplete_with_retry(Settings.llm, prompt, limiter=limiter, tokens=tokens)
+    return handle_extraction_response(prompt, response, stats=stats, cache=cache)
+
+@traced("parse")
 def parse_response_to_triplets(response: CompletionResponse):
     triplets = []
     for line in response.text.split('\n'):
@@ -88,57 +199,369 @@ def parse_response_to_triplets(response: CompletionResponse):
             if len(parts) == 3:
                 triplets.append(tuple(part.strip() for part in parts))
         elif line:
-            logger.info(f"Non-triplet line in response: {line}")
+            logger.debug(f"Non-triplet line in response: {line}")
     
-    logger.info(f"Extracted {len(triplets)} triplets from LLM response")
+    logger.debug(f"Extracted {len(triplets)} triplets from LLM response")
     for triplet in triplets:
-        logger.info(f"Triplet: {triplet}")
+        logger.debug(f"Triplet: {triplet}")
     
     return triplets
 
+def build_batch_header(shared_entities: bool) -> str:
+    entities = f"Entities: {', '.join(IMPORTANT_ENTITIES)}\n" if shared_entities else ""
+    return f"""Extract key relationships from each chunk of text below, focusing on characters,
+locations, and events from the Silmarillion. Pay special attention to:
+
+{entities}Relationships: {', '.join(IMPORTANT_RELATIONSHIPS)}
+
+Only extract relationships that are explicitly stated or strongly implied.
+Limit to 25 most important relationships per chunk.
+Answer with one JSON object mapping every chunk ID to a list of
+[Entity1, Relationship, Entity2] triplets, with [] for a chunk that has none:
+{{"c0": [["Fëanor", "crafted", "Silmarils"]], "c1": []}}"""
+
+def build_batch_section(text, entities=None) -> str:
+    lines = [] if entities is None else [f"Entities: {', '.join(entities)}"]
+    return "\n".join(lines + [f"Text: {text}"])
+
+def build_batch_prompt(chunks) -> str:
+    """One request for several (text, entities) chunks; the header is only sent once."""
+    parts = [build_batch_header(chunks[0][1] is None)]
+    for i, (text, entities) in enumerate(chunks):
+        parts.append(f"Chunk c{i}\n{build_batch_section(text, entities)}")
+    parts.append("JSON:")
+    return "\n\n".join(parts)
+
+def batch_cache_prompt(text, entities=None) -> str:
+    # Cached per chunk rather than per batch, so a chunk's triplets are reused
+    # whichever chunks it is batched with next time
+    return f"{build_batch_header(entities is None)}\n\n{build_batch_section(text, entities)}"
+
+def make_batches(chunks, batch_size: int = EXTRACTION_BATCH_SIZE,
+                 max_tokens: int = MAX_BATCH_PROMPT_TOKENS):
+    """Groups chunk positions into batches of at most batch_size chunks and about max_tokens prompt tokens."""
+    batches = []
+    batch, batch_tokens = [], 0
+    for i, (text, entities) in enumerate(chunks):
+        tokens = count_tokens(build_batch_section(text, entities))
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def cached_chunk_triplets(text, entities=None, stats: BuildStats = None, cache: ExtractionCache = None):
+    triplets = cached_triplets(batch_cache_prompt(text, entities), stats=stats, cache=cache)
+    if triplets is None:
+        # Answers cached from single-chunk requests are just as good
+        triplets = cached_triplets(build_extraction_prompt(text, entities), stats=stats, cache=cache)
+    return triplets
+
+def line_format_batch_triplets(chunks, response: CompletionResponse) -> dict:
+    """Chunk id -> triplets for a batched prompt answered in the one-chunk line format instead of JSON.
+
+    Triplets under a heading like "Chunk c1:" belong to that chunk. Without
+    headings, a triplet goes to every chunk that names its subject or object.
+    Chunks left with no triplets are not in the result, so they are retried.
+    """
+    from llama_index.core.llms import CompletionResponse
+    chunk_ids = {f"c{i}" for i in range(len(chunks))}
+    sections, current = {}, None
+    for line in response.text.split("\n"):
+        heading = re.fullmatch(r"[\W_]*(?:chunk\s+)?(c\d+)[\W_]*", line.strip(), flags=re.IGNORECASE)
+        if heading:
+            current = heading.group(1).lower()
+        elif current is not None:
+            sections.setdefault(current, []).append(line)
+    if sections:
+        results = {chunk_id: parse_response_to_triplets(CompletionResponse(text="\n".join(lines)))
+                   for chunk_id, lines in sections.items() if chunk_id in chunk_ids}
+    else:
+        triplets = parse_response_to_triplets(response)
+        results = {}
+        for i, (text, _) in enumerate(chunks):
+            lowered = text.lower()
+            results[f"c{i}"] = [triplet for triplet in triplets
+                                if triplet[0].lower() in lowered or triplet[2].lower() in lowered]
+    return {chunk_id: triplets for chunk_id, triplets in results.items() if triplets}
+
+def handle_batch_response(chunks, prompt, response, stats: BuildStats = None, cache: ExtractionCache = None):
+    """Triplets per chunk, None for chunks the answer did not cover."""
+    logger.debug(f"Received response from LLM for {len(chunks)} chunks (length: {len(response.text)} chars)")
+    logger.debug(f"LLM response: {response.text}")
+    record_llm_call(prompt, response, stats=stats)
+
+    from llama_index.core import Settings
+    from semanticsilm.extraction import TripletStreamParser
+    parser = TripletStreamParser()
+    with span("parse", chunks=len(chunks)):
+        parser.feed(response.text)
+        answered = {chunk_id: parser.results[chunk_id] for chunk_id in parser.closed}
+        if not parser.found_object:
+            # Answered the old way: the triplets are usable as long as they can be told apart by chunk
+            logger.warning("Batched response is not JSON, reading it in the one-chunk line format")
+            answered = line_format_batch_triplets(chunks, response)
+    results = []
+    for i, (text, entities) in enumerate(chunks):
+        chunk_id = f"c{i}"
+        if chunk_id not in answered:
+            logger.warning(f"Batched response has no complete answer for chunk {chunk_id}, retrying it on its own")
+            results.append(None)
+            continue
+        triplets = answered[chunk_id]
+        logger.debug(f"Extracted {len(triplets)} triplets for chunk {chunk_id}")
+        count("triplets.extracted", len(triplets))
+        if cache is not None:
+            model = Settings.llm.metadata.model_name
+            cache.put(cache_key(model, batch_cache_prompt(text, entities)), model,
+                      json.dumps({chunk_id: triplets}, ensure_ascii=False), triplets)
+        results.append(triplets)
+    return results
+
+def extract_batch(chunks, stats: BuildStats = None, cache: ExtractionCache = None):
+    from llama_index.core import Settings
+    prompt = build_batch_prompt(chunks)
+    logger.debug(f"Sending prompt for {len(chunks)} chunks to LLM (length: {len(prompt)} chars)")
+    with span("llm.extract", chunks=len(chunks), prompt_chars=len(prompt)):
+        response = Settings.llm.complete(prompt)
+    results = handle_batch_response(chunks, prompt, response, stats=stats, cache=cache)
+    # Fall back to the one-chunk line format for anything the JSON answer lost
+    return [
+        triplets if triplets is not None
+        else silmarillion_triplet_extract_fn(text, stats=stats, cache=cache, entities=entities)
+        for triplets, (text, entities) in zip(results, chunks)
+    ]
+
+async def aextract_batch(chunks, limiter: RateLimiter = None, stats: BuildStats = None,
+                         cache: ExtractionCache = None):
+    from llama_index.core import Settings
+    from semanticsilm.extraction import acomplete_with_retry
+    prompt = build_batch_prompt(chunks)
+    logger.debug(f"Sending prompt for {len(chunks)} chunks to LLM (length: {len(prompt)} chars)")
+    tokens = count_tokens(prompt) + EXPECTED_COMPLETION_TOKENS * len(chunks)
+    with span("llm.extract", chunks=len(chunks), prompt_chars=len(prompt)):
+        response = await acomplete_with_retry(Settings.llm, prompt, limiter=limiter, tokens=tokens)
+    results = handle_batch_response(chunks, prompt, response, stats=stats, cache=cache)
+    for i, (text, entities) in enumerate(chunks):
+        if results[i] is None:
+            results[i] = await asilmarillion_triplet_extract_fn(
+                text, limiter=limiter, stats=stats, cache=cache, entities=entities
+            )
+    return results
+
+def extract_batched_triplets(chunks, stats: BuildStats = None, cache: ExtractionCache = None,
+                             concurrency: int = EXTRACTION_CONCURRENCY, batch_size: int = EXTRACTION_BATCH_SIZE,
+                             on_extracted=None):
+    """Triplets for each (text, entities) chunk, several chunks per LLM request.
+
+    on_extracted(position, triplets) is called for each chunk as soon as its triplets are known.
+    """
+    on_extracted = on_extracted or (lambda position, triplets: None)
+    results = [cached_chunk_triplets(text, entities, stats=stats, cache=cache) for text, entities in chunks]
+    for i, triplets in enumerate(results):
+        if triplets is not None:
+            on_extracted(i, triplets)
+    misses = [i for i, triplets in enumerate(results) if triplets is None]
+    batches = [[misses[i] for i in batch] for batch in make_batches([chunks[i] for i in misses], batch_size)]
+    logger.info(f"Sending {len(misses)} uncached chunks in {len(batches)} batches")
+
+    def batch_extracted(batch_number, triplets):
+        for i, chunk_triplets in zip(batches[batch_number], triplets):
+            results[i] = chunk_triplets
+            on_extracted(i, chunk_triplets)
+
+    if concurrency > 1:
+        asyncio.run(abatch_triplets([[chunks[i] for i in batch] for batch in batches], stats=stats, cache=cache,
+                                    concurrency=concurrency, on_extracted=batch_extracted))
+    else:
+        for batch_number, batch in enumerate(batches):
+            batch_extracted(batch_number, extract_batch([chunks[i] for i in batch], stats=stats, cache=cache))
+    return results
+
+async def abatch_triplets(batches, stats: BuildStats = None, cache: ExtractionCache = None,
+                          concurrency: int = EXTRACTION_CONCURRENCY,
+                          requests_per_minute: int = REQUESTS_PER_MINUTE,
+                          tokens_per_minute: int = TOKENS_PER_MINUTE, on_extracted=None):
+    from semanticsilm.extraction import RateLimiter, gather_in_order
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    async def extract(item):
+        batch_number, batch = item
+        triplets = await aextract_batch(batch, limiter=limiter, stats=stats, cache=cache)
+        if on_extracted is not None:
+            on_extracted(batch_number, triplets)
+        return triplets
+
+    return await gather_in_order(list(enumerate(batches)), extract, concurrency)
+
 def get_timestamp_folder():
     now = datetime.now()
     return now.strftime("%m_%d_%Y_%H_%M")
 
-def preprocess_entity(entity):
-    return entity.lower().strip()
-
 def are_entities_similar(entity1, entity2, threshold=80):
+    from thefuzz import fuzz
     return fuzz.ratio(preprocess_entity(entity1), preprocess_entity(entity2)) > threshold
 
-def create_silmarillion_kg(documents):
-    graph_store = SimpleGraphStore()
+def chunk_documents(documents, storage_context: StorageContext, nodes=None):
+    from llama_index.core import Settings
+    for doc in documents:
+        storage_context.docstore.set_document_hash(doc.get_doc_id(), doc.hash)
+    if nodes is not None:
+        # Already chunked by preprocess.py
+        return nodes
+    return Settings.node_parser.get_nodes_from_documents(documents)
+
+def node_texts(nodes):
+    from llama_index.core.schema import MetadataMode
+    # Keyed by the exact text KnowledgeGraphIndex hands to kg_triplet_extract_fn
+    return list(dict.fromkeys(node.get_content(metadata_mode=MetadataMode.LLM) for node in nodes))
+
+def prefilter_nodes(nodes, stats: BuildStats = None):
+    """Text -> ChunkFocus, logging the prompt tokens each chunk saves."""
+    texts = node_texts(nodes)
+    if not texts:
+        return {}
+    logger.info(f"Pre-extracting entities from {len(texts)} chunks")
+    from semanticsilm.prefilter import focus_chunks
+    focused = dict(zip(texts, focus_chunks(texts, known_entities())))
+    total_before = total_after = 0
+    for i, (text, focus) in enumerate(focused.items()):
+        before = count_tokens(build_extraction_prompt(text))
+        after = count_tokens(build_extraction_prompt(focus.text, focus.entities)) if focus.text else 0
+        total_before += before
+        total_after += after
+        logger.info(f"Chunk {i}: kept {focus.kept}/{focus.sentences} sentences, {len(focus.entities)} entities, "
+                    f"prompt {before} -> {after} tokens (saved {before - after})")
+    logger.info(f"Pre-extraction saved {total_before - total_after} of {total_before} prompt tokens "
+                f"({(total_before - total_after) / max(total_before, 1):.0%}, "
+                f"{(total_before - total_after) / len(texts):.0f} per chunk)")
+    if stats is not None:
+        stats.get("prefilter").saved += total_before - total_after
+    return focused
+
+def unjournaled_nodes(nodes, journal: BuildJournal = None):
+    from llama_index.core.schema import MetadataMode
+    if journal is None:
+        return nodes
+    return [node for node in nodes if node.get_content(metadata_mode=MetadataMode.LLM) not in journal]
+
+def extract_node_triplets(nodes, stats: BuildStats = None, cache: ExtractionCache = None,
+                          concurrency: int = EXTRACTION_CONCURRENCY, focused: dict = None,
+                          batch_size: int = EXTRACTION_BATCH_SIZE, journal: BuildJournal = None):
+    """Text -> triplets for every chunk; chunks already in the journal are not extracted again."""
+    from semanticsilm.prefilter import ChunkFocus
+    results = {text: [] for text in node_texts(nodes)}
+    texts = list(results)
+    if journal is not None:
+        texts = [text for text in texts if text not in journal]
+        for text in results:
+            if text in journal:
+                results[text] = journal.get(text)
+        if len(texts) < len(results):
+            logger.info(f"Resuming: {len(results) - len(texts)} of {len(results)} chunks are in the build journal")
+    # Without pre-extraction every chunk goes to the LLM whole, with the full entity list
+    focus = [focused[text] if focused is not None else ChunkFocus(text, None) for text in texts]
+    # Chunks without a single entity have nothing to extract
+    pending = [i for i, chunk in enumerate(focus) if chunk.text]
+
+    def on_extracted(position, triplets):
+        results[texts[pending[position]]] = triplets
+        if journal is not None:
+            journal.record(texts[pending[position]], triplets)
+
+    if journal is not None:
+        for i, chunk in enumerate(focus):
+            if not chunk.text:
+                journal.record(texts[i], [])
+    logger.info(f"Extracting triplets from {len(pending)} of {len(texts)} chunks "
+                f"(concurrency: {concurrency}, batch size: {batch_size})")
+    if batch_size > 1:
+        extract_batched_triplets([(focus[i].text, focus[i].entities) for i in pending], stats=stats, cache=cache,
+                                 concurrency=concurrency, batch_size=batch_size, on_extracted=on_extracted)
+    elif concurrency > 1:
+        asyncio.run(aextract_triplets(
+            [focus[i].text for i in pending], stats=stats, cache=cache, concurrency=concurrency,
+            entities=[focus[i].entities for i in pending], on_extracted=on_extracted,
+        ))
+    else:
+        for position, i in enumerate(pending):
+            on_extracted(position, silmarillion_triplet_extract_fn(focus[i].text, stats=stats, cache=cache,
+                                                                   entities=focus[i].entities))
+    return results
+
+async def aextract_triplets(texts, stats: BuildStats = None, cache: ExtractionCache = None,
+                            concurrency: int = EXTRACTION_CONCURRENCY,
+                            requests_per_minute: int = REQUESTS_PER_MINUTE,
+                            tokens_per_minute: int = TOKENS_PER_MINUTE, entities=None, on_extracted=None):
+    from semanticsilm.extraction import RateLimiter, gather_in_order
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    async def extract(item):
+        position, text, chunk_entities = item
+        triplets = await asilmarillion_triplet_extract_fn(
+            text, limiter=limiter, stats=stats, cache=cache, entities=chunk_entities
+        )
+        if on_extracted is not None:
+            on_extracted(position, triplets)
+        return triplets
+
+    items = list(zip(range(len(texts)), texts, entities or [None] * len(texts)))
+    return await gather_in_order(items, extract, concurrency)
+
+def create_silmarillion_kg(documents, stats: BuildStats = None, cache: ExtractionCache = None,
+                           concurrency: int = EXTRACTION_CONCURRENCY, manifest: dict = None, nodes=None,
+                           prefilter: bool = PREFILTER, batch_size: int = EXTRACTION_BATCH_SIZE,
+                           journal: BuildJournal = None):
+    from llama_index.core import KnowledgeGraphIndex, StorageContext
+    from semanticsilm.graph_store import CompactGraphStore
+    stats = stats or BuildStats()
+    graph_store = CompactGraphStore()
     storage_context = StorageContext.from_defaults(graph_store=graph_store)
 
     logger.info(f"Creating initial Knowledge Graph Index from {len(documents)} documents...")
+
+    with stats.stage("chunk"):
+        nodes = chunk_documents(documents, storage_context, nodes)
+    logger.info(f"Split documents into {len(nodes)} chunks")
+
+    focused = None
+    if prefilter:
+        with stats.stage("prefilter"):
+            focused = prefilter_nodes(unjournaled_nodes(nodes, journal), stats=stats)
+    with stats.stage("extract"):
+        extracted = extract_node_triplets(nodes, stats=stats, cache=cache, concurrency=concurrency, focused=focused,
+                                          batch_size=batch_size, journal=journal)
+
+    total_triplets = sum(len(triplets) for triplets in extracted.values())
+    logger.info(f"Total triplets extracted: {total_triplets}")
     
-    all_triplets = []
-    for doc in documents:
-        logger.info(f"Processing document: {doc.doc_id}")
-        text = doc.text
-        triplets = silmarillion_triplet_extract_fn(text)
-        logger.info(f"Extracted {len(triplets)} triplets from document")
-        logger.info(f"Triplets: {triplets}")
-        all_triplets.extend(triplets)
-    
-    logger.info(f"Total triplets extracted: {len(all_triplets)}")
-    
-    if not all_triplets:
+    if not total_triplets:
         logger.warning("No triplets were extracted. The knowledge graph will be empty.")
     
-    index = KnowledgeGraphIndex.from_documents(
-        documents,
-        max_triplets_per_chunk=25,
-        kg_triplet_extract_fn=silmarillion_triplet_extract_fn,
-        include_embeddings=True,
-        storage_context=storage_context,
-    )
+    # Triplets are replayed from the extraction pass, so building the index
+    # only pays for the triplet embeddings, never for a second LLM round-trip.
+    with stats.stage("index") as stage:
+        for triplets in extracted.values():
+            stage.calls += len(triplets)
+            stage.tokens += sum(count_tokens(str(triplet)) for triplet in triplets)
+        index = KnowledgeGraphIndex(
+            nodes=nodes,
+            max_triplets_per_chunk=25,
+            kg_triplet_extract_fn=lambda text: extracted.get(text, []),
+            include_embeddings=True,
+            storage_context=storage_context,
+        )
     
     logger.info("Knowledge Graph Index created. Inspecting graph structure...")
     inspect_graph_structure(index.graph_store)
     
     logger.info("Performing entity linking...")
-    linked_graph_store = silmarillion_entity_linking(index.graph_store)
+    entity_map, links = {}, {}
+    with stats.stage("link"):
+        linked_graph_store = silmarillion_entity_linking(index.graph_store, entity_map=entity_map, links=links)
     
     logger.info("Updating index with linked graph store...")
     index._graph_store = linked_graph_store
@@ -147,52 +570,205 @@ def create_silmarillion_kg(documents):
     logger.info("Final Knowledge Graph structure:")
     inspect_graph_structure(index.graph_store)
 
+    if manifest is not None:
+        manifest.update(build_manifest(documents, nodes, extracted, entity_map, links))
+
+    return index
+
+def update_silmarillion_kg(documents, persist_dir, stats: BuildStats = None, cache: ExtractionCache = None,
+                           concurrency: int = EXTRACTION_CONCURRENCY, manifest: dict = None,
+                           prefilter: bool = PREFILTER, batch_size: int = EXTRACTION_BATCH_SIZE,
+                           journal: BuildJournal = None):
+    from llama_index.core import Settings
+    from llama_index.core.schema import MetadataMode
+    from semanticsilm.graph_store import CompactGraphStore
+    from semanticsilm.persistence import load_index
+    stats = stats or BuildStats()
+    old_manifest = load_manifest(persist_dir)
+    if old_manifest is None:
+        raise ValueError(f"No manifest in {persist_dir}, the index has to be rebuilt from scratch")
+    index = load_index(persist_dir)
+    storage_context = index.storage_context
+    updated = new_manifest(dict(old_manifest["entity_map"]), dict(old_manifest["links"]))
+
+    logger.info(f"Updating Knowledge Graph Index in {persist_dir} from {len(documents)} documents...")
+
+    new_nodes = []
+    with stats.stage("chunk"):
+        for doc in documents:
+            doc_id = doc.get_doc_id()
+            old_doc = old_manifest["documents"].get(doc_id)
+            if old_doc is not None and old_doc["hash"] == doc.hash:
+                updated["documents"][doc_id] = old_doc
+                for node_id in old_doc["chunks"]:
+                    updated["chunks"][node_id] = old_manifest["chunks"][node_id]
+                continue
+
+            logger.info(f"Document changed: {doc_id}")
+            storage_context.docstore.set_document_hash(doc_id, doc.hash)
+            # Chunks whose text survived the edit keep their node and triplets
+            old_chunks = {}
+            for node_id in (old_doc or {}).get("chunks", []):
+                old_chunks[old_manifest["chunks"][node_id]["hash"]] = node_id
+            chunk_ids = []
+            for node in Settings.node_parser.get_nodes_from_documents([doc]):
+                node_hash = chunk_hash(node.get_content(metadata_mode=MetadataMode.LLM))
+                if node_hash in old_chunks:
+                    node_id = old_chunks.pop(node_hash)
+                    updated["chunks"][node_id] = old_manifest["chunks"][node_id]
+                else:
+                    new_nodes.append(node)
+                    node_id = node.node_id
+                chunk_ids.append(node_id)
+            updated["documents"][doc_id] = {"hash": doc.hash, "chunks": chunk_ids}
+
+    removed_ids = set(old_manifest["chunks"]) - set(updated["chunks"])
+    logger.info(f"{len(new_nodes)} new chunks, {len(removed_ids)} removed chunks")
+
+    focused = None
+    if prefilter:
+        with stats.stage("prefilter"):
+            focused = prefilter_nodes(unjournaled_nodes(new_nodes, journal), stats=stats)
+    with stats.stage("extract"):
+        extracted = extract_node_triplets(new_nodes, stats=stats, cache=cache, concurrency=concurrency,
+                                          focused=focused, batch_size=batch_size, journal=journal)
+    for node in new_nodes:
+        text = node.get_content(metadata_mode=MetadataMode.LLM)
+        updated["chunks"][node.node_id] = chunk_entry(node, extracted.get(text, []))
+
+    with stats.stage("index") as stage:
+        remove_index_chunks(index, removed_ids)
+        stage.calls, stage.tokens = add_index_chunks(index, new_nodes, extracted)
+        live_triplets = {str(triplet) for triplet in manifest_triplets(updated)}
+        for triplet_str in list(index.index_struct.embedding_dict):
+            if triplet_str not in live_triplets:
+                del index.index_struct.embedding_dict[triplet_str]
+        storage_context.index_store.add_index_struct(index.index_struct)
+
+    logger.info("Performing entity linking...")
+    raw_graph_store = CompactGraphStore()
+    for subj, rel, obj in manifest_triplets(updated):
+        raw_graph_store.upsert_triplet(subj, rel, obj)
+    with stats.stage("link"):
+        # Entities seen in earlier builds resolve through the saved links,
+        # so only entities introduced by the new chunks are matched.
+        linked_graph_store = silmarillion_entity_linking(
+            raw_graph_store, entity_map=updated["entity_map"], links=updated["links"]
+        )
+    prune_links(updated, raw_graph_store)
+
+    index._graph_store = linked_graph_store
+    index._storage_context.graph_store = linked_graph_store
+
+    logger.info("Final Knowledge Graph structure:")
+    inspect_graph_structure(index.graph_store)
+
+    if manifest is not None:
+        manifest.update(updated)
+
     return index
 
-def inspect_graph_structure(graph_store: SimpleGraphStore):
-    total_subjects = len(graph_store._data.graph_dict)
+def remove_index_chunks(index: KnowledgeGraphIndex, node_ids):
+    if not node_ids:
+        return
+    for node_id in node_ids:
+        index.docstore.delete_document(node_id, raise_error=False)
+    table = index.index_struct.table
+    for keyword in list(table):
+        table[keyword] -= node_ids
+        if not table[keyword]:
+            del table[keyword]
+
+def add_index_chunks(index: KnowledgeGraphIndex, nodes, extracted):
+    from llama_index.core.schema import MetadataMode
+    index.docstore.add_documents(nodes, allow_update=True)
+    new_triplets = []
+    for node in nodes:
+        for triplet in extracted.get(node.get_content(metadata_mode=MetadataMode.LLM), []):
+            subj, _, obj = triplet
+            index.index_struct.add_node([subj, obj], node)
+            triplet_str = str(triplet)
+            if triplet_str not in index.index_struct.embedding_dict:
+                new_triplets.append(triplet_str)
+    new_triplets = list(dict.fromkeys(new_triplets))
+    if new_triplets:
+        embeddings = index._embed_model.get_text_embedding_batch(new_triplets)
+        for triplet_str, embedding in zip(new_triplets, embeddings):
+            index.index_struct.add_to_embedding_dict(triplet_str, embedding)
+    return len(new_triplets), sum(count_tokens(triplet_str) for triplet_str in new_triplets)
+
+def prune_links(manifest: dict, raw_graph_store: GraphStore):
+    from semanticsilm.graph_store import graph_items
+    live_entities = set()
+    for subj, relations in graph_items(raw_graph_store):
+        live_entities.add(subj)
+        live_entities.update(obj for _, obj in relations)
+    links = manifest["links"]
+    for entity in list(links):
+        if entity not in live_entities:
+            del links[entity]
+    canonical = set(links.values())
+    entity_map = manifest["entity_map"]
+    for known_entity in list(entity_map):
+        if entity_map[known_entity] not in canonical:
+            del entity_map[known_entity]
+
+def inspect_graph_structure(graph_store: GraphStore):
+    from semanticsilm.graph_store import graph_items
+    total_subjects = 0
+    total_relationships = 0
+    sample = []
+    for subject, relations in graph_items(graph_store):
+        total_subjects += 1
+        total_relationships += len(relations)
+        if len(sample) < 5:
+            sample.append((subject, relations))
     logger.info(f"Total subjects in graph: {total_subjects}")
     
     if total_subjects == 0:
         logger.warning("The graph is empty. No entities or relationships were extracted.")
         return
     
-    total_relationships = sum(len(relations) for relations in graph_store._data.graph_dict.values())
     logger.info(f"Total relationships in graph: {total_relationships}")
     
-    sample_size = min(5, total_subjects)
-    logger.info(f"Sample of graph structure (up to {sample_size} subjects):")
-    for subject, relations in list(graph_store._data.graph_dict.items())[:sample_size]:
-        logger.info(f"Subject: {subject}")
+    logger.debug(f"Sample of graph structure (up to {len(sample)} subjects):")
+    for subject, relations in sample:
+        logger.debug(f"Subject: {subject}")
         for relation, object in relations[:5]:
-            logger.info(f"  - {relation} -> {object}")
+            logger.debug(f"  - {relation} -> {object}")
         if len(relations) > 5:
-            logger.info(f"  ... and {len(relations) - 5} more relations")
+            logger.debug(f"  ... and {len(relations) - 5} more relations")
 
-def silmarillion_entity_linking(graph_store: SimpleGraphStore) -> SimpleGraphStore:
-    linked_graph_store = SimpleGraphStore()
-    entity_map = {}
+def silmarillion_entity_linking(graph_store: GraphStore, entity_map: dict = None,
+                                links: dict = None) -> CompactGraphStore:
+    from semanticsilm.graph_store import CompactGraphStore, graph_items
+    linked_graph_store = CompactGraphStore()
+    resolver = EntityResolver(entity_map, links)
     
-    logger.info(f"Starting entity linking process. Total subjects: {len(graph_store._data.graph_dict)}")
-    for subj, relations in graph_store._data.graph_dict.items():
-        linked_subj = link_entity(subj, entity_map)
-        logger.info(f"Linking subject: {subj} -> {linked_subj}")
-        for rel, obj in relations:
-            linked_obj = link_entity(obj, entity_map)
-            logger.info(f"Linking object: {obj} -> {linked_obj}")
-            aliased_subj = apply_alias(linked_subj)
-            aliased_obj = apply_alias(linked_obj)
-            logger.info(f"Adding triplet: ({aliased_subj}, {rel}, {aliased_obj})")
-            linked_graph_store.upsert_triplet(aliased_subj, rel, aliased_obj)
+    logger.info("Starting entity linking process.")
+    linked = []
+    with span("link.resolve"):
+        for subj, relations in graph_items(graph_store):
+            linked_subj = resolver.resolve(subj)
+            logger.debug(f"Linking subject: {subj} -> {linked_subj}")
+            for rel, obj in relations:
+                linked_obj = resolver.resolve(obj)
+                logger.debug(f"Linking object: {obj} -> {linked_obj}")
+                linked.append((apply_alias(linked_subj), rel, apply_alias(linked_obj)))
+    with span("graph.upsert", triplets=len(linked)):
+        for triplet in linked:
+            logger.debug(f"Adding triplet: {triplet}")
+            linked_graph_store.upsert_triplet(*triplet)
+    count("graph.upserts", len(linked))
     
-    logger.info(f"Entity linking complete. Total linked subjects: {len(linked_graph_store._data.graph_dict)}")
+    logger.info(f"Entity linking complete. Total linked subjects: {len(linked_graph_store.subjects())}")
     return linked_graph_store
 
 def apply_alias(entity: str) -> str:
     lower_entity = entity.lower()
     if lower_entity in aliases:
         aliased = aliases[lower_entity].title()
-        logger.info(f"Applied alias: {entity} -> {aliased}")
+        logger.debug(f"Applied alias: {entity} -> {aliased}")
         return aliased
     return entity
 
@@ -200,10 +776,10 @@ def link_entity(entity: str, entity_map: dict) -> str:
     processed_entity = preprocess_entity(entity)
     for known_entity, mapped_entity in entity_map.items():
         if are_entities_similar(processed_entity, known_entity):
-            logger.info(f"Linked entity: {entity} -> {mapped_entity} (via {known_entity})")
+            logger.debug(f"Linked entity: {entity} -> {mapped_entity} (via {known_entity})")
             return mapped_entity
     entity_map[processed_entity] = entity
-    logger.info(f"New entity encountered: {entity}")
+    logger.debug(f"New entity encountered: {entity}")
     return entity
 
 def get_new_index_folder(timestamp_folder):
@@ -212,22 +788,32 @@ def get_new_index_folder(timestamp_folder):
     
     return os.path.join(INDEX_DIR, timestamp_folder)
 
-def select_index_folder():
+def existing_index_folders():
     if not os.path.exists(INDEX_DIR):
-        print("No existing index folders found.")
-        return None
-    
+        return []
     existing_folders = [f for f in os.listdir(INDEX_DIR) if os.path.isdir(os.path.join(INDEX_DIR, f))]
+    # Sort folders by creation time (newest first)
+    existing_folders.sort(key=lambda x: os.path.getctime(os.path.join(INDEX_DIR, x)), reverse=True)
+    return existing_folders
+
+def latest_index_folder(unfinished: bool = False):
+    """The newest finished index folder, or with unfinished=True the newest interrupted build."""
+    for folder in existing_index_folders():
+        path = os.path.join(INDEX_DIR, folder)
+        if is_unfinished_build(path) == unfinished:
+            return path
+    return None
+
+def select_index_folder():
+    existing_folders = existing_index_folders()
     if not existing_folders:
         print("No existing index folders found.")
         return None
     
-    # Sort folders by creation time (newest first)
-    existing_folders.sort(key=lambda x: os.path.getctime(os.path.join(INDEX_DIR, x)), reverse=True)
-    
     print("Available index folders:")
     for i, folder in enumerate(existing_folders, 1):
-        print(f"{i}. {folder}")
+        unfinished = is_unfinished_build(os.path.join(INDEX_DIR, folder))
+        print(f"{i}. {folder}{' (unfinished build)' if unfinished else ''}")
     print("0. Create a new index")
     
     while True:
@@ -242,47 +828,268 @@ def select_index_folder():
             pass
         print("Invalid choice. Please try again.")
 
-def main():
-    documents = SimpleDirectoryReader(DATA_DIR, recursive=True, filename_as_id=True).load_data()
-    print("Loaded docs")
-
-    llm = OpenAI(temperature=0, model="gpt-4o-mini")
-    Settings.llm = llm
+def configure_settings():
+    from llama_index.core import Settings
+    from llama_index.llms.openai import OpenAI
+    Settings.llm = OpenAI(temperature=0, model="gpt-4o-mini")
     Settings.chunk_size = 1024
 
-    timestamp_folder = get_timestamp_folder()
-    selected_folder = select_index_folder()
-    if selected_folder:
-        print(f"Loading index from {selected_folder}")
-        storage_context = StorageContext.from_defaults(
-            graph_store=SimpleGraphStore.from_persist_dir(selected_folder),
-            index_store=SimpleIndexStore.from_persist_dir(selected_folder)
-        )
-        index = load_index_from_storage(storage_context)
-        print("Loaded index")
+def load_documents():
+    """Documents from DATA_DIR, plus their chunks when preprocess.py's manifest is current."""
+    from llama_index.core import Settings, SimpleDirectoryReader
+    from semanticsilm.chunks import load_chunk_manifest
+    with span("load_documents"):
+        preprocessed = load_chunk_manifest(DATA_DIR, Settings.chunk_size)
+        if preprocessed:
+            documents, nodes = preprocessed
+            print(f"Loaded {len(documents)} preprocessed docs")
+            return documents, nodes
+        documents = SimpleDirectoryReader(DATA_DIR, recursive=True, filename_as_id=True).load_data()
+        print("Loaded docs")
+        return documents, None
+
+def data_changed_since(persist_dir, data_dir=DATA_DIR) -> bool:
+    """Whether anything under data_dir is newer than the index's manifest.
+
+    Only stats files and directories (adding or removing a file touches its
+    directory), so loading an index doesn't read every document just to
+    find out nothing changed.
+    """
+    built = os.path.getmtime(os.path.join(persist_dir, MANIFEST_FNAME))
+    for root, dirs, files in os.walk(data_dir):
+        paths = [root] + [os.path.join(root, name) for name in files if not name.startswith(".")]
+        if any(os.path.getmtime(path) > built for path in paths):
+            return True
+    return False
+
+def open_index(index_folder, index=None, **runner_settings):
+    """Imports the query stack, loads the index and builds its query engine."""
+    from semanticsilm.batch_query import QueryRunner
+    configure_settings()
+    return QueryRunner(index_folder, index=index, **runner_settings)
+
+def open_index_in_background(index_folder, **runner_settings) -> Future:
+    # Lets the caller show the query prompt while the index is still loading
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-loader")
+    future = executor.submit(open_index, index_folder, **runner_settings)
+    executor.shutdown(wait=False)
+    return future
+
+def is_similarity_threshold(value: str) -> bool:
+    try:
+        return 0 < float(value) <= 1
+    except ValueError:
+        return False
+
+def repl_command(command: str, query_settings: dict, runner=None) -> str:
+    """Applies a ":" command from the query prompt to query_settings and says what it did."""
+    name, _, value = command[1:].strip().partition(" ")
+    value = value.strip()
+    if name == "mode" and value in RESPONSE_MODES:
+        query_settings["mode"] = value
+        return f"Response mode: {value}"
+    if name == "context" and (value == "off" or (value.isdigit() and int(value) > 0)):
+        query_settings["max_context_tokens"] = None if value == "off" else int(value)
+        return f"Context limit: {'none' if value == 'off' else value + ' tokens'}"
+    if name == "similarity" and is_similarity_threshold(value):
+        query_settings["similarity_threshold"] = float(value)
+        return f"Cache similarity threshold: {float(value):g}"
+    if name == "latency":
+        return runner.latency_report() if runner is not None else "No queries answered yet"
+    return REPL_HELP
+
+@contextmanager
+def interrupted_build_hint(journal: BuildJournal):
+    try:
+        yield
+    except BaseException:
+        print(f"Build interrupted with {len(journal)} chunks saved in {journal.path}. "
+              f"Resume it with: python main.py --resume {os.path.basename(journal.persist_dir)}")
+        raise
+
+def build_index(timestamp_folder, documents, nodes=None):
+    from llama_index.core import Settings
+    from semanticsilm import visualize
+    from semanticsilm.analytics import compute_analytics
+    from semanticsilm.layout import compute_layout
+    from semanticsilm.persistence import save_index
+
+    new_folder = get_new_index_folder(timestamp_folder)
+    journal = BuildJournal(new_folder)
+    if journal.started:
+        print(f"Resuming the build in {new_folder}, {len(journal)} chunks already extracted")
     else:
-        new_folder = get_new_index_folder(timestamp_folder)
         print(f"Creating new index in {new_folder}")
-        index = create_silmarillion_kg(documents)
-        storage_context = index.storage_context
-        storage_context.persist(persist_dir=new_folder)
-        print("Built and saved index")
-        g = index.get_networkx_graph()
-        output_folder = os.path.join(OUTPUT_DIR, timestamp_folder)
-        os.makedirs(output_folder, exist_ok=True)
-        visualize.visualize_networkx(g, output_file=os.path.join(output_folder, 'silmarillion_graph_networkx.png'))
-        visualize.visualize_plotly(g, output_file=os.path.join(output_folder, 'silmarillion_graph_plotly.html'))
-        visualize.create_interactive_graph(g, output_file=os.path.join(output_folder, 'silmarillion_graph_interactive.html'))
-        print(f"Visualizations saved in {output_folder}")
-
-    query_engine = index.as_query_engine(include_text=True, response_mode="tree_summarize")
+    journal.begin(base=None, chunk_size=Settings.chunk_size)
+    stats = BuildStats()
+    manifest = {}
+    with interrupted_build_hint(journal):
+        index = create_silmarillion_kg(documents, stats=stats, cache=ExtractionCache(), manifest=manifest, nodes=nodes,
+                                       journal=journal)
+    with stats.stage("analytics"):
+        analytics = compute_analytics(index.graph_store)
+    with stats.stage("persist"):
+        save_index(index, new_folder)
+        analytics.save(new_folder)
+        save_manifest(manifest, new_folder)
+    journal.finish()
+    print("Built and saved index")
+    output_folder = os.path.join(OUTPUT_DIR, timestamp_folder)
+    os.makedirs(output_folder, exist_ok=True)
+    with stats.stage("layout"):
+        # The default limit of 100 relations would keep large graphs out of visualize's large-graph mode
+        g = index.get_networkx_graph(limit=index.graph_store.num_edges())
+        pos = compute_layout(g)
+    with stats.stage("visualize"):
+        # The communities were already found by the analytics stage
+        partition = analytics.partition()
+        visualize.visualize_networkx(g, output_file=os.path.join(output_folder, 'silmarillion_graph_networkx.png'), pos=pos)
+        visualize.visualize_plotly(g, output_file=os.path.join(output_folder, 'silmarillion_graph_plotly.html'), pos=pos,
+                                   partition=partition)
+        visualize.create_interactive_graph(g, output_file=os.path.join(output_folder, 'silmarillion_graph_interactive.html'),
+                                           pos=pos, partition=partition)
+    print(f"Visualizations saved in {output_folder}")
+    print("Build summary:")
+    print(stats.summary())
+    return new_folder, index
 
-    while True:
-        query = input("Enter query (or 'quit' to exit): ")
-        if query.lower() == 'quit':
-            break
-        response = query_engine.query(query)
-        print(response)
+def update_index(timestamp_folder, selected_folder, documents):
+    from llama_index.core import Settings
+    from semanticsilm.analytics import compute_analytics
+    from semanticsilm.persistence import save_index
+
+    new_folder = get_new_index_folder(timestamp_folder)
+    journal = BuildJournal(new_folder)
+    if journal.started:
+        print(f"Resuming the update of {selected_folder} in {new_folder}, {len(journal)} chunks already extracted")
+    else:
+        print(f"Updating {selected_folder} into {new_folder}")
+    journal.begin(base=selected_folder, chunk_size=Settings.chunk_size)
+    stats = BuildStats()
+    manifest = {}
+    with interrupted_build_hint(journal):
+        index = update_silmarillion_kg(documents, selected_folder, stats=stats, cache=ExtractionCache(),
+                                       manifest=manifest, journal=journal)
+    with stats.stage("analytics"):
+        analytics = compute_analytics(index.graph_store)
+    with stats.stage("persist"):
+        save_index(index, new_folder)
+        analytics.save(new_folder)
+        save_manifest(manifest, new_folder)
+    journal.finish()
+    print("Updated and saved index")
+    print("Build summary:")
+    print(stats.summary())
+    return new_folder, index
+
+def resume_build(persist_dir):
+    """Finishes an interrupted build or update of persist_dir (a folder in INDEX_DIR) from its journal."""
+    from llama_index.core import Settings
+    journal = BuildJournal(persist_dir)
+    if not journal.started:
+        raise ValueError(f"{persist_dir} has no build journal to resume from")
+    configure_settings()
+    if journal.settings.get("chunk_size") != Settings.chunk_size:
+        logger.warning(f"The build started with chunk size {journal.settings.get('chunk_size')}, now "
+                       f"{Settings.chunk_size}: chunks that changed are extracted again")
+    documents, nodes = load_documents()
+    timestamp_folder = os.path.basename(os.path.normpath(persist_dir))
+    if journal.settings.get("base"):
+        return update_index(timestamp_folder, journal.settings["base"], documents)
+    return build_index(timestamp_folder, documents, nodes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, update or query the Silmarillion knowledge graph")
+    parser.add_argument("--resume", nargs="?", const="", default=None, metavar="INDEX_FOLDER",
+                        help="finish an interrupted build (default: the newest one)")
+    parser.add_argument("--mode", choices=list(RESPONSE_MODES), default=DEFAULT_RESPONSE_MODE,
+                        help="response mode to start with, from the slowest and most thorough to the cheapest")
+    parser.add_argument("--context-tokens", type=int, default=None, metavar="TOKENS",
+                        help="limit on retrieved context tokens to start with")
+    parser.add_argument("--ranked-triplets", type=int, default=None, metavar="COUNT",
+                        help="triplets kept after graph ranking (default: max_knowledge_sequence, 30)")
+    parser.add_argument("--similarity-threshold", type=float, default=None, metavar="COSINE",
+                        help="cosine similarity at which a cached query's answer is reused (default: 0.95)")
+    args = parser.parse_args()
+    if args.context_tokens is not None and args.context_tokens < 1:
+        parser.error("--context-tokens must be at least 1")
+    if args.ranked_triplets is not None and args.ranked_triplets < 1:
+        parser.error("--ranked-triplets must be at least 1")
+    if args.similarity_threshold is not None and not 0 < args.similarity_threshold <= 1:
+        parser.error("--similarity-threshold must be above 0 and at most 1")
+    query_settings = {"mode": args.mode, "max_context_tokens": args.context_tokens,
+                      "similarity_threshold": args.similarity_threshold}
+    # Fixed for the runner's lifetime, unlike query_settings which the prompt can change
+    runner_settings = {**query_settings, "ranked_triplets": args.ranked_triplets}
+
+    started = time.perf_counter()
+    runner = None
+    runner_future = None
+    timestamp_folder = get_timestamp_folder()
+    choosing_seconds = 0
+    if args.resume is not None:
+        selected_folder = os.path.join(INDEX_DIR, args.resume) if args.resume else latest_index_folder(unfinished=True)
+        if selected_folder is None or not is_unfinished_build(selected_folder):
+            parser.error(f"no interrupted build to resume in {selected_folder or INDEX_DIR}")
+    else:
+        choosing = time.perf_counter()
+        selected_folder = select_index_folder()
+        choosing_seconds = time.perf_counter() - choosing
+        if (selected_folder and is_unfinished_build(selected_folder) and not
+                input(f"{selected_folder} is an unfinished build. Resume it? (y/n): ").lower().startswith('y')):
+            return
+    if selected_folder and is_unfinished_build(selected_folder):
+        runner = open_index(*resume_build(selected_folder), **runner_settings)
+    elif selected_folder:
+        old_manifest = load_manifest(selected_folder)
+        changed = []
+        if old_manifest and data_changed_since(selected_folder):
+            configure_settings()
+            documents, _ = load_documents()
+            changed = changed_documents(old_manifest, documents)
+        if changed and input(f"{len(changed)} documents changed since this index was built. "
+                             "Update it? (y/n): ").lower().startswith('y'):
+            runner = open_index(*update_index(timestamp_folder, selected_folder, documents), **runner_settings)
+        else:
+            print(f"Loading index from {selected_folder}")
+            runner_future = open_index_in_background(selected_folder, **runner_settings)
+            print(f"Startup: main.py imported in {IMPORT_SECONDS:.2f}s, query prompt "
+                  f"{time.perf_counter() - started - choosing_seconds:.2f}s later (not counting the index "
+                  f"choice), index loading in the background")
+    else:
+        configure_settings()
+        documents, nodes = load_documents()
+        runner = open_index(*build_index(timestamp_folder, documents, nodes), **runner_settings)
+
+    try:
+        while True:
+            query = input(f"Enter query (or 'quit' to exit, ':help' for commands) [{query_settings['mode']}]: ")
+            if query.lower() == 'quit':
+                break
+            if query.startswith(":"):
+                print(repl_command(query, query_settings, runner))
+                continue
+            if runner is None:
+                with span("persist.wait"):
+                    runner = runner_future.result()
+                print(f"Loaded index in {runner.load_seconds:.2f}s")
+            # The answer is printed as it is generated rather than once it is complete
+            result = runner.answer(query, on_token=lambda token: print(token, end="", flush=True), **query_settings)
+            print()
+            first_token = f"first token {result['ttft_ms'] / 1000:.2f}s, " if result["ttft_ms"] is not None else ""
+            print(f"[{result['mode']}] {first_token}total {result['latency_ms'] / 1000:.2f}s"
+                  f"{' (cached)' if result['cached'] else ''}")
+    finally:
+        if runner is not None:
+            print(runner.latency_report())
+        if runner is not None and runner.query_cache is not None:
+            runner.query_cache.flush()
+            print(runner.query_cache.stats.summary())
+        print("Run summary:")
+        print(tracer.summary())
+        tracer.export(trace_path(timestamp_folder))
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
 
 if __name__ == "__main__":
     main()
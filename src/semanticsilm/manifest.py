@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FNAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def new_manifest(entity_map=None, links=None):
+    return {
+        "version": MANIFEST_VERSION,
+        "documents": {},
+        "chunks": {},
+        "entity_map": entity_map if entity_map is not None else {},
+        "links": links if links is not None else {},
+    }
+
+def chunk_entry(node, triplets):
+    # Imported here so loading a manifest doesn't import llama_index
+    from llama_index.core.schema import MetadataMode
+    return {
+        "hash": chunk_hash(node.get_content(metadata_mode=MetadataMode.LLM)),
+        "doc_id": node.ref_doc_id,
+        "triplets": [list(triplet) for triplet in triplets],
+    }
+
+def build_manifest(documents, nodes, extracted, entity_map, links):
+    from llama_index.core.schema import MetadataMode
+    manifest = new_manifest(entity_map, links)
+    for doc in documents:
+        manifest["documents"][doc.get_doc_id()] = {"hash": doc.hash, "chunks": []}
+    for node in nodes:
+        text = node.get_content(metadata_mode=MetadataMode.LLM)
+        manifest["chunks"][node.node_id] = chunk_entry(node, extracted.get(text, []))
+        manifest["documents"][node.ref_doc_id]["chunks"].append(node.node_id)
+    return manifest
+
+def manifest_triplets(manifest):
+    for doc in manifest["documents"].values():
+        for node_id in doc["chunks"]:
+            for triplet in manifest["chunks"][node_id]["triplets"]:
+                yield tuple(triplet)
+
+def changed_documents(manifest, documents):
+    current = {doc.get_doc_id(): doc.hash for doc in documents}
+    changed = [doc_id for doc_id, doc_hash in current.items()
+               if manifest["documents"].get(doc_id, {}).get("hash") != doc_hash]
+    removed = [doc_id for doc_id in manifest["documents"] if doc_id not in current]
+    return changed + removed
+
+def save_manifest(manifest, persist_dir):
+    with open(os.path.join(persist_dir, MANIFEST_FNAME), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False)
+
+def load_manifest(persist_dir):
+    path = os.path.join(persist_dir, MANIFEST_FNAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
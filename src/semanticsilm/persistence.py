@@ -0,0 +1,123 @@
+import argparse
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+import numpy as np
+from llama_index.core import KnowledgeGraphIndex, StorageContext, load_index_from_storage
+from llama_index.core.data_structs.data_structs import IndexStruct, KG
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.docstore.types import DEFAULT_PERSIST_FNAME as DOCSTORE_FNAME
+from llama_index.core.storage.index_store.types import BaseIndexStore
+from semanticsilm.embeddings import EmbeddingMatrix
+from semanticsilm.graph_store import CompactGraphStore, load_graph_store
+from semanticsilm.telemetry import traced
+
+logger = logging.getLogger(__name__)
+
+BINARY_FNAME = "binary_index.json"
+BINARY_VERSION = 1
+EMBEDDINGS_FNAME = "embeddings.npy"
+INDEX_STRUCT_FNAME = "index_struct.json"
+
+
+class ObjectIndexStore(BaseIndexStore):
+    """Index store that keeps structs as objects.
+
+    SimpleIndexStore serialises the whole struct to a dict on every
+    add_index_struct, which would copy every row of a memory-mapped
+    embedding matrix into Python lists.
+    """
+
+    def __init__(self):
+        self._structs = {}
+
+    def index_structs(self) -> List[IndexStruct]:
+        return list(self._structs.values())
+
+    def add_index_struct(self, index_struct: IndexStruct) -> None:
+        self._structs[index_struct.index_id] = index_struct
+
+    def delete_index_struct(self, key: str) -> None:
+        self._structs.pop(key, None)
+
+    def get_index_struct(self, struct_id: Optional[str] = None) -> Optional[IndexStruct]:
+        if struct_id is None:
+            return next(iter(self._structs.values()), None)
+        return self._structs.get(struct_id)
+
+def is_binary_index(persist_dir: str) -> bool:
+    return os.path.exists(os.path.join(persist_dir, BINARY_FNAME))
+
+@traced("persist.save")
+def save_index(index: KnowledgeGraphIndex, persist_dir: str):
+    os.makedirs(persist_dir, exist_ok=True)
+    kg = index.index_struct
+    keys, matrix = EmbeddingMatrix.from_dict(kg.embedding_dict).to_matrix()
+    np.save(os.path.join(persist_dir, EMBEDDINGS_FNAME), np.ascontiguousarray(matrix, dtype=np.float32))
+    with open(os.path.join(persist_dir, INDEX_STRUCT_FNAME), 'w', encoding='utf-8') as file:
+        json.dump({
+            "index_id": kg.index_id,
+            "summary": kg.summary,
+            "table": {keyword: sorted(node_ids) for keyword, node_ids in kg.table.items()},
+        }, file, ensure_ascii=False)
+
+    graph_store = index.graph_store
+    if not isinstance(graph_store, CompactGraphStore):
+        graph_store = CompactGraphStore.from_graph_store(graph_store)
+    graph_store.save_arrays(persist_dir)
+    index.docstore.persist(os.path.join(persist_dir, DOCSTORE_FNAME))
+
+    # Written last: a folder only counts as binary once everything else is on disk
+    with open(os.path.join(persist_dir, BINARY_FNAME), 'w', encoding='utf-8') as file:
+        json.dump({
+            "format": "binary",
+            "version": BINARY_VERSION,
+            "embedding_dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+            "triplets": keys,
+        }, file, ensure_ascii=False)
+
+@traced("persist.load")
+def load_index(persist_dir: str) -> KnowledgeGraphIndex:
+    if not is_binary_index(persist_dir):
+        storage_context = StorageContext.from_defaults(persist_dir=persist_dir, graph_store=load_graph_store(persist_dir))
+        return load_index_from_storage(storage_context)
+
+    with open(os.path.join(persist_dir, BINARY_FNAME), 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    with open(os.path.join(persist_dir, INDEX_STRUCT_FNAME), 'r', encoding='utf-8') as file:
+        struct = json.load(file)
+    matrix = np.load(os.path.join(persist_dir, EMBEDDINGS_FNAME), mmap_mode="r")
+    kg = KG(
+        index_id=struct["index_id"],
+        summary=struct["summary"],
+        table={keyword: set(node_ids) for keyword, node_ids in struct["table"].items()},
+    )
+    kg.embedding_dict = EmbeddingMatrix(meta["triplets"], matrix)
+
+    storage_context = StorageContext.from_defaults(
+        docstore=SimpleDocumentStore.from_persist_path(os.path.join(persist_dir, DOCSTORE_FNAME)),
+        index_store=ObjectIndexStore(),
+        graph_store=load_graph_store(persist_dir),
+    )
+    return KnowledgeGraphIndex(index_struct=kg, storage_context=storage_context, include_embeddings=True)
+
+def convert_index_folder(persist_dir: str):
+    if is_binary_index(persist_dir):
+        print(f"{persist_dir} is already in binary format")
+        return
+    start = time.perf_counter()
+    index = load_index(persist_dir)
+    save_index(index, persist_dir)
+    print(f"Converted {persist_dir} in {time.perf_counter() - start:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert JSON index folders to the binary format")
+    parser.add_argument("persist_dirs", nargs="+")
+    args = parser.parse_args()
+    for persist_dir in args.persist_dirs:
+        convert_index_folder(persist_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import logging
+import os
+from dataclasses import dataclass, field
+import spacy
+from spacy.language import Language
+
+logger = logging.getLogger(__name__)
+
+SPACY_MODEL = "en_core_web_sm"
+PREFILTER_BATCH_SIZE = 32
+# Label for matches of the known Silmarillion names, which a general-purpose model mostly misses
+KNOWN_ENTITY_LABEL = "SILMARILLION"
+ENTITY_LABELS = {
+    KNOWN_ENTITY_LABEL, "PERSON", "NORP", "FAC", "ORG", "GPE", "LOC", "PRODUCT", "EVENT", "WORK_OF_ART", "LANGUAGE",
+}
+
+
+@dataclass
+class ChunkFocus:
+    """The part of a chunk worth sending to the LLM."""
+    text: str
+    entities: list = field(default_factory=list)
+    sentences: int = 0
+    kept: int = 0
+
+def load_nlp(known_entities, model: str = SPACY_MODEL) -> Language:
+    """A pipeline that splits sentences and tags the known names plus whatever its NER finds.
+
+    Without the model installed it falls back to a blank English pipeline;
+    capitalized words inside a sentence then stand in for the NER.
+    """
+    try:
+        nlp = spacy.load(model, exclude=["lemmatizer"])
+    except OSError:
+        logger.warning(f"spaCy model {model} is not installed, falling back to known names and capitalized words")
+        nlp = spacy.blank("en")
+        nlp.add_pipe("sentencizer")
+    ruler = nlp.add_pipe("entity_ruler", **({"before": "ner"} if "ner" in nlp.pipe_names else {}))
+    ruler.add_patterns([{"label": KNOWN_ENTITY_LABEL, "pattern": name} for name in known_entities])
+    return nlp
+
+def sentence_entities(sent, use_capitals: bool):
+    entities = [ent.text for ent in sent.ents if ent.label_ in ENTITY_LABELS]
+    if use_capitals:
+        in_entity = {token.i for ent in sent.ents for token in ent}
+        entities.extend(
+            token.text for token in sent[1:]
+            if token.is_title and token.is_alpha and not token.is_stop and token.i not in in_entity
+        )
+    return entities
+
+def focus_chunk(doc, use_capitals: bool) -> ChunkFocus:
+    kept = []
+    entities = {}
+    sentences = list(doc.sents)
+    for sent in sentences:
+        found = sentence_entities(sent, use_capitals)
+        if found:
+            kept.append(sent.text.strip())
+            entities.update(dict.fromkeys(found))
+    return ChunkFocus(" ".join(kept), list(entities), len(sentences), len(kept))
+
+def focus_chunks(texts, known_entities, n_process: int = None, batch_size: int = PREFILTER_BATCH_SIZE,
+                 model: str = SPACY_MODEL):
+    """A ChunkFocus per text: only the sentences naming a candidate entity, and those entities."""
+    nlp = load_nlp(known_entities, model)
+    use_capitals = "ner" not in nlp.pipe_names
+    n_process = n_process or os.cpu_count() or 1
+    docs = nlp.pipe(texts, n_process=min(n_process, max(len(texts), 1)), batch_size=batch_size)
+    return [focus_chunk(doc, use_capitals) for doc in docs]
@@ -1,50 +1,102 @@
+import argparse
+import glob
 import re
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 
 from semanticsilm.main import DATA_DIR, SOURCE_DIR
+from semanticsilm.chunks import chunk_file, data_files, save_chunk_manifest
 
-def split_chapters(input_file, output_dir):
-    # Create the output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+# The original single-book source, whose chapters live directly in DATA_DIR
+DEFAULT_BOOK = "raw"
+CHAPTER_HEADING = re.compile(r'CHAPTER \d+')
 
-    # Read the entire file
-    with open(input_file, 'r', encoding='utf-8') as file:
-        content = file.read()
 
-    # Split the content into chapters
-    chapters = re.split(r'\n\n+CHAPTER \d+\n\n+', content)
+def book_output_dir(input_file, data_dir):
+    book = os.path.splitext(os.path.basename(input_file))[0]
+    return data_dir if book == DEFAULT_BOOK else os.path.join(data_dir, book)
 
-    # Remove any leading/trailing whitespace from each chapter
-    chapters = [chapter.strip() for chapter in chapters if chapter.strip()]
+def iter_chapters(input_file):
+    # Streams the book and yields one chapter at a time, split where the
+    # old whole-file regex r'\n\n+CHAPTER \d+\n\n+' split it
+    lines = []
+    previous_blank = False
+    with open(input_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.rstrip('\n')
+            if previous_blank and CHAPTER_HEADING.fullmatch(line):
+                chapter = '\n'.join(lines).strip()
+                if chapter:
+                    yield chapter
+                lines = []
+            else:
+                lines.append(line)
+            previous_blank = line == ''
+    chapter = '\n'.join(lines).strip()
+    if chapter:
+        yield chapter
 
-    # Write each chapter to a separate file
-    for i, chapter in enumerate(chapters, 1):
-        # Extract the chapter title
-        title_match = re.match(r'([A-Z\s]+)\n\n', chapter)
-        if title_match:
-            title = title_match.group(1).strip()
-        else:
-            title = f"Chapter {i}"
+def write_chapter(output_dir, i, chapter):
+    # Extract the chapter title
+    title_match = re.match(r'([A-Z\s]+)\n\n', chapter)
+    if title_match:
+        title = title_match.group(1).strip()
+    else:
+        title = f"Chapter {i}"
 
-        # Create the filename
-        filename = f"chapter{i}.txt"
-        filepath = os.path.join(output_dir, filename)
+    filepath = os.path.join(output_dir, f"chapter{i}.txt")
+    content = f"CHAPTER {i}\n\n{title}\n\n{chapter}"
+    # Leave unchanged chapters alone: their modification time is part of the document hash
+    if os.path.exists(filepath):
+        with open(filepath, 'r', encoding='utf-8') as file:
+            if file.read() == content:
+                return filepath, False
+    with open(filepath, 'w', encoding='utf-8') as file:
+        file.write(content)
+    return filepath, True
 
-        # Write the chapter content to the file
-        with open(filepath, 'w', encoding='utf-8') as file:
-            file.write(f"CHAPTER {i}\n\n")
-            file.write(f"{title}\n\n")
-            file.write(chapter)
+def split_chapters(input_file, output_dir):
+    """Writes the book's chapters to output_dir and chunks each one as it is written."""
+    os.makedirs(output_dir, exist_ok=True)
+    entries = []
+    for i, chapter in enumerate(iter_chapters(input_file), 1):
+        filepath, written = write_chapter(output_dir, i, chapter)
+        if written:
+            print(f"Wrote {filepath}")
+        entries.append(chunk_file(filepath))
+    return entries
+
+def chunk_files(paths):
+    return [chunk_file(path) for path in paths]
 
-        print(f"Wrote {filename}")
+def preprocess(input_files, data_dir, workers=None):
+    start = time.perf_counter()
+    entries = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(split_chapters, input_file, book_output_dir(input_file, data_dir))
+                   for input_file in input_files]
+        for future in futures:
+            entries.extend(future.result())
+        # Hand-written files in data_dir (forewords, appendices) are chunked too,
+        # so the manifest covers everything the index build would read
+        written = {entry["path"] for entry in entries}
+        extra = [path for path in data_files(data_dir) if os.path.abspath(path) not in written]
+        entries.extend(executor.map(chunk_file, extra))
+    save_chunk_manifest(entries, data_dir)
+    chunks = sum(len(entry["chunks"]) for entry in entries)
+    print(f"Preprocessed {len(input_files)} books into {len(entries)} files and {chunks} chunks "
+          f"in {time.perf_counter() - start:.1f}s")
 
 def main():
-    input_file = f"{SOURCE_DIR}/raw.txt"
-    output_dir = DATA_DIR
-    split_chapters(input_file, output_dir)
+    parser = argparse.ArgumentParser(description="Split source books into chapters and pre-chunk them")
+    parser.add_argument("input_files", nargs="*", help=f"books to split (default: every .txt in {SOURCE_DIR})")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="processes to use (default: one per CPU)")
+    args = parser.parse_args()
+    input_files = args.input_files or sorted(glob.glob(os.path.join(SOURCE_DIR, "*.txt")))
+    preprocess(input_files, args.data_dir, args.workers)
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from semanticsilm.analytics import ANALYTICS_FNAME
+from semanticsilm.manifest import MANIFEST_FNAME
+from semanticsilm.persistence import BINARY_FNAME
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_FNAME = "query_cache.json"
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+# New answers are written out at most this often; flush() writes the rest
+SAVE_INTERVAL = 30.0
+# Any of these changing means the index was rebuilt, converted or re-ranked in place
+INDEX_FILES = [BINARY_FNAME, "index_store.json", "graph_store.json", MANIFEST_FNAME, ANALYTICS_FNAME]
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
+
+def index_fingerprint(persist_dir: str) -> str:
+    parts = []
+    for fname in INDEX_FILES:
+        path = os.path.join(persist_dir, fname)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{fname}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+@dataclass
+class QueryCacheStats:
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evicted: int = 0
+
+    def summary(self) -> str:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        hit_rate = (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+        return (f"Query cache: {self.exact_hits} exact hits, {self.semantic_hits} semantic hits, "
+                f"{self.misses} misses ({hit_rate:.0%} hit rate), {self.expired} expired, {self.evicted} evicted")
+
+class QueryCache:
+    """Two-tier cache of REPL answers for one index folder.
+
+    The first tier matches the normalized query text. The second embeds the
+    query and reuses the answer to any cached query whose embedding is at
+    least similarity_threshold cosine-similar. Entries expire after ttl
+    seconds, the least recently used are evicted past max_entries, and the
+    whole cache is dropped when the index folder's files change. It is kept
+    in the index folder, so an updated index (a new folder) starts empty.
+
+    New answers are saved at most every save_interval seconds, outside the
+    lock queries take, so call flush() before the process exits.
+    """
+
+    def __init__(self, persist_dir: str, embed_model: BaseEmbedding = None,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL,
+                 similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD, save_interval: float = SAVE_INTERVAL):
+        self.path = os.path.join(persist_dir, QUERY_CACHE_FNAME)
+        self.fingerprint = index_fingerprint(persist_dir)
+        self.embed_model = embed_model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.save_interval = save_interval
+        self.stats = QueryCacheStats()
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._lock = threading.Lock()
+        # Serializes writes of the file, which happen without holding _lock
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if data.get("fingerprint") != self.fingerprint:
+            logger.info(f"Index files changed, discarding {self.path}")
+            return
+        for key, entry in data["entries"]:
+            self._entries[key] = entry
+
+    def _save(self, entries):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump({"fingerprint": self.fingerprint, "entries": entries}, file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save query cache to {self.path}: {e}")
+
+    def flush(self, force: bool = True):
+        """Writes the cache out if it changed (and, unless force, save_interval has passed).
+
+        Without force, a query never waits for another thread's write: the
+        change is left for the next save.
+        """
+        if not self._save_lock.acquire(blocking=force):
+            return
+        try:
+            with self._lock:
+                if not self._dirty or (not force and time.monotonic() - self._saved_at < self.save_interval):
+                    return
+                # Entries are replaced rather than mutated, so a shallow copy is a consistent snapshot
+                entries = list(self._entries.items())
+                self._dirty = False
+                self._saved_at = time.monotonic()
+            self._save(entries)
+        finally:
+            self._save_lock.release()
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self.stats.expired += len(expired)
+            self._matrix = None
+
+    def _semantic_match(self, embedding, similarity_threshold: float):
+        keys = [key for key, entry in self._entries.items() if entry.get("embedding") is not None]
+        if not keys:
+            return None
+        if self._matrix is None or self._matrix[0] != keys:
+            matrix = np.asarray([self._entries[key]["embedding"] for key in keys], dtype=np.float32)
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            self._matrix = (keys, matrix)
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = self._matrix[1] @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        best = int(np.argmax(scores))
+        if scores[best] >= similarity_threshold:
+            logger.info(f"Semantic cache hit ({scores[best]:.3f}): {keys[best]}")
+            return keys[best]
+        return None
+
+    def embed(self, query: str):
+        if self.embed_model is None:
+            return None
+        return self.embed_model.get_text_embedding(query)
+
+    def lookup(self, query: str, similarity_threshold: float = None):
+        """Cached answer and the query's embedding (None if not needed or available).
+
+        similarity_threshold defaults to the cache's.
+        """
+        if similarity_threshold is None:
+            similarity_threshold = self.similarity_threshold
+        key = normalize_query(query)
+        with self._lock:
+            self._expire(time.time())
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats.exact_hits += 1
+                return self._entries[key]["response"], None
+        embedding = self.embed(query)
+        with self._lock:
+            match = self._semantic_match(embedding, similarity_threshold) if embedding is not None else None
+            if match is not None:
+                self._entries.move_to_end(match)
+                self.stats.semantic_hits += 1
+                return self._entries[match]["response"], embedding
+            self.stats.misses += 1
+        return None, embedding
+
+    def put(self, query: str, response: str, embedding=None):
+        key = normalize_query(query)
+        entry = {
+            "response": response,
+            "embedding": [float(x) for x in embedding] if embedding is not None else None,
+            "created": time.time(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evicted += 1
+            self._matrix = None
+            self._dirty = True
+        self.flush(force=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._dirty = True
+        self.flush()
+
+    def __len__(self):
+        return len(self._entries)
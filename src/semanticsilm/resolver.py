@@ -0,0 +1,120 @@
+import argparse
+import logging
+import math
+import time
+from collections import defaultdict
+from rapidfuzz import fuzz, process
+
+logger = logging.getLogger(__name__)
+
+
+def preprocess_entity(entity):
+    return entity.lower().strip()
+
+def length_bounds(length: int, threshold: float):
+    # fuzz.ratio is 200 * matches / (len1 + len2) and matches <= the shorter
+    # length, so strings too short or too long can never clear the threshold
+    if threshold <= 0:
+        return 0, math.inf
+    low = math.ceil(length * threshold / (200 - threshold))
+    high = math.floor(length * (200 - threshold) / threshold) if threshold < 200 else length
+    return low, high
+
+class EntityResolver:
+    """Indexed replacement for the linear fuzzy scan in main.link_entity.
+
+    Gives the same answer as link_entity: the first entry of entity_map, in
+    insertion order, whose thefuzz ratio with the entity is above threshold.
+    """
+
+    def __init__(self, entity_map: dict = None, links: dict = None, threshold: int = 80):
+        self.entity_map = {} if entity_map is None else entity_map
+        self.links = {} if links is None else links
+        self.threshold = threshold
+        self._keys = []
+        self._by_length = defaultdict(list)
+        self._resolved = {}
+        for known_entity in self.entity_map:
+            self._add_known(known_entity)
+
+    def _add_known(self, known_entity: str):
+        self._by_length[len(known_entity)].append(len(self._keys))
+        self._keys.append(known_entity)
+
+    def _candidates(self, processed_entity: str):
+        low, high = length_bounds(len(processed_entity), self.threshold)
+        positions = []
+        for length, bucket in self._by_length.items():
+            if low <= length <= high:
+                positions.extend(bucket)
+        positions.sort()
+        return positions
+
+    def _first_match(self, processed_entity: str):
+        positions = self._candidates(processed_entity)
+        if not positions:
+            return None
+        choices = [self._keys[position] for position in positions]
+        matches = process.extract(processed_entity, choices, scorer=fuzz.ratio,
+                                  score_cutoff=self.threshold, limit=None)
+        # thefuzz rounds rapidfuzz's float score to an int before comparing
+        passing = [positions[i] for _, score, i in matches if int(round(score)) > self.threshold]
+        return self._keys[min(passing)] if passing else None
+
+    def link(self, entity: str) -> str:
+        processed_entity = preprocess_entity(entity)
+        if processed_entity in self._resolved:
+            return self._resolved[processed_entity]
+        known_entity = self._first_match(processed_entity)
+        if known_entity is not None:
+            mapped_entity = self.entity_map[known_entity]
+            logger.debug(f"Linked entity: {entity} -> {mapped_entity} (via {known_entity})")
+        else:
+            mapped_entity = entity
+            self.entity_map[processed_entity] = entity
+            self._add_known(processed_entity)
+            logger.debug(f"New entity encountered: {entity}")
+        # Later entity_map entries never change an earlier first match, so this stays valid
+        self._resolved[processed_entity] = mapped_entity
+        return mapped_entity
+
+    def resolve(self, entity: str) -> str:
+        if entity not in self.links:
+            self.links[entity] = self.link(entity)
+        return self.links[entity]
+
+def linking_order(items):
+    for subj, relations in items:
+        yield subj
+        for _, obj in relations:
+            yield obj
+
+def main():
+    from semanticsilm.graph_store import graph_items, load_graph_store
+    from semanticsilm.main import link_entity
+
+    parser = argparse.ArgumentParser(description="Compare EntityResolver against the linear link_entity scan")
+    parser.add_argument("persist_dir", help="index folder containing graph_store.json")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    entities = list(linking_order(graph_items(load_graph_store(args.persist_dir))))
+
+    start = time.perf_counter()
+    entity_map = {}
+    linear = [link_entity(entity, entity_map) for entity in entities]
+    linear_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    resolver = EntityResolver()
+    indexed = [resolver.link(entity) for entity in entities]
+    indexed_seconds = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(linear, indexed) if a != b)
+    print(f"Entities linked: {len(entities)} ({len(entity_map)} distinct)")
+    print(f"link_entity:    {linear_seconds:.3f}s")
+    print(f"EntityResolver: {indexed_seconds:.3f}s ({linear_seconds / max(indexed_seconds, 1e-9):.1f}x)")
+    print(f"Mismatches: {mismatches}")
+
+if __name__ == "__main__":
+    main()
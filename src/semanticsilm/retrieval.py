@@ -0,0 +1,325 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import List, Optional
+import numpy as np
+from llama_index.core import KnowledgeGraphIndex, Settings
+from llama_index.core.indices.knowledge_graph.retrievers import (
+    DEFAULT_NODE_SCORE, GLOBAL_EXPLORE_NODE_LIMIT, KGRetrieverMode, KGTableRetriever,
+)
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+from llama_index.core.utils import print_text, truncate_text
+from semanticsilm.analytics import GraphAnalytics
+from semanticsilm.embeddings import EmbeddingMatrix
+from semanticsilm.stats import count_tokens
+from semanticsilm.telemetry import span, traced
+
+logger = logging.getLogger(__name__)
+
+# Below this many triplets an exact scan is a single fast matmul anyway
+APPROXIMATE_MIN_ROWS = 100_000
+KMEANS_ITERATIONS = 10
+# k-means trains on this many points per cluster rather than on every row
+KMEANS_POINTS_PER_CLUSTER = 40
+ASSIGN_BLOCK_ROWS = 65_536
+# Triplets kept after ranking by the index's graph analytics; None keeps
+# max_knowledge_sequence of them, as many as the stock retriever does
+RANKED_TRIPLETS = None
+# Query entities whose neighbourhood summary goes into the KG context
+SUMMARIZED_ENTITIES = 3
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def row_norms(matrix: np.ndarray, block_rows: int = 65_536) -> np.ndarray:
+    # Blocked so a memory-mapped matrix is never copied whole
+    norms = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        norms[start:start + block_rows] = np.sqrt(np.einsum("ij,ij->i", block, block))
+    norms[norms == 0] = 1.0
+    return norms
+
+class IVFIndex:
+    """Inverted-file index over unit vectors, built locally with spherical k-means.
+
+    A query is scored against the centroids, and only the rows in the
+    nprobe closest clusters are scored exactly.
+    """
+
+    def __init__(self, matrix: np.ndarray, norms: np.ndarray, nlist: int = None, nprobe: int = None,
+                 seed: int = 0):
+        rows = len(matrix)
+        self.nlist = nlist or max(1, int(np.sqrt(rows)))
+        self.nprobe = nprobe or max(1, self.nlist // 16)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(rows, min(rows, KMEANS_POINTS_PER_CLUSTER * self.nlist), replace=False))
+        points = np.asarray(matrix[sample], dtype=np.float32) / norms[sample, None]
+        centroids = points[rng.choice(len(points), min(self.nlist, len(points)), replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(points @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind="stable")
+            clusters, starts = np.unique(assignment[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[clusters] = np.add.reduceat(points[order], starts, axis=0)
+            lengths = np.linalg.norm(sums, axis=1)
+            # Empty clusters keep their old centroid
+            filled = lengths > 0
+            centroids[filled] = sums[filled] / lengths[filled, None]
+        self.centroids = centroids
+
+        assignment = np.empty(rows, dtype=np.int64)
+        for start in range(0, rows, ASSIGN_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+            assignment[start:start + ASSIGN_BLOCK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+        # Cluster members as one flat array with offsets, like the graph store's CSR
+        self.rows = np.argsort(assignment, kind="stable")
+        self.offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=len(centroids)), out=self.offsets[1:])
+
+    def candidates(self, unit_query: np.ndarray) -> np.ndarray:
+        probes = top_k(self.centroids @ unit_query, self.nprobe)
+        return np.concatenate([self.rows[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+
+class TripletEmbeddings:
+    """All triplet embeddings of an index as one matrix, scored by cosine similarity."""
+
+    def __init__(self, embedding_dict, approximate: Optional[bool] = None, nlist: int = None,
+                 nprobe: int = None):
+        self.keys, self.matrix = EmbeddingMatrix.from_dict(embedding_dict).to_matrix()
+        self.norms = row_norms(self.matrix) if len(self.keys) else np.empty(0, dtype=np.float32)
+        if approximate is None:
+            approximate = len(self.keys) >= APPROXIMATE_MIN_ROWS
+        self.ivf = IVFIndex(self.matrix, self.norms, nlist, nprobe) if approximate and len(self.keys) else None
+
+    def search(self, query_embedding, k: int):
+        if not self.keys:
+            return [], []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = float(np.linalg.norm(query)) or 1.0
+        if self.ivf is not None:
+            rows = self.ivf.candidates(query / query_norm)
+            scores = (self.matrix[rows] @ query) / (self.norms[rows] * query_norm)
+            best = rows[top_k(scores, k)]
+            best_scores = (self.matrix[best] @ query) / (self.norms[best] * query_norm)
+        else:
+            scores = (self.matrix @ query) / (self.norms * query_norm)
+            best = top_k(scores, k)
+            best_scores = scores[best]
+        return [float(score) for score in best_scores], [self.keys[row] for row in best]
+
+class MatrixKGTableRetriever(KGTableRetriever):
+    """KGTableRetriever with the triplet similarity search done in NumPy.
+
+    The stock retriever rebuilds a list of every embedding and scores them one
+    at a time on each query. This one builds TripletEmbeddings once, on the
+    first embedding query, and otherwise retrieves exactly as KGTableRetriever.
+
+    Given the index's GraphAnalytics, the retrieved triplets are ranked (query
+    entities, their communities, then centrality) and cut to ranked_triplets
+    (by default max_knowledge_sequence) before the chunks are picked, and the
+    KG context opens with a summary of each query entity.
+
+    With max_context_tokens set, the KG context and then the best chunks are
+    kept only as far as they fit in that many tokens.
+    """
+
+    def __init__(self, index: KnowledgeGraphIndex, approximate: Optional[bool] = None,
+                 nlist: int = None, nprobe: int = None, analytics: GraphAnalytics = None,
+                 ranked_triplets: int = RANKED_TRIPLETS, max_context_tokens: int = None,
+                 triplet_embeddings: TripletEmbeddings = None, **kwargs):
+        super().__init__(index, **kwargs)
+        self._analytics = analytics
+        self._ranked_triplets = ranked_triplets if ranked_triplets is not None else self.max_knowledge_sequence
+        self._max_context_tokens = max_context_tokens
+        self._approximate = approximate
+        self._nlist = nlist
+        self._nprobe = nprobe
+        # Engines over the same index can share one matrix
+        self._triplet_embeddings = triplet_embeddings
+        self._triplet_embeddings_lock = threading.Lock()
+
+    @property
+    def triplet_embeddings(self) -> TripletEmbeddings:
+        with self._triplet_embeddings_lock:
+            if self._triplet_embeddings is None:
+                self._triplet_embeddings = TripletEmbeddings(
+                    self._index_struct.embedding_dict, self._approximate, self._nlist, self._nprobe
+                )
+            return self._triplet_embeddings
+
+    @traced("retrieve.keywords")
+    def _keyword_rel_texts(self, keywords: List[str], chunk_indices_count: dict, cur_rel_map: dict) -> List[str]:
+        rel_texts = []
+        node_visited = set()
+        for keyword in keywords:
+            subjs = {keyword}
+            node_ids = self._index_struct.search_node_by_keyword(keyword)
+            for node_id in node_ids[:GLOBAL_EXPLORE_NODE_LIMIT]:
+                if node_id in node_visited:
+                    continue
+                if self._include_text:
+                    chunk_indices_count[node_id] += 1
+                node_visited.add(node_id)
+                if self.use_global_node_triplets:
+                    subjs.update(self._get_keywords(
+                        self._docstore.get_node(node_id).get_content(metadata_mode=MetadataMode.LLM)
+                    ))
+            rel_map = self._graph_store.get_rel_map(list(subjs), self.graph_store_query_depth)
+            logger.debug(f"rel_map: {rel_map}")
+            if not rel_map:
+                continue
+            rel_texts.extend(str(rel_obj) for rel_objs in rel_map.values() for rel_obj in rel_objs)
+            cur_rel_map.update(rel_map)
+        return rel_texts
+
+    @traced("retrieve.embedding")
+    def _embedding_rel_texts(self, query_bundle: QueryBundle) -> List[str]:
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = self._embed_model.get_text_embedding(query_bundle.query_str)
+        similarities, top_rel_texts = self.triplet_embeddings.search(query_embedding, self.similarity_top_k)
+        logger.debug(f"Found the following rel_texts+query similarites: {similarities!s}")
+        return top_rel_texts
+
+    @traced("retrieve")
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        rel_texts = []
+        cur_rel_map = {}
+        chunk_indices_count = defaultdict(int)
+        keywords = []
+        if self._retriever_mode != KGRetrieverMode.EMBEDDING:
+            with span("retrieve.extract_keywords"):
+                keywords = self._get_keywords(query_bundle.query_str)
+            if self._verbose:
+                print_text(f"Extracted keywords: {keywords}\n", color="green")
+            rel_texts.extend(self._keyword_rel_texts(keywords, chunk_indices_count, cur_rel_map))
+
+        if self._retriever_mode != KGRetrieverMode.KEYWORD and len(self._index_struct.embedding_dict) > 0:
+            rel_texts.extend(self._embedding_rel_texts(query_bundle))
+        elif len(self._index_struct.embedding_dict) == 0:
+            logger.warning("Index was not constructed with embeddings, skipping embedding usage...")
+
+        if self._retriever_mode == KGRetrieverMode.HYBRID:
+            # Drop duplicates and texts contained in a longer one, longest first like
+            # KGTableRetriever; it breaks ties in set order, here they keep the order
+            # they were found in (keyword walk, then embeddings) so runs are repeatable
+            kept = []
+            for rel_text in sorted(dict.fromkeys(rel_texts), key=len, reverse=True):
+                if not any(rel_text in longer for longer in kept):
+                    kept.append(rel_text)
+            rel_texts = kept
+
+        if self._analytics is not None:
+            ranked = self._analytics.rank_triplets(rel_texts, keywords, self._ranked_triplets)
+            logger.debug(f"Kept {len(ranked)} of {len(rel_texts)} triplets")
+            rel_texts = ranked
+        if self._retriever_mode == KGRetrieverMode.HYBRID:
+            rel_texts = rel_texts[:self.max_knowledge_sequence]
+
+        if self._include_text:
+            for keyword in self._extract_rel_text_keywords(rel_texts):
+                for node_id in self._index_struct.search_node_by_keyword(keyword):
+                    chunk_indices_count[node_id] += 1
+
+        sorted_chunk_indices = sorted(chunk_indices_count, key=lambda x: chunk_indices_count[x], reverse=True)
+        sorted_chunk_indices = sorted_chunk_indices[:self.num_chunks_per_query]
+        sorted_nodes = self._docstore.get_nodes(sorted_chunk_indices)
+        summaries = self._entity_summaries(keywords)
+        budget = self._max_context_tokens
+        if budget is not None and rel_texts:
+            rel_texts = self._fit_rel_texts(rel_texts, summaries, budget)
+            if rel_texts:
+                budget -= count_tokens(self._rel_info_text(rel_texts, summaries))
+        sorted_nodes_with_scores = []
+        for chunk_idx, node in zip(sorted_chunk_indices, sorted_nodes):
+            if budget is not None:
+                tokens = count_tokens(node.get_content(metadata_mode=MetadataMode.LLM))
+                if tokens > budget:
+                    logger.info(f"> Skipping idx {chunk_idx}: {tokens} tokens, {budget} left in the context budget")
+                    continue
+                budget -= tokens
+            sorted_nodes_with_scores.append(NodeWithScore(node=node, score=DEFAULT_NODE_SCORE))
+            logger.info(f"> Querying with idx: {chunk_idx}: {truncate_text(node.get_content(), 80)}")
+
+        if not rel_texts:
+            logger.info("> No relationships found, returning nodes found by keywords.")
+            if not sorted_nodes_with_scores:
+                logger.info("> No nodes found by keywords, returning empty response.")
+                return [NodeWithScore(node=TextNode(text="No relationships found."), score=1.0)]
+            return sorted_nodes_with_scores
+
+        sorted_nodes_with_scores.append(NodeWithScore(
+            node=self._rel_text_node(rel_texts, cur_rel_map, summaries),
+            score=DEFAULT_NODE_SCORE,
+        ))
+        return sorted_nodes_with_scores
+
+    def _entity_summaries(self, keywords: List[str]) -> List[str]:
+        if self._analytics is None:
+            return []
+        summaries = dict.fromkeys(filter(None, (self._analytics.describe(keyword) for keyword in keywords)))
+        return list(summaries)[:SUMMARIZED_ENTITIES]
+
+    def _rel_info_text(self, rel_texts: List[str], summaries: List[str] = ()) -> str:
+        rel_initial_text = (
+            f"The following are knowledge sequence in max depth"
+            f" {self.graph_store_query_depth} "
+            f"in the form of directed graph like:\n"
+            f"`subject -[predicate]->, object, <-[predicate_next_hop]-,"
+            f" object_next_hop ...`"
+        )
+        return "\n".join([*summaries, rel_initial_text, *rel_texts])
+
+    def _fit_rel_texts(self, rel_texts: List[str], summaries: List[str], budget: int) -> List[str]:
+        """The longest prefix of the (ranked) rel_texts whose KG context fits in budget tokens."""
+        used = count_tokens(self._rel_info_text([], summaries))
+        kept = 0
+        for rel_text in rel_texts:
+            # One more token for the line break
+            used += count_tokens(rel_text) + 1
+            if used > budget:
+                break
+            kept += 1
+        if kept < len(rel_texts):
+            logger.info(f"> Kept {kept} of {len(rel_texts)} triplets within the {budget} token context budget")
+        return rel_texts[:kept]
+
+    def _rel_text_node(self, rel_texts: List[str], cur_rel_map: dict, summaries: List[str] = ()) -> TextNode:
+        rel_node_info = {"kg_rel_texts": rel_texts, "kg_rel_map": cur_rel_map}
+        if self._graph_schema != "":
+            rel_node_info["kg_schema"] = {"schema": self._graph_schema}
+        rel_info_text = self._rel_info_text(rel_texts, summaries)
+        if self._verbose:
+            print_text(f"KG context:\n{rel_info_text}\n", color="blue")
+        return TextNode(
+            text=rel_info_text,
+            metadata=rel_node_info,
+            excluded_embed_metadata_keys=["kg_rel_map", "kg_rel_texts"],
+            excluded_llm_metadata_keys=["kg_rel_map", "kg_rel_texts"],
+        )
+
+def build_query_engine(index: KnowledgeGraphIndex, approximate: Optional[bool] = None,
+                       analytics: GraphAnalytics = None, **kwargs) -> RetrieverQueryEngine:
+    """Drop-in for index.as_query_engine(**kwargs) using MatrixKGTableRetriever."""
+    if len(index.index_struct.embedding_dict) > 0:
+        kwargs.setdefault("retriever_mode", KGRetrieverMode.HYBRID)
+    retriever = MatrixKGTableRetriever(
+        index,
+        approximate=approximate,
+        analytics=analytics,
+        llm=index._llm,
+        embed_model=index._embed_model,
+        object_map=index._object_map,
+        **kwargs,
+    )
+    return RetrieverQueryEngine.from_args(retriever, llm=Settings.llm, **kwargs)
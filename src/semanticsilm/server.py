@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import logging
+import os
+import re
+import signal
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from aiohttp import web
+from semanticsilm.batch_query import DEFAULT_WORKERS, QueryRunner
+from semanticsilm.main import RESPONSE_MODES, configure_settings, latest_index_folder
+from semanticsilm.telemetry import tracer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+# Latencies kept for the p50/p95 in /metrics
+LATENCY_WINDOW = 1000
+MAX_SPANS = 10_000
+
+
+class QueryService:
+    """Answers queries from a loaded index folder that can be swapped for another while serving.
+
+    Queries run on a thread pool. Each request keeps the runner it started
+    with, so a reload only affects requests that arrive after the swap.
+    """
+
+    def __init__(self, index_folder: str = None, workers: int = DEFAULT_WORKERS, use_cache: bool = True,
+                 **runner_kwargs):
+        self.index_folder = index_folder
+        self.use_cache = use_cache
+        self.runner_kwargs = runner_kwargs
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self.runner = None
+        self.loaded_at = None
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.reloads = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._reload_lock = asyncio.Lock()
+
+    async def reload(self, index_folder: str = None) -> QueryRunner:
+        """Loads index_folder (default: the newest) off the event loop, then swaps it in."""
+        async with self._reload_lock:
+            index_folder = index_folder or latest_index_folder()
+            if index_folder is None or not os.path.isdir(index_folder):
+                raise FileNotFoundError(f"No index folder {index_folder}")
+            loop = asyncio.get_running_loop()
+            runner = await loop.run_in_executor(
+                self.executor, partial(QueryRunner, index_folder, self.use_cache, **self.runner_kwargs))
+            previous = self.runner
+            self.runner, self.index_folder, self.loaded_at = runner, index_folder, time.time()
+            if previous is not None:
+                self.reloads += 1
+                if previous.query_cache is not None:
+                    previous.query_cache.flush()
+                logger.info(f"Swapped {previous.index_folder} for {index_folder}")
+            return runner
+
+    async def reload_in_background(self, index_folder: str = None):
+        try:
+            await self.reload(index_folder)
+        except Exception:
+            logger.exception(f"Could not load index folder {index_folder or latest_index_folder()}")
+
+    async def answer(self, query: str, **query_settings) -> dict:
+        """Answers query with the runner's mode, context limit and cache similarity threshold, unless
+        query_settings overrides them."""
+        runner = self.runner
+        if runner is None:
+            raise web.HTTPServiceUnavailable(reason="index is still loading")
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, partial(runner.answer, query, **query_settings))
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.latencies.append(result["latency_ms"])
+        tracer.trim(MAX_SPANS)
+        return {**result, "index_folder": runner.index_folder}
+
+    def health(self) -> dict:
+        return {
+            "status": "ok" if self.runner is not None else "loading",
+            "index_folder": self.index_folder,
+            "loaded_at": self.loaded_at,
+            "uptime_seconds": time.time() - self.started_at,
+        }
+
+    def metrics(self) -> str:
+        """Prometheus text exposition of request counts, latency quantiles and tracer counters.
+
+        Tracer counters get a prefix of their own, so they can't collide with
+        the metrics above (the tracer counts query cache misses too).
+        """
+        metrics = [
+            ("semanticsilm_requests_total", "counter", [("", self.requests)]),
+            ("semanticsilm_errors_total", "counter", [("", self.errors)]),
+            ("semanticsilm_in_flight", "gauge", [("", self.in_flight)]),
+            ("semanticsilm_reloads_total", "counter", [("", self.reloads)]),
+            ("semanticsilm_index_loaded", "gauge", [("", int(self.runner is not None))]),
+        ]
+        if self.latencies:
+            p50, p95 = np.percentile(np.asarray(self.latencies), [50, 95])
+            metrics.append(("semanticsilm_latency_ms", "summary",
+                            [('{quantile="0.5"}', round(p50, 1)), ('{quantile="0.95"}', round(p95, 1))]))
+        cache = self.runner.query_cache if self.runner is not None else None
+        if cache is not None:
+            metrics.append(("semanticsilm_query_cache_exact_hits", "counter", [("", cache.stats.exact_hits)]))
+            metrics.append(("semanticsilm_query_cache_semantic_hits", "counter", [("", cache.stats.semantic_hits)]))
+            metrics.append(("semanticsilm_query_cache_misses", "counter", [("", cache.stats.misses)]))
+        for name, value in sorted(tracer.counters.items()):
+            metrics.append((f"semanticsilm_tracer_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}", "counter", [("", value)]))
+        lines = []
+        for name, kind, samples in metrics:
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{labels} {value:g}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+async def json_body(request: web.Request) -> dict:
+    """The request's JSON object, or a 400 if the body is not one."""
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(reason="body is not valid JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(reason="body must be a JSON object")
+    return body
+
+async def handle_query(request: web.Request) -> web.Response:
+    service = request.app["service"]
+    if request.method == "POST":
+        body = await json_body(request)
+        query = body.get("query")
+    else:
+        body = request.query
+        query = body.get("q")
+    mode, context_tokens, similarity_threshold = (
+        body.get("mode"), body.get("context_tokens"), body.get("similarity_threshold"))
+    if not isinstance(query, str) or not query.strip():
+        raise web.HTTPBadRequest(reason="query must be a non-empty string")
+    query_settings = {}
+    if mode is not None:
+        if not isinstance(mode, str) or mode not in RESPONSE_MODES:
+            raise web.HTTPBadRequest(reason=f"mode must be one of {', '.join(RESPONSE_MODES)}")
+        query_settings["mode"] = mode
+    if context_tokens is not None:
+        try:
+            context_tokens = int(context_tokens)
+        except (TypeError, ValueError):
+            context_tokens = 0
+        if context_tokens < 1:
+            raise web.HTTPBadRequest(reason="context_tokens must be a positive whole number")
+        query_settings["max_context_tokens"] = context_tokens
+    if similarity_threshold is not None:
+        try:
+            similarity_threshold = float(similarity_threshold)
+        except (TypeError, ValueError):
+            similarity_threshold = 0
+        if not 0 < similarity_threshold <= 1:
+            raise web.HTTPBadRequest(reason="similarity_threshold must be above 0 and at most 1")
+        query_settings["similarity_threshold"] = similarity_threshold
+    return web.json_response(await service.answer(query, **query_settings))
+
+async def handle_health(request: web.Request) -> web.Response:
+    health = request.app["service"].health()
+    return web.json_response(health, status=200 if health["status"] == "ok" else 503)
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=request.app["service"].metrics(), content_type="text/plain")
+
+async def handle_reload(request: web.Request) -> web.Response:
+    body = await json_body(request) if request.can_read_body else {}
+    try:
+        runner = await request.app["service"].reload(body.get("index_folder"))
+    except FileNotFoundError as error:
+        raise web.HTTPNotFound(reason=str(error))
+    return web.json_response({"index_folder": runner.index_folder, "load_seconds": runner.load_seconds})
+
+def create_app(service: QueryService) -> web.Application:
+    app = web.Application()
+    app["service"] = service
+    app.router.add_get("/query", handle_query)
+    app.router.add_post("/query", handle_query)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_post("/reload", handle_reload)
+
+    async def start(app):
+        # Start listening right away; /health reports "loading" until the index is in
+        app["initial_load"] = asyncio.create_task(service.reload_in_background(service.index_folder))
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGHUP, lambda: asyncio.create_task(service.reload_in_background(latest_index_folder()))
+            )
+        except (NotImplementedError, AttributeError):
+            pass
+
+    async def stop(app):
+        service.executor.shutdown(wait=False)
+        if service.runner is not None and service.runner.query_cache is not None:
+            service.runner.query_cache.flush()
+
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve queries against an index folder over HTTP")
+    parser.add_argument("index_folder", nargs="?", default=None, help="index folder (default: the newest)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="queries answered at once")
+    parser.add_argument("--no-cache", action="store_true", help="don't answer from query_cache.json")
+    parser.add_argument("--ranked-triplets", type=int, default=None,
+                        help="triplets kept after graph ranking (default: max_knowledge_sequence, 30)")
+    parser.add_argument("--similarity-threshold", type=float, default=None,
+                        help="cosine similarity at which a cached query's answer is reused (default: 0.95)")
+    args = parser.parse_args()
+    if args.ranked_triplets is not None and args.ranked_triplets < 1:
+        parser.error("--ranked-triplets must be at least 1")
+    if args.similarity_threshold is not None and not 0 < args.similarity_threshold <= 1:
+        parser.error("--similarity-threshold must be above 0 and at most 1")
+
+    configure_settings()
+    service = QueryService(args.index_folder, workers=args.workers, use_cache=not args.no_cache,
+                           similarity_threshold=args.similarity_threshold, ranked_triplets=args.ranked_triplets)
+    web.run_app(create_app(service), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import subprocess
+import sys
+
+# Slow to import and only needed to build an index or draw the graph
+HEAVY_PACKAGES = ["llama_index.core", "llama_index.llms.openai", "openai", "spacy", "thefuzz", "matplotlib",
+                  "plotly", "pyvis", "networkx", "community", "scipy"]
+DEFAULT_MODULES = ["semanticsilm.main", "semanticsilm.batch_query", "semanticsilm.server"]
+
+
+def import_times(module: str):
+    """(package, self seconds, cumulative seconds) for every import made by importing module in a fresh interpreter.
+
+    Modules the interpreter imports at startup (site and friends) are left out.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        # Nested imports are indented and listed before the module importing them
+        if not name.startswith("  ") and name.strip() != module:
+            times = []
+            continue
+        times.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+        if name.strip() == module:
+            break
+    return times
+
+def report(module: str, top: int) -> str:
+    times = import_times(module)
+    imported = {name for name, _, _ in times}
+    total = next(cumulative for name, _, cumulative in times if name == module)
+    lines = [f"import {module}: {total:.2f}s, {len(times)} modules"]
+    for name, _, cumulative in sorted(times, key=lambda item: -item[2])[1:top + 1]:
+        lines.append(f"  {cumulative:>7.3f}s  {name}")
+    heavy = [package for package in HEAVY_PACKAGES if package in imported]
+    lines.append(f"  heavy packages imported: {', '.join(heavy) if heavy else 'none'}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Report what importing the entry points costs")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list per module")
+    args = parser.parse_args()
+    for module in args.modules:
+        print(report(module, args.top))
+
+if __name__ == "__main__":
+    main()
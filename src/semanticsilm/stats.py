@@ -0,0 +1,57 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from semanticsilm.telemetry import count, span
+
+
+def count_tokens(text: str) -> int:
+    from llama_index.core.utils import get_tokenizer
+    return len(get_tokenizer()(text))
+
+@dataclass
+class StageStats:
+    name: str
+    calls: int = 0
+    hits: int = 0
+    tokens: int = 0
+    # Prompt tokens avoided, e.g. by pre-extraction trimming chunks
+    saved: int = 0
+    seconds: float = 0.0
+
+class BuildStats:
+    def __init__(self):
+        self.stages = {}
+
+    def get(self, name: str) -> StageStats:
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name: str):
+        stage = self.get(name)
+        start = time.perf_counter()
+        try:
+            with span(f"build.{name}"):
+                yield stage
+        finally:
+            stage.seconds += time.perf_counter() - start
+
+    def record_call(self, name: str, tokens: int = 0):
+        stage = self.get(name)
+        stage.calls += 1
+        stage.tokens += tokens
+        count(f"{name}.calls")
+        count(f"{name}.tokens", tokens)
+
+    def summary(self) -> str:
+        lines = [f"{'stage':<12} {'calls':>8} {'hits':>8} {'tokens':>10} {'saved':>10} {'seconds':>10}"]
+        for stage in self.stages.values():
+            lines.append(f"{stage.name:<12} {stage.calls:>8} {stage.hits:>8} {stage.tokens:>10} {stage.saved:>10} {stage.seconds:>10.2f}")
+        total_calls = sum(stage.calls for stage in self.stages.values())
+        total_hits = sum(stage.hits for stage in self.stages.values())
+        total_tokens = sum(stage.tokens for stage in self.stages.values())
+        total_saved = sum(stage.saved for stage in self.stages.values())
+        total_seconds = sum(stage.seconds for stage in self.stages.values())
+        lines.append(f"{'total':<12} {total_calls:>8} {total_hits:>8} {total_tokens:>10} {total_saved:>10} {total_seconds:>10.2f}")
+        return "\n".join(lines)
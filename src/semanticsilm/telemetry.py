@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+TRACE_DIR = "../../traces"
+OTLP_SUFFIX = ".otlp.json"
+# Set to 1 to log full prompts, responses, triplets and link decisions
+VERBOSE_ENV = "SEMANTICSILM_VERBOSE"
+# jsonl (default) or otlp
+TRACE_FORMAT_ENV = "SEMANTICSILM_TRACE_FORMAT"
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: str
+    parent_id: str = None
+    start_ns: int = 0
+    end_ns: int = 0
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def seconds(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+class Tracer:
+    """Collects timed, nested spans and named counters for one run.
+
+    Spans nest through a context variable, so asyncio tasks started inside a
+    span (the concurrent LLM calls) are recorded as its children.
+    """
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.counters = defaultdict(float)
+        self._current = ContextVar(f"span-{self.trace_id}", default=None)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = self._current.get()
+        span = Span(name, os.urandom(8).hex(), parent.span_id if parent else None, attributes=attributes)
+        token = self._current.set(span)
+        span.start_ns = time.time_ns()
+        try:
+            yield span
+        except BaseException as error:
+            span.set(error=repr(error))
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            self._current.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def trim(self, max_spans: int):
+        """Keeps only the newest max_spans spans, so a long-running server doesn't grow without bound."""
+        with self._lock:
+            if len(self.spans) > max_spans:
+                del self.spans[:len(self.spans) - max_spans]
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+            self.counters = defaultdict(float)
+
+    def summary(self) -> str:
+        import numpy as np
+        durations = defaultdict(list)
+        for span in self.spans:
+            durations[span.name].append(span.seconds)
+        lines = [f"{'span':<28} {'count':>7} {'total s':>9} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for name, seconds in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            ms = np.array(seconds) * 1000
+            lines.append(f"{name:<28} {len(ms):>7} {ms.sum() / 1000:>9.2f} {ms.mean():>9.1f} "
+                         f"{np.percentile(ms, 95):>9.1f} {ms.max():>9.1f}")
+        if self.counters:
+            lines.append("")
+            lines.append(f"{'counter':<28} {'value':>12}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:<28} {value:>12g}")
+        return "\n".join(lines)
+
+    def export(self, path: str):
+        """Writes the spans and counters as JSONL, or as OTLP/JSON if path ends in .otlp.json."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            if path.endswith(OTLP_SUFFIX):
+                json.dump(self.otlp(), file, ensure_ascii=False)
+                return
+            for span in self.spans:
+                record = {"type": "span", "trace_id": self.trace_id, "span_id": span.span_id,
+                          "parent_id": span.parent_id, "name": span.name, "start_ns": span.start_ns,
+                          "end_ns": span.end_ns, "seconds": span.seconds, "attributes": span.attributes}
+                file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            for name, value in sorted(self.counters.items()):
+                file.write(json.dumps({"type": "counter", "name": name, "value": value}) + "\n")
+        logger.info(f"Wrote {len(self.spans)} spans to {path}")
+
+    def otlp(self) -> dict:
+        """The trace in the OTLP/JSON layout an OpenTelemetry collector's file receiver reads."""
+        spans = [{
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": otlp_attributes(span.attributes),
+        } for span in self.spans]
+        end_ns = str(time.time_ns())
+        metrics = [{
+            "name": name,
+            "sum": {"dataPoints": [{"asDouble": value, "timeUnixNano": end_ns}],
+                    "aggregationTemporality": 2, "isMonotonic": True},
+        } for name, value in sorted(self.counters.items())]
+        resource = {"attributes": otlp_attributes({"service.name": "semanticsilm"})}
+        scope = {"name": "semanticsilm"}
+        return {
+            "resourceSpans": [{"resource": resource, "scopeSpans": [{"scope": scope, "spans": spans}]}],
+            "resourceMetrics": [{"resource": resource, "scopeMetrics": [{"scope": scope, "metrics": metrics}]}],
+        }
+
+def otlp_attributes(attributes: dict):
+    values = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        values.append({"key": key, "value": typed})
+    return values
+
+# The process-wide tracer that the build, the REPL and the helpers record into
+tracer = Tracer()
+
+def span(name: str, **attributes):
+    return tracer.span(name, **attributes)
+
+def count(name: str, value: float = 1):
+    tracer.count(name, value)
+
+def traced(name: str):
+    """Decorator recording every call of the function as a span."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def verbose() -> bool:
+    return os.environ.get(VERBOSE_ENV, "") not in ("", "0")
+
+def configure_logging(*loggers: str):
+    """Turns on payload logging (at DEBUG) for the given loggers when SEMANTICSILM_VERBOSE is set."""
+    if verbose():
+        for name in loggers:
+            logging.getLogger(name).setLevel(logging.DEBUG)
+
+def trace_path(run_name: str) -> str:
+    suffix = OTLP_SUFFIX if os.environ.get(TRACE_FORMAT_ENV, "jsonl").lower() == "otlp" else ".jsonl"
+    return os.path.join(TRACE_DIR, f"{run_name}{suffix}")
@@ -1,18 +1,210 @@
 import os
+import random
+import numpy as np
 from pyvis.network import Network
-from llama_index.core import load_index_from_storage
-from llama_index.core.storage.index_store import SimpleIndexStore
-from llama_index.core.graph_stores import SimpleGraphStore
-from llama_index.core import StorageContext
+from semanticsilm.graph_store import graph_items, load_graph_store
+from semanticsilm.layout import compute_layout
+from semanticsilm.telemetry import traced
 import networkx as nx
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 from community import community_louvain
 
+# Graphs above either size are drawn in large-graph mode
+LARGE_GRAPH_NODES = 500
+LARGE_GRAPH_EDGES = 2_000
+MAX_RENDER_NODES = 2_000
+MAX_RENDER_EDGES = 10_000
+MAX_LABELS = 100
+MAX_EXPANDABLE_COMMUNITIES = 30
 
-def visualize_networkx(g, output_file='silmarillion_graph_networkx.png'):
+
+def is_large_graph(g, large=None):
+    if large is None:
+        return g.number_of_nodes() > LARGE_GRAPH_NODES or g.number_of_edges() > LARGE_GRAPH_EDGES
+    return large
+
+def sample_graph(g, max_nodes=MAX_RENDER_NODES, max_edges=MAX_RENDER_EDGES, seed=0):
+    """Subgraph of at most max_nodes nodes and max_edges edges.
+
+    The highest-degree half of the node budget is always kept, so hubs stay
+    in the picture; the rest of the nodes, and the edges, are sampled.
+    """
+    rng = random.Random(seed)
+    if g.number_of_nodes() > max_nodes:
+        by_degree = sorted(g.nodes(), key=g.degree, reverse=True)
+        hubs = by_degree[:max_nodes // 2]
+        sampled = rng.sample(by_degree[max_nodes // 2:], max_nodes - len(hubs))
+        g = g.subgraph(hubs + sampled)
+    if g.number_of_edges() > max_edges:
+        sampled_g = g.__class__()
+        sampled_g.add_nodes_from(g.nodes(data=True))
+        sampled_g.add_edges_from(rng.sample(list(g.edges(data=True)), max_edges))
+        g = sampled_g
+    return g
+
+def labelled_nodes(g, max_labels=MAX_LABELS):
+    return set(sorted(g.nodes(), key=g.degree, reverse=True)[:max_labels])
+
+@traced("communities")
+def community_partition(g):
+    return community_louvain.best_partition(g.to_undirected() if g.is_directed() else g, random_state=0)
+
+def aggregate_communities(g, pos, partition):
+    """One super-node per community, at its members' centroid, with edges weighted by crossing edges."""
+    members = {}
+    for node in g.nodes():
+        members.setdefault(partition[node], []).append(node)
+    super_g = nx.Graph()
+    super_pos = {}
+    for community, nodes in members.items():
+        hub = max(nodes, key=g.degree)
+        super_g.add_node(community, size=len(nodes), hub=hub, members=nodes)
+        super_pos[community] = np.mean([pos[node] for node in nodes], axis=0)
+    for u, v in g.edges():
+        cu, cv = partition[u], partition[v]
+        if cu != cv:
+            weight = super_g.get_edge_data(cu, cv, {"weight": 0})["weight"]
+            super_g.add_edge(cu, cv, weight=weight + 1)
+    return super_g, super_pos
+
+def edge_coordinates(g, pos):
+    edge_x = []
+    edge_y = []
+    for u, v in g.edges():
+        x0, y0 = pos[u]
+        x1, y1 = pos[v]
+        edge_x.extend([x0, x1, None])
+        edge_y.extend([y0, y1, None])
+    return edge_x, edge_y
+
+def graph_layout(title):
+    return go.Layout(
+        title=title,
+        titlefont_size=16,
+        showlegend=False,
+        hovermode='closest',
+        margin=dict(b=20,l=5,r=5,t=40),
+        xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+        yaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+    )
+
+def large_graph_networkx(g, pos, output_file):
+    view = sample_graph(g)
+    labels = labelled_nodes(view)
+    plt.figure(figsize=(20,20))
+    degrees = np.array([view.degree(node) for node in view.nodes()], dtype=float)
+    nx.draw_networkx_edges(view, pos, edge_color='gray', width=0.3, alpha=0.3, arrows=False)
+    nx.draw_networkx_nodes(view, pos, node_color='lightblue', node_size=10 + 200 * degrees / max(degrees.max(), 1))
+    nx.draw_networkx_labels(view, pos, labels={node: node for node in labels}, font_size=6)
+    plt.title(f"Silmarillion Knowledge Graph ({view.number_of_nodes()} of {g.number_of_nodes()} nodes)", fontsize=20)
+    plt.axis('off')
+    plt.tight_layout()
+    plt.savefig(output_file, dpi=150, bbox_inches='tight')
+    plt.close()
+    print(f"NetworkX graph saved to {output_file}")
+
+def large_graph_plotly(g, pos, output_file, partition=None):
+    """Community overview with a dropdown that expands the largest communities."""
+    partition = partition if partition is not None else community_partition(g)
+    super_g, super_pos = aggregate_communities(g, pos, partition)
+    largest = sorted(super_g.nodes(), key=lambda c: super_g.nodes[c]['size'], reverse=True)
+    super_g = super_g.subgraph(largest[:MAX_RENDER_NODES])
+    sizes = np.array([super_g.nodes[c]['size'] for c in super_g.nodes()], dtype=float)
+    labelled = set(largest[:MAX_LABELS])
+
+    edge_x, edge_y = edge_coordinates(sample_graph(super_g), super_pos)
+    traces = [
+        go.Scattergl(x=edge_x, y=edge_y, line=dict(width=0.5, color='#888'), hoverinfo='none', mode='lines'),
+        go.Scattergl(
+            x=[super_pos[c][0] for c in super_g.nodes()],
+            y=[super_pos[c][1] for c in super_g.nodes()],
+            mode='markers+text',
+            hoverinfo='text',
+            text=[super_g.nodes[c]['hub'] if c in labelled else '' for c in super_g.nodes()],
+            hovertext=[f"{super_g.nodes[c]['hub']} and {super_g.nodes[c]['size'] - 1} others" for c in super_g.nodes()],
+            textposition="top center",
+            marker=dict(size=6 + 30 * np.sqrt(sizes / sizes.max()), color=list(super_g.nodes()),
+                        colorscale='Viridis'),
+        ),
+    ]
+
+    largest = largest[:MAX_EXPANDABLE_COMMUNITIES]
+    buttons = [dict(label="All communities", method="update",
+                    args=[{"visible": [True, True] + [False] * (2 * len(largest))}])]
+    for i, community in enumerate(largest):
+        members = sample_graph(g.subgraph(super_g.nodes[community]['members']),
+                               MAX_RENDER_NODES // 4, MAX_RENDER_EDGES // 4)
+        labels = labelled_nodes(members)
+        member_x, member_y = edge_coordinates(members, pos)
+        traces.append(go.Scattergl(x=member_x, y=member_y, line=dict(width=0.5, color='#888'),
+                                   hoverinfo='none', mode='lines', visible=False))
+        traces.append(go.Scattergl(
+            x=[pos[node][0] for node in members.nodes()],
+            y=[pos[node][1] for node in members.nodes()],
+            mode='markers+text',
+            hoverinfo='text',
+            text=[node if node in labels else '' for node in members.nodes()],
+            hovertext=list(members.nodes()),
+            textposition="top center",
+            marker=dict(size=8),
+            visible=False,
+        ))
+        visible = [False] * len(traces)
+        visible[-2:] = [True, True]
+        buttons.append(dict(label=f"{super_g.nodes[community]['hub']} ({super_g.nodes[community]['size']})",
+                            method="update", args=[{"visible": visible + [False] * (2 * (len(largest) - i - 1))}]))
+
+    fig = go.Figure(data=traces, layout=graph_layout(
+        f"Silmarillion Knowledge Graph ({super_g.number_of_nodes()} communities, {g.number_of_nodes()} nodes)"
+    ))
+    fig.update_layout(updatemenus=[dict(buttons=buttons, direction="down", x=0.01, xanchor="left", y=1.1, yanchor="top")])
+    fig.write_html(output_file)
+    print(f"Plotly graph saved to {output_file}")
+
+def large_graph_interactive(G, pos, output_file, partition=None):
+    partition = partition if partition is not None else community_partition(G)
+    view = sample_graph(G)
+    labels = labelled_nodes(view)
+    edge_x, edge_y = edge_coordinates(view, pos)
+    edge_trace = go.Scattergl(x=edge_x, y=edge_y, line=dict(width=0.5, color='#888'), hoverinfo='none', mode='lines')
+    node_trace = go.Scattergl(
+        x=[pos[node][0] for node in view.nodes()],
+        y=[pos[node][1] for node in view.nodes()],
+        mode='markers+text',
+        hoverinfo='text',
+        text=[node if node in labels else '' for node in view.nodes()],
+        hovertext=[f"{node}<br># of connections: {G.degree(node)}" for node in view.nodes()],
+        textposition="top center",
+        marker=dict(size=8, color=[partition[node] for node in view.nodes()], colorscale='Viridis', line_width=1),
+    )
+    fig = go.Figure(data=[edge_trace, node_trace], layout=graph_layout(
+        f"Interactive Silmarillion Knowledge Graph ({view.number_of_nodes()} of {G.number_of_nodes()} nodes)"
+    ))
+    fig.update_layout(updatemenus=[dict(
+        type="buttons",
+        direction="left",
+        buttons=[
+            dict(args=[{"visible": [True, True]}], label="Show All", method="update"),
+            dict(args=[{"visible": [True, "legendonly"]}], label="Hide Nodes", method="update"),
+            dict(args=[{"visible": ["legendonly", True]}], label="Hide Edges", method="update"),
+        ],
+        pad={"r": 10, "t": 10},
+        showactive=True,
+        x=0.11,
+        xanchor="left",
+        y=1.1,
+        yanchor="top",
+    )])
+    fig.write_html(output_file)
+    print(f"Interactive graph saved to {output_file}")
+
+@traced("render.networkx")
+def visualize_networkx(g, output_file='silmarillion_graph_networkx.png', pos=None, large=None):
+    pos = pos if pos is not None else compute_layout(g)
+    if is_large_graph(g, large):
+        return large_graph_networkx(g, pos, output_file)
     plt.figure(figsize=(20,20))
-    pos = nx.spring_layout(g, k=0.5, iterations=50)
     nx.draw(g, pos, with_labels=True, node_color='lightblue', 
             node_size=1500, font_size=8, font_weight='bold', 
             edge_color='gray', width=1, alpha=0.7)
@@ -27,8 +219,11 @@ def visualize_networkx(g, output_file='silmarillion_graph_networkx.png'):
     plt.close()
     print(f"NetworkX graph saved to {output_file}")
 
-def visualize_plotly(g, output_file='silmarillion_graph_plotly.html'):
-    pos = nx.spring_layout(g)
+@traced("render.plotly")
+def visualize_plotly(g, output_file='silmarillion_graph_plotly.html', pos=None, large=None, partition=None):
+    pos = pos if pos is not None else compute_layout(g)
+    if is_large_graph(g, large):
+        return large_graph_plotly(g, pos, output_file, partition)
 
     edge_x = []
     edge_y = []
@@ -89,18 +284,22 @@ def visualize_plotly(g, output_file='silmarillion_graph_plotly.html'):
     fig.write_html(output_file)
     print(f"Plotly graph saved to {output_file}")
 
-def create_interactive_graph(G, output_file='interactive_silmarillion_graph.html'):
+@traced("render.interactive")
+def create_interactive_graph(G, output_file='interactive_silmarillion_graph.html', pos=None, large=None,
+                             partition=None):
     # Convert to undirected graph if it's directed
     if isinstance(G, nx.DiGraph):
         G_undirected = G.to_undirected()
     else:
         G_undirected = G
 
-    pos = nx.spring_layout(G, k=0.5, iterations=50)
+    pos = pos if pos is not None else compute_layout(G)
+    if is_large_graph(G, large):
+        return large_graph_interactive(G, pos, output_file, partition)
 
-    partition = community_louvain.best_partition(G_undirected)
+    partition = partition if partition is not None else community_louvain.best_partition(G_undirected)
     
-    node_x, node_y = zip(*pos.values())
+    node_x, node_y = zip(*(pos[node] for node in G.nodes()))
     node_trace = go.Scatter(
         x=node_x, y=node_y,
         mode='markers+text',
@@ -128,7 +327,7 @@ def create_interactive_graph(G, output_file='interactive_silmarillion_graph.html
         node_adjacencies.append(len(adjacencies))
         node_text.append(f"{node}<br># of connections: {len(adjacencies)}")
     
-    node_trace.marker.color = list(partition.values())
+    node_trace.marker.color = [partition[node] for node in G.nodes()]
     node_trace.hovertext = node_text
 
     edge_x = []
@@ -197,20 +396,18 @@ def create_interactive_graph(G, output_file='interactive_silmarillion_graph.html
     print(f"Interactive graph saved to {output_file}")
 
 def main():
-    storage_context = StorageContext.from_defaults(
-        graph_store=SimpleGraphStore.from_persist_dir(f"../../index/08_18_2024_10_32"),
-        index_store=SimpleIndexStore.from_persist_dir(f"../../index/08_18_2024_10_32")
-    )
-    graph_store = storage_context.graph_store
+    graph_store = load_graph_store(f"../../index/08_18_2024_10_32")
     
     g = nx.DiGraph()
-    for subject, relations in graph_store._data.graph_dict.items():
+    for subject, relations in graph_items(graph_store):
         for relation, object in relations:
             g.add_edge(subject, object, relationship=relation)
     
-    visualize_networkx(g)
-    visualize_plotly(g)
-    create_interactive_graph(g)
+    pos = compute_layout(g)
+    partition = community_partition(g)
+    visualize_networkx(g, pos=pos)
+    visualize_plotly(g, pos=pos, partition=partition)
+    create_interactive_graph(g, pos=pos, partition=partition)
 
 if __name__ == "__main__":
     main()
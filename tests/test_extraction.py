@@ -0,0 +1,44 @@
+from llama_index.core import Settings
+from semanticsilm import main
+from semanticsilm.extraction import TripletStreamParser
+from semanticsilm.fake_llm import FakeLLM
+
+CHUNKS = [
+    ("Fëanor crafted the Silmarils in Valinor.", None),
+    ("Morgoth fled to Angband with the jewels.", None),
+]
+
+
+def test_malformed_list_is_not_closed():
+    parser = TripletStreamParser()
+    parser.feed('{"c0": [1, 2, 3], "c1": [], "c2": [["Fëanor", "crafted", "Silmarils"], 4]}')
+    assert parser.closed == {"c1", "c2"}
+    assert parser.results["c2"] == [("Fëanor", "crafted", "Silmarils")]
+
+def use_llm(answer):
+    prompts = []
+
+    def respond(prompt):
+        prompts.append(prompt)
+        return answer
+
+    Settings.llm = FakeLLM(respond=respond)
+    return prompts
+
+def test_line_format_batch_answer_is_used_without_retries():
+    prompts = use_llm("1. (Fëanor, crafted, Silmarils)\n2. (Morgoth, fled to, Angband)")
+    results = main.extract_batch(CHUNKS)
+    assert len(prompts) == 1
+    assert results == [[("Fëanor", "crafted", "Silmarils")], [("Morgoth", "fled to", "Angband")]]
+
+def test_line_format_batch_answer_with_headings():
+    prompts = use_llm("Chunk c0:\n1. (Fëanor, crafted, Silmarils)\n\nChunk c1:\n1. (Morgoth, stole, Silmarils)")
+    results = main.extract_batch(CHUNKS)
+    assert len(prompts) == 1
+    assert results == [[("Fëanor", "crafted", "Silmarils")], [("Morgoth", "stole", "Silmarils")]]
+
+def test_chunk_with_only_malformed_triplets_is_retried():
+    prompts = use_llm('{"c0": [["Fëanor", "crafted", "Silmarils"]], "c1": [[1, 2]]}')
+    main.extract_batch(CHUNKS)
+    assert len(prompts) == 2
+    assert "Chunk c0" not in prompts[1] and "Morgoth fled" in prompts[1]
@@ -0,0 +1,57 @@
+import os
+import pytest
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+from semanticsilm import main
+from semanticsilm.fake_llm import FakeLLM, synthetic_response
+from semanticsilm.manifest import changed_documents, save_manifest
+from semanticsilm.persistence import save_index
+from semanticsilm.preprocess import preprocess
+
+CHAPTERS = [
+    "OF MELKOR\n\nMelkor rebelled against Ilúvatar, and the Valar opposed Melkor in Arda.",
+    "OF THE SILMARILS\n\nFëanor crafted the Silmarils, and Morgoth stole them from Fëanor.",
+    "OF BEREN AND LUTHIEN\n\nLúthien and Beren took a Silmaril from the crown of Morgoth.",
+]
+
+
+@pytest.fixture
+def fake_models(tmp_path, monkeypatch):
+    prompts = []
+
+    def respond(prompt):
+        prompts.append(prompt)
+        return synthetic_response(prompt, main.IMPORTANT_ENTITIES, main.IMPORTANT_RELATIONSHIPS)
+
+    Settings.llm = FakeLLM(respond=respond)
+    Settings.embed_model = MockEmbedding(embed_dim=8)
+    Settings.chunk_size = 1024
+    # Relative, like the real DATA_DIR, so the paths in doc ids are built the same way
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("source")
+    with open(os.path.join("source", "raw.txt"), 'w', encoding='utf-8') as file:
+        file.write("".join(f"\n\nCHAPTER {i}\n\n{chapter}" for i, chapter in enumerate(CHAPTERS, 1)))
+    monkeypatch.setattr(main, "DATA_DIR", "data")
+    return prompts
+
+def test_preprocessed_build_then_one_edit_reextracts_only_that_file(fake_models):
+    preprocess([os.path.join("source", "raw.txt")], "data", workers=1)
+    documents, nodes = main.load_documents()
+    assert nodes is not None
+    manifest = {}
+    index = main.create_silmarillion_kg(documents, nodes=nodes, manifest=manifest, prefilter=False, batch_size=1)
+    save_index(index, "index")
+    save_manifest(manifest, "index")
+    assert len(fake_models) == len(CHAPTERS)
+
+    with open(os.path.join("data", "chapter2.txt"), 'a', encoding='utf-8') as file:
+        file.write(" Fëanor swore an oath against Morgoth.")
+    fake_models.clear()
+    # The edit makes the chunk manifest stale, so the documents are read afresh
+    documents, nodes = main.load_documents()
+    assert nodes is None
+    assert [os.path.basename(doc_id) for doc_id in changed_documents(manifest, documents)] == ["chapter2.txt"]
+
+    main.update_silmarillion_kg(documents, "index", prefilter=False, batch_size=1)
+    assert len(fake_models) == 1
+    assert "Fëanor swore an oath" in fake_models[0]
@@ -0,0 +1,15 @@
+from types import SimpleNamespace
+from semanticsilm.query_cache import QueryCache
+
+EMBEDDINGS = {"Who is Melkor?": [1.0, 0.0], "Who was Melkor?": [0.9, 0.1]}
+
+
+def test_similarity_threshold_can_be_overridden_per_lookup(tmp_path):
+    cache = QueryCache(str(tmp_path), embed_model=SimpleNamespace(get_text_embedding=EMBEDDINGS.get))
+    cache.put("Who is Melkor?", "The first Dark Lord.", EMBEDDINGS["Who is Melkor?"])
+
+    # The two embeddings are about 0.994 cosine-similar
+    assert cache.lookup("Who was Melkor?")[0] == "The first Dark Lord."
+    assert cache.lookup("Who was Melkor?", similarity_threshold=0.999)[0] is None
+    assert QueryCache(str(tmp_path), embed_model=cache.embed_model,
+                      similarity_threshold=0.999).lookup("Who was Melkor?")[0] is None
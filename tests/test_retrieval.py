@@ -0,0 +1,29 @@
+from llama_index.core import KnowledgeGraphIndex, Settings
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode
+from semanticsilm.analytics import compute_analytics
+from semanticsilm.fake_llm import FakeLLM
+from semanticsilm.retrieval import build_query_engine
+
+
+def melkor_index(num_triplets: int) -> KnowledgeGraphIndex:
+    Settings.llm = FakeLLM(respond=lambda prompt: "KEYWORDS: Melkor")
+    Settings.embed_model = MockEmbedding(embed_dim=8)
+    index = KnowledgeGraphIndex([], include_embeddings=True)
+    node = TextNode(text="Melkor fought everyone.")
+    for i in range(num_triplets):
+        index.upsert_triplet_and_node(("Melkor", "fought", f"Foe {i}"), node, include_embeddings=True)
+    return index
+
+def kg_rel_texts(engine, query: str):
+    nodes = engine.retriever.retrieve(query)
+    return next(node.metadata["kg_rel_texts"] for node in nodes if "kg_rel_texts" in node.metadata)
+
+def test_ranking_keeps_as_many_triplets_as_the_stock_retriever():
+    index = melkor_index(40)
+    analytics = compute_analytics(index.graph_store)
+    stock = kg_rel_texts(build_query_engine(index), "Who did Melkor fight?")
+    ranked = kg_rel_texts(build_query_engine(index, analytics=analytics), "Who did Melkor fight?")
+    assert len(ranked) == len(stock) == 30
+    assert len(kg_rel_texts(build_query_engine(index, analytics=analytics, ranked_triplets=5),
+                            "Who did Melkor fight?")) == 5
@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+from aiohttp.test_utils import TestClient, TestServer
+from semanticsilm.query_cache import QueryCache
+from semanticsilm.server import QueryService, create_app
+from semanticsilm.telemetry import count
+
+
+def test_metric_names_are_unique_and_typed(tmp_path):
+    service = QueryService(str(tmp_path))
+    service.runner = SimpleNamespace(query_cache=QueryCache(str(tmp_path)))
+    service.runner.query_cache.lookup("Who is Melkor?")
+    count("query.cache_misses")
+    service.latencies.extend([10.0, 20.0])
+
+    lines = service.metrics().splitlines()
+    typed = [line.split()[2] for line in lines if line.startswith("# TYPE ")]
+    samples = [line.split()[0] for line in lines if not line.startswith("#")]
+    assert len(samples) == len(set(samples))
+    assert len(typed) == len(set(typed))
+    assert {sample.split("{")[0] for sample in samples} == set(typed)
+    assert "semanticsilm_query_cache_misses" in samples
+    assert "semanticsilm_tracer_query_cache_misses" in samples
+
+def test_query_must_be_a_non_empty_string(tmp_path):
+    async def statuses():
+        async with TestClient(TestServer(create_app(QueryService(str(tmp_path))))) as client:
+            return [(await client.post("/query", json=body)).status
+                    for body in [{"query": 5}, {"query": ["Melkor"]}, {"query": "   "}, {}]]
+
+    assert asyncio.run(statuses()) == [400, 400, 400, 400]
+
+def test_query_settings_reach_the_runner(tmp_path):
+    service = QueryService(str(tmp_path))
+    service.runner = SimpleNamespace(index_folder=str(tmp_path), query_cache=None,
+                                     answer=lambda query, **query_settings: {**query_settings, "latency_ms": 1.0})
+
+    async def answers():
+        async with TestClient(TestServer(create_app(service))) as client:
+            replies = []
+            for body in [{"query": "Who is Melkor?", "similarity_threshold": 0.9},
+                         {"query": "Who is Melkor?", "similarity_threshold": 1.5},
+                         {"query": "Who is Melkor?", "similarity_threshold": "close"}]:
+                reply = await client.post("/query", json=body)
+                replies.append((await reply.json())["similarity_threshold"] if reply.status == 200 else reply.status)
+            return replies
+
+    assert asyncio.run(answers()) == [0.9, 400, 400]